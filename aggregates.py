@@ -0,0 +1,235 @@
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import emoji_stats
+import links
+import token_stats
+
+
+# ──────────────────────────────────────────────
+#  PER-USER AGGREGATE CUBE
+# ──────────────────────────────────────────────
+# Built once per upload and persisted next to the chat as <file_id>.cube.parquet:
+#   activity: message counts by user x date x hour (calendar columns carried along)
+#   totals:   per-user messages / words / media / links / sentiment counts
+#   tokens:   per-user token counts without stop words (token_stats), stored alongside
+#             as <file_id>.tokens.parquet
+#   emojis:   per-user emoji counts (emoji_stats), stored as <file_id>.emojis.parquet
+# Every dashboard chart below is answered by slicing these small tables, so switching
+# users never rescans the messages. Return values match the dashboard helpers they replaced.
+CUBE_VERSION = 3
+METADATA_KEY = b"chat_cube"
+ACTIVITY_KEYS = ['user', 'only_date', 'hour', 'year', 'month_num', 'month', 'day_name', 'period']
+MEDIA_MESSAGE = '<Media omitted>\n'
+
+
+def _cube_path(folder, file_id):
+    return os.path.join(folder, f"{file_id}.cube.parquet")
+
+
+# Long-form side tables stored next to the cube, one Parquet file each (name -> key column)
+SIDE_TABLES = {'tokens': 'token', 'emojis': 'emoji'}
+
+
+def _side_path(folder, file_id, name):
+    return os.path.join(folder, f"{file_id}.{name}.parquet")
+
+
+def build_cube(df):
+    """Aggregate a processed chat into the activity table and per-user totals."""
+    # date -> calendar columns and hour -> period are functional dependencies,
+    # so grouping on them as well only carries them along into the cube
+    activity = df.groupby(ACTIVITY_KEYS, observed=True).size().reset_index(name='count')
+
+    # One tokenization pass gives the word totals and the stop-word-free token table
+    tables = token_stats.build_tables(df)
+
+    messages = df['message']
+    per_row = pd.DataFrame({
+        'user': df['user'],
+        'messages': 1,
+        'media': (messages == MEDIA_MESSAGE).astype(int),
+        'links': df['links'] if 'links' in df.columns else links.count_links(messages),
+    })
+    if 'sentiment_category' in df.columns:
+        for category in ['Positive', 'Negative', 'Neutral']:
+            per_row[category] = (df['sentiment_category'] == category).astype(int)
+    totals = per_row.groupby('user', observed=True).sum()
+    totals.insert(1, 'words', tables['words'].reindex(totals.index.astype(str), fill_value=0).to_numpy())
+    return {'activity': activity, 'totals': totals, 'tokens': tables['tokens'],
+            'emojis': emoji_stats.build_table(df)}
+
+
+def _merge_ranked(old, tail, key):
+    """Merge two long-form count tables (token_stats / emoji_stats) as if the tail's
+    messages came after the old ones: counts add up, and keys first seen in the tail
+    rank after every existing key, overall and per user."""
+    pair = ['user', key]
+    old = old.assign(user=old['user'].astype(str))
+    tail = tail.assign(user=tail['user'].astype(str))
+
+    merged = old.merge(tail[pair + ['count']], on=pair, how='left', suffixes=('', '_tail'))
+    merged['count'] = merged['count'] + merged.pop('count_tail').fillna(0).astype('int64')
+
+    fresh = tail.merge(old[pair], on=pair, how='left', indicator=True)
+    fresh = fresh[fresh.pop('_merge') == 'left_only'].sort_values('user_rank', kind='stable')
+    next_user_rank = old.groupby('user')['user_rank'].max() + 1
+    fresh['user_rank'] = (fresh['user'].map(next_user_rank).fillna(0).astype('int64')
+                          + fresh.groupby('user').cumcount())
+    ranks = old.groupby(key, sort=False)['rank'].first()
+    new_keys = fresh[~fresh[key].isin(ranks.index)].sort_values('rank', kind='stable')[key].unique()
+    start = int(ranks.max()) + 1 if len(ranks) else 0
+    ranks = pd.concat([ranks, pd.Series(range(start, start + len(new_keys)), index=new_keys, dtype='int64')])
+    fresh['rank'] = fresh[key].map(ranks)
+
+    table = pd.concat([merged, fresh[merged.columns]], ignore_index=True)
+    table = table.astype({'count': 'int64', 'user_rank': 'int64', 'rank': 'int64'})
+    table['user'] = table['user'].astype('category')
+    return table
+
+
+def merge_cube(cube, tail_cube):
+    """Cube of a chat extended by new messages, from the stored cube and a cube of just
+    the new messages; equivalent to build_cube() over the whole chat."""
+    activity = pd.concat([cube['activity'], tail_cube['activity']], ignore_index=True)
+    activity['user'] = activity['user'].astype(str).astype('category')
+    activity = activity.groupby(ACTIVITY_KEYS, observed=True)['count'].sum().reset_index()
+
+    old_totals = cube['totals'].set_axis(cube['totals'].index.astype(str))
+    tail_totals = tail_cube['totals'].set_axis(tail_cube['totals'].index.astype(str))
+    totals = old_totals.add(tail_totals, fill_value=0).fillna(0).astype('int64')
+    totals.index.name = 'user'
+
+    merged = {'activity': activity, 'totals': totals}
+    for name, key in SIDE_TABLES.items():
+        merged[name] = _merge_ranked(cube[name], tail_cube[name], key)
+    return merged
+
+
+def save_cube(cube, folder, file_id):
+    path = _cube_path(folder, file_id)
+    meta = {
+        "cube_version": CUBE_VERSION,
+        "totals": cube['totals'].reset_index().to_dict(orient='list'),
+    }
+    table = pa.Table.from_pandas(cube['activity'], preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), METADATA_KEY: json.dumps(meta).encode()})
+    # Side tables first: a cube file on disk implies they are complete
+    for name in SIDE_TABLES:
+        side_path = _side_path(folder, file_id, name)
+        pq.write_table(pa.Table.from_pandas(cube[name], preserve_index=False), side_path + ".tmp")
+        os.replace(side_path + ".tmp", side_path)
+    tmp_path = path + ".tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_cube(folder, file_id):
+    """Return the persisted cube, or None if it is missing or from an older version."""
+    path = _cube_path(folder, file_id)
+    if not os.path.exists(path):
+        return None
+    try:
+        table = pq.read_table(path, memory_map=True)
+        meta = json.loads((table.schema.metadata or {}).get(METADATA_KEY, b"{}"))
+        if meta.get("cube_version") != CUBE_VERSION:
+            print(f"[Cube] STALE cube for {file_id} (v{meta.get('cube_version')} != v{CUBE_VERSION})")
+            return None
+        totals = pd.DataFrame(meta['totals']).set_index('user')
+        cube = {'activity': table.to_pandas(), 'totals': totals}
+        for name in SIDE_TABLES:
+            cube[name] = pq.read_table(_side_path(folder, file_id, name), memory_map=True).to_pandas()
+        return cube
+    except Exception as e:
+        print(f"[Cube] Failed to read {path}: {e}")
+        return None
+
+
+def _activity(selected_user, cube):
+    activity = cube['activity']
+    if selected_user != 'Overall':
+        activity = activity[activity['user'] == selected_user]
+    return activity
+
+
+def _totals(selected_user, cube):
+    totals = cube['totals']
+    if selected_user != 'Overall':
+        return totals.loc[[selected_user]] if selected_user in totals.index else totals.iloc[0:0]
+    return totals
+
+
+def fetch_stats(selected_user, cube):
+    totals = _totals(selected_user, cube)
+    return (int(totals['messages'].sum()), int(totals['words'].sum()),
+            int(totals['media'].sum()), int(totals['links'].sum()))
+
+
+def most_busy_users(cube):
+    counts = cube['totals']['messages']
+    counts = counts[counts > 0].sort_values(ascending=False, kind='stable').rename('count')
+    counts.index.name = 'user'
+    x = counts.head()
+    df = round((counts / counts.sum()) * 100, 2).reset_index().rename(
+        columns={'index': 'name', 'user': 'percent'})
+    return x, df
+
+
+def monthly_timeline(selected_user, cube):
+    activity = _activity(selected_user, cube)
+    timeline = activity.groupby(['year', 'month_num', 'month'], observed=True)['count'].sum().reset_index()
+    timeline = timeline.rename(columns={'count': 'message'})
+    timeline['time'] = timeline['month'].astype(str) + "-" + timeline['year'].astype(str)
+    return timeline
+
+
+def daily_timeline(selected_user, cube):
+    activity = _activity(selected_user, cube)
+    return activity.groupby('only_date')['count'].sum().reset_index().rename(columns={'count': 'message'})
+
+
+def _ranked_counts(activity, column):
+    counts = activity.groupby(column, observed=True)['count'].sum()
+    counts = counts[counts > 0].sort_values(ascending=False, kind='stable')
+    counts.name = 'count'
+    return counts
+
+
+def week_activity_map(selected_user, cube):
+    return _ranked_counts(_activity(selected_user, cube), 'day_name')
+
+
+def month_activity_map(selected_user, cube):
+    return _ranked_counts(_activity(selected_user, cube), 'month')
+
+
+def activity_heatmap(selected_user, cube):
+    activity = _activity(selected_user, cube)
+    return activity.pivot_table(index='day_name', columns='period', values='count',
+                                aggfunc='sum', observed=True).fillna(0)
+
+
+def sentiment_counts(selected_user, cube):
+    """Same shape as helper.sentiment_analysis(...)[0]: columns category/count, largest first."""
+    totals = _totals(selected_user, cube)
+    categories = [c for c in ['Positive', 'Negative', 'Neutral'] if c in totals.columns]
+    counts = totals[categories].sum()
+    counts = counts[counts > 0].sort_values(ascending=False, kind='stable')
+    return pd.DataFrame({'category': counts.index, 'count': counts.values.astype(int)})
+
+
+def most_common_words(selected_user, cube):
+    return token_stats.most_common_words(selected_user, cube['tokens'])
+
+
+def wordcloud_frequencies(selected_user, cube):
+    return token_stats.wordcloud_frequencies(selected_user, cube['tokens'])
+
+
+def emoji_helper(selected_user, cube):
+    return emoji_stats.emoji_counts(selected_user, cube['emojis'])
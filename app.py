@@ -1,12 +1,21 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, make_response, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, make_response, jsonify, Response, copy_current_request_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 load_dotenv()
 
 import os
 import secrets
+import time
+import numpy as np
 import pandas as pd
 import preprocessor, helper
+import chat_store, aggregates
+import charts
+import jobs
+import toxicity
+import links
+import text_index
+import chat_context
 import instagram_scraper
 import matplotlib
 matplotlib.use('Agg') # Set backend to Agg for non-interactive plotting
@@ -32,24 +41,43 @@ def add_cors_headers(response):
 app.config['UPLOAD_FOLDER'] = 'uploads'
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Memory budget for processed chats kept in-process between requests
+app.config['CHAT_CACHE_MAX_MB'] = int(os.environ.get("CHAT_CACHE_MAX_MB", "512"))
+chat_cache = chat_store.LRUCache(app.config['CHAT_CACHE_MAX_MB'] * 1024 * 1024)
+
+# Upload processing runs on a local background job queue (see jobs.py)
+job_queue = jobs.JobQueue()
+UPLOAD_STAGES = ['parse', 'sentiment', 'links', 'aggregate', 'toxicity', 'search', 'cache', 'charts']
+
+# Rendered dashboard charts, content-addressed (see charts.render_cached)
+app.config['CHART_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'charts')
+os.makedirs(app.config['CHART_FOLDER'], exist_ok=True)
+
 
 # GEMINI CONFIG
 # API Key is loaded from .env automatically by load_dotenv()
 if "GEMINI_API_KEY" not in os.environ:
     print("WARNING: GEMINI_API_KEY not found in environment variables.")
-    print("         Vector search (semantic chat search) will be disabled.")
+    print("         Semantic chat search will use the local vector index.")
     
 from gemini_helper import GeminiChat
 chatbot = GeminiChat()
 
 try:
-    from vector_helper import VectorStore
-    vector_store = VectorStore()
+    from vector_helper import create_vector_store
+    vector_store = create_vector_store()
 except Exception as e:
     print(f"⚠️ WARNING: Failed to initialize VectorStore: {e}")
     print("          The app will work, but semantic chat search will be disabled.")
     vector_store = None
 
+# Spawn and warm the chart rendering pool in the background so the first upload doesn't
+# pay for it (skipped inside the pool's own spawned workers, which re-import this module)
+import multiprocessing
+import threading
+if multiprocessing.parent_process() is None:
+    threading.Thread(target=charts.start, daemon=True).start()
+
 # Helper to convert plot to base64
 def get_base64_plot(fig):
     buf = io.BytesIO()
@@ -91,8 +119,10 @@ def analyze_instagram():
     if request.is_json:
         data = request.json or {}
         username = data.get('username')
+        chart_mode = data.get('chart_mode', 'image')
     else:
         username = request.form.get('username')
+        chart_mode = request.form.get('chart_mode', 'image')
         
     if not username:
         return jsonify({"error": "Username is required"}), 400
@@ -110,7 +140,13 @@ def analyze_instagram():
     graphs = {}
     
     # Daily
-    if not posts_df.empty:
+    if not posts_df.empty and chart_mode == 'data':
+        # Series only; the browser draws them (see drawChart in main.js)
+        for name, counts in zip(['daily_chart', 'weekly_chart', 'monthly_chart'],
+                                instagram_scraper.get_activity_charts_data(posts_df)):
+            x = pd.to_datetime(counts['timestamp']).dt.strftime('%Y-%m-%d').tolist()
+            graphs[name] = charts.chart_series('line', {'x': x, 'y': counts['count'].tolist(), 'color': '#fd7e14'})
+    elif not posts_df.empty:
         daily_counts, weekly_counts, monthly_counts = instagram_scraper.get_activity_charts_data(posts_df)
         
         # Plot Daily
@@ -155,15 +191,140 @@ def analyze_instagram():
         "stats": stats,
         "activity": activity_metrics,
         "graphs": graphs,
+        "chart_mode": chart_mode,
         "top_content": top_content,
         "data_source": data_source
     })
 
 
 # WhatsApp Logic
-# For simplicity in this demo, we will process the file on every request or use a simple caching mechanism 
-# (e.g., save DF to temporary pickle).
-# Since session size is limited, we save the file path in session.
+# Each upload is parsed once and cached as a columnar Parquet file (chat_store) next to
+# the raw export. Later requests read only the columns/rows they need; if the cache is
+# missing or was written by an older schema it is rebuilt from the raw .txt.
+
+def process_chat_file(filepath, job=None):
+    """Parse a raw export and add the per-message columns cached alongside it."""
+    with jobs.stage(job, 'parse'):
+        # Stream the export from disk in bounded batches instead of reading it whole
+        df = preprocessor.preprocess_file(filepath).reset_index(drop=True)
+        print(f"📄 Parsed {len(df)} messages by header format: {df.attrs.get('format_counts', {})}")
+    return score_messages(df, job)
+
+def score_messages(df, job=None):
+    """Add the per-message columns (sentiment, link counts) cached with a chat."""
+    # Pre-calculate sentiment analysis on upload so it is cached with the chat
+    with jobs.stage(job, 'sentiment'):
+        try:
+            _, df = helper.sentiment_analysis("Overall", df)
+        except Exception as e:
+            print(f"⚠️ Warning: Pre-calculating sentiment failed: {e}")
+
+    # Per-message link counts, so link totals for any scope are a column sum
+    with jobs.stage(job, 'links'):
+        df['links'] = links.count_links(df['message'])
+    return df
+
+def save_chat_cache(df, cube, file_id, content_hash=None):
+    try:
+        path = chat_store.save_chat(df, app.config['UPLOAD_FOLDER'], file_id, content_hash)
+        aggregates.save_cube(cube, app.config['UPLOAD_FOLDER'], file_id)
+        print(f"✅ Chat and aggregate cube cached as Parquet: {path}")
+    except Exception as e:
+        print(f"❌ Failed to save chat cache: {e}")
+
+def _load_full_chat(file_id):
+    """Read a whole processed chat (and its cube) from disk, rebuilding from the raw export if needed."""
+    folder = app.config['UPLOAD_FOLDER']
+    filepath = os.path.join(folder, f"{file_id}.txt")
+    meta = chat_store.read_meta(folder, file_id)
+    if meta is not None:
+        df = chat_store.load_chat(folder, file_id)
+        if df is not None:
+            print(f"✅ Loaded chat from Parquet cache: {file_id} ({len(df)} rows)")
+            cube = aggregates.load_cube(folder, file_id)
+            if cube is None:
+                cube = aggregates.build_cube(df)
+                aggregates.save_cube(cube, folder, file_id)
+            content_hash = meta.get('content_hash')
+            if not content_hash:
+                # Caches written before content hashing: fall back to the raw export, or the upload id
+                content_hash = chat_store.file_digest(filepath) if os.path.exists(filepath) else file_id
+            return {"file_id": file_id, "df": df, "users": meta['users'], "cube": cube, "content_hash": content_hash}
+
+    if not os.path.exists(filepath):
+        return None
+    print(f"⚠️ Chat cache missing or stale for {file_id}. Rebuilding from txt.")
+    df = process_chat_file(filepath)
+    cube = aggregates.build_cube(df)
+    content_hash = chat_store.file_digest(filepath)
+    save_chat_cache(df, cube, file_id, content_hash)
+    return {"file_id": file_id, "df": df, "users": chat_store.user_list_of(df['user'].unique().tolist()),
+            "cube": cube, "content_hash": content_hash}
+
+def valid_file_id(file_id):
+    """Whether ``file_id`` is an upload id (a UUID). Ids come from clients and are
+    joined into paths under UPLOAD_FOLDER, so anything else is rejected up front."""
+    try:
+        return isinstance(file_id, str) and str(uuid.UUID(file_id)) == file_id.lower()
+    except ValueError:
+        return False
+
+def load_chat(file_id):
+    """Cached {'file_id', 'df', 'users', 'cube', 'content_hash'} entry for an upload, or None if it no longer exists.
+
+    Whole chats live in the shared in-memory LRU (chat_cache), so repeat interactions
+    skip disk entirely.
+    """
+    if not valid_file_id(file_id):
+        return None
+    return chat_cache.get_or_load(file_id, lambda: _load_full_chat(file_id))
+
+def build_toxicity_index(df, file_id):
+    """Scan the chat once for bad words and store the sparse index next to it."""
+    scanner = toxicity.get_scanner()
+    if scanner is None:
+        return None
+    index = toxicity.build_index(df, scanner)
+    try:
+        toxicity.save_index(index, app.config['UPLOAD_FOLDER'], file_id)
+    except Exception as e:
+        print(f"❌ Failed to save toxicity index: {e}")
+    return index
+
+def chat_toxicity(entry, selected_user):
+    """Toxicity table for a scope, from the chat's precomputed index.
+
+    The index is loaded (or rebuilt) on first use and whenever bad_words.txt changes.
+    """
+    scanner = toxicity.get_scanner()
+    if scanner is None:
+        return []
+    index = entry.get("toxicity")
+    if index is None or index['fingerprint'] != scanner.fingerprint:
+        index = (toxicity.load_index(app.config['UPLOAD_FOLDER'], entry["file_id"], scanner.fingerprint)
+                 or build_toxicity_index(entry["df"], entry["file_id"]))
+        entry["toxicity"] = index
+        chat_cache.resize(entry["file_id"], entry)
+    return toxicity.scope_scores(entry["df"], index, selected_user)
+
+def chat_text_index(entry):
+    """The chat's inverted text index (see text_index.py), loaded or rebuilt on first use."""
+    index = entry.get("text_index")
+    if index is None or len(index) != len(entry["df"]):
+        folder = app.config['UPLOAD_FOLDER']
+        index = text_index.load_index(folder, entry["file_id"], entry.get("content_hash"))
+        if index is None or len(index) != len(entry["df"]):
+            index = text_index.build_index(entry["df"], entry.get("content_hash"))
+            save_text_index(index, entry["file_id"])
+        entry["text_index"] = index
+        chat_cache.resize(entry["file_id"], entry)
+    return index
+
+def save_text_index(index, file_id):
+    try:
+        text_index.save_index(index, app.config['UPLOAD_FOLDER'], file_id)
+    except Exception as e:
+        print(f"❌ Failed to save text index: {e}")
 
 import re
 
@@ -192,16 +353,12 @@ def analyze_whatsapp():
                         head.append(line)
                     except StopIteration:
                         break
-                
-                # Reset pointer for processing
-                f.seek(0)
-                data = f.read()
         except Exception as e:
             return jsonify({"error": f"Failed to read file: {str(e)}"}), 400
 
-        # Regex for standard WhatsApp date formats (dd/mm/yy or mm/dd/yy)
-        # Matches: "12/05/2023, 10:30" or "[12/05/23, 10:30]"
-        whatsapp_pattern = re.compile(r'^\[?\d{1,2}[/-]\d{1,2}[/-]\d{2,4},? \d{1,2}:\d{2}')
+        # Regex for standard WhatsApp date formats (dd/mm/yy, mm/dd/yy or dd.mm.yy)
+        # Matches: "12/05/2023, 10:30", "[12/05/23, 10:30]" or "12.05.23, 10:30"
+        whatsapp_pattern = re.compile(r'^\u200e?\[?\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4},? \d{1,2}:\d{2}')
         
         is_valid = False
         for line in head:
@@ -216,47 +373,228 @@ def analyze_whatsapp():
             except:
                 pass
             return jsonify({"error": "This is not a WhatsApp chat. Please upload only WhatsApp chat!"}), 400
-        df = preprocessor.preprocess(data)
+        # A newer export of a chat we already have is appended to it (same file_id)
+        base = chat_store.find_base_export(app.config['UPLOAD_FOLDER'], filepath)
+        if base is not None:
+            print(f"🔁 Upload extends stored chat {base[0]}; only new messages will be processed")
+            file_id = base[0]
+
+        # The heavy pipeline runs on the job queue; the client polls /api/jobs/<job_id>
+        chart_mode = request.form.get('chart_mode', 'image')
+        # The worker reuses this request's context so url_for() builds the chart URLs
+        job = job_queue.submit(copy_current_request_context(process_upload), filepath, file_id, chart_mode,
+                               incremental=base is not None, stages=UPLOAD_STAGES)
+        if request.form.get('wait') == '1':
+            # Synchronous mode for scripts: block and answer like the old endpoint did
+            job.wait()
+            if job.status == "error":
+                return jsonify({"error": f"Failed to process chat: {job.error}"}), 500
+            return jsonify(job.result)
+        # No file_id yet: an upload that turns out not to extend the stored chat is
+        # processed under its own id, so the id comes with the job's result
+        return jsonify({
+            "job_id": job.id,
+            "status_url": url_for('job_status', job_id=job.id),
+        }), 202
+
+def process_upload(job, filepath, file_id, chart_mode="image", incremental=False):
+    """Upload pipeline run on the job queue: parse, score, aggregate, cache, render."""
+    if incremental:
+        with ingest_lock:
+            # Checked again under the lock: another upload may have extended the chat meanwhile
+            base = chat_store.find_base_export(app.config['UPLOAD_FOLDER'], filepath)
+            res = process_incremental(job, filepath, *base, chart_mode=chart_mode) if base else None
+        if res is not None:
+            return res
+        # Not appendable after all: process it as a new chat under its own upload id
+        file_id = os.path.splitext(os.path.basename(filepath))[0]
+
+    df = process_chat_file(filepath, job)
+    # Aggregate once here; every dashboard view afterwards just slices the cube
+    with jobs.stage(job, 'aggregate'):
+        cube = aggregates.build_cube(df)
+    # Bad-word hits are found once and kept as a sparse index; scopes just filter it
+    with jobs.stage(job, 'toxicity'):
+        toxicity_index = build_toxicity_index(df, file_id)
+    # Inverted index for keyword search and the lexical half of /api/chat retrieval
+    with jobs.stage(job, 'search'):
+        search_index = text_index.build_index(df)
+    with jobs.stage(job, 'cache'):
+        content_hash = chat_store.file_digest(filepath)
+        save_chat_cache(df, cube, file_id, content_hash)
+        search_index.content_hash = content_hash
+        save_text_index(search_index, file_id)
+        chat_store.register_export(app.config['UPLOAD_FOLDER'], file_id, filepath, content_hash)
+        user_list = chat_store.user_list_of(df['user'].unique().tolist())
+        entry = {"file_id": file_id, "df": df, "users": user_list, "cube": cube, "content_hash": content_hash,
+                 "toxicity": toxicity_index, "text_index": search_index}
+        chat_cache.put(file_id, entry)
+    
+    # Index into ChromaDB for semantic search in a background thread to avoid blocking the user response
+    if vector_store:
+        def run_background_indexing(df_copy, fn):
+            try:
+                vector_store.index_chat(df_copy, fn)
+            except Exception as e:
+                print(f"❌ Background Indexing Error: {e}")
         
-        # Pre-calculate sentiment analysis on upload so it is cached in the DataFrame
+        thread = threading.Thread(target=run_background_indexing, args=(df.copy(), os.path.basename(filepath)))
+        thread.start()
+        print("🚀 Started ChromaDB indexing in a background thread.")
+    else:
+        print("⚠️ VectorStore not available; semantic search skipped.")
+
+    # Default to Overall
+    with jobs.stage(job, 'charts'):
+        res = render_whatsapp_result("Overall", entry, chart_mode=chart_mode)
+    res["file_id"] = file_id
+    return res
+
+# Newer exports of a stored chat are appended to it one at a time
+ingest_lock = threading.Lock()
+
+def append_messages(df, tail):
+    """The stored chat frame with the tail's rows (already numbered after it) appended."""
+    merged = pd.concat([df, tail])
+    # Senders differ between the two parts; re-derive the sorted 'user' categories
+    merged['user'] = merged['user'].astype(str).astype('category')
+    merged.attrs = {'formats': tail.attrs.get('formats')}
+    return merged
+
+def index_in_background(df, collection, append=False):
+    def run_background_indexing():
         try:
-            _, df = helper.sentiment_analysis("Overall", df)
+            vector_store.index_chat(df, collection, append=append)
         except Exception as e:
-            print(f"⚠️ Warning: Pre-calculating sentiment failed: {e}")
-            
-        # Save DataFrame as a pickle for extremely fast loading on subsequent requests
-        pkl_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{file_id}.pkl")
+            print(f"❌ Background Indexing Error: {e}")
+
+    threading.Thread(target=run_background_indexing).start()
+
+def process_incremental(job, filepath, file_id, base_size, chart_mode="image"):
+    """Append a newer export of stored chat ``file_id`` (whose export was its first
+    ``base_size`` bytes): only the new messages are parsed, scored, aggregated,
+    scanned and embedded. Returns None if the new part can't be appended cleanly."""
+    folder = app.config['UPLOAD_FOLDER']
+    meta = chat_store.read_meta(folder, file_id)
+    entry = load_chat(file_id)
+    if meta is None or not meta.get('formats') or entry is None:
+        return None
+    # Decide on falling back before any stage runs, so a full reprocess never follows delta work
+    if not preprocessor.tail_appendable(filepath, base_size, meta['formats']):
+        print(f"⚠️ New part of {file_id} doesn't start a new message or changes format; reprocessing it whole")
+        return None
+    old_df = entry["df"]
+    base_path = os.path.join(folder, f"{file_id}.txt")
+
+    if os.path.getsize(filepath) == base_size:
+        # The very same export again: nothing to process
+        os.remove(filepath)
+        for name in UPLOAD_STAGES[:-1]:
+            jobs.skip(job, name)
+        if vector_store and vector_store.count(f"{file_id}.txt") == 0:
+            # Stored while another vector backend was in use: index it for this one
+            index_in_background(old_df.copy(), f"{file_id}.txt")
+        with jobs.stage(job, 'charts'):
+            res = render_whatsapp_result("Overall", entry, chart_mode=chart_mode)
+        res["file_id"] = file_id
+        res["incremental"] = {"base_messages": len(old_df), "new_messages": 0}
+        return res
+
+    with jobs.stage(job, 'parse'):
+        tail = preprocessor.preprocess_tail(filepath, base_size, meta['formats'])
+        # Row ids continue after the stored ones (they key the toxicity and vector indexes)
+        tail.index = pd.RangeIndex(len(tail)) + (int(old_df.index.max()) + 1 if len(old_df) else 0)
+        print(f"📄 Parsed {len(tail)} new messages after {len(old_df)} stored ones")
+    tail = score_messages(tail, job)
+
+    with jobs.stage(job, 'aggregate'):
+        cube = aggregates.merge_cube(entry["cube"], aggregates.build_cube(tail))
+        df = append_messages(old_df, tail)
+    with jobs.stage(job, 'toxicity'):
+        scanner = toxicity.get_scanner()
+        index = None
+        if scanner is not None:
+            index = entry.get("toxicity") or toxicity.load_index(folder, file_id, scanner.fingerprint)
+            if index is not None and index['fingerprint'] == scanner.fingerprint:
+                index = toxicity.extend_index(index, tail, scanner)
+                try:
+                    toxicity.save_index(index, folder, file_id)
+                except Exception as e:
+                    print(f"❌ Failed to save toxicity index: {e}")
+            else:
+                index = build_toxicity_index(df, file_id)
+    with jobs.stage(job, 'search'):
+        search_index = text_index.extend_index(chat_text_index(entry), tail)
+    with jobs.stage(job, 'cache'):
+        content_hash = chat_store.file_digest(filepath)
+        os.replace(filepath, base_path)
+        save_chat_cache(df, cube, file_id, content_hash)
+        search_index.content_hash = content_hash
+        save_text_index(search_index, file_id)
+        chat_store.register_export(folder, file_id, base_path, content_hash)
+        entry = {"file_id": file_id, "df": df, "users": chat_store.user_list_of(df['user'].unique().tolist()),
+                 "cube": cube, "content_hash": content_hash, "toxicity": index, "text_index": search_index}
+        chat_cache.put(file_id, entry)
+
+    if vector_store:
+        # Only the new messages are embedded, unless the chat was never indexed
+        append = vector_store.count(f"{file_id}.txt") > 0
+        index_in_background((tail if append else df).copy(), f"{file_id}.txt", append=append)
+
+    with jobs.stage(job, 'charts'):
+        res = render_whatsapp_result("Overall", entry, chart_mode=chart_mode)
+    res["file_id"] = file_id
+    res["incremental"] = {"base_messages": len(old_df), "new_messages": len(tail)}
+    return res
+
+def resume_interrupted_indexing():
+    """Finish the vector indexes an earlier run of the app stopped in the middle of."""
+    for name in vector_store.interrupted():
+        entry = load_chat(os.path.splitext(name)[0])
+        if entry is None:
+            print(f"⚠️ Can't resume indexing of {name}: the chat is no longer stored")
+            continue
+        print(f"🔁 Resuming interrupted ChromaDB indexing of {name}")
         try:
-            df.to_pickle(pkl_path)
-            print(f"✅ DataFrame cached successfully as pickle: {pkl_path}")
+            # Only the messages missing from the collection are embedded and added
+            vector_store.index_chat(entry["df"], name, append=True)
         except Exception as e:
-            print(f"❌ Failed to save DataFrame pickle: {e}")
+            print(f"❌ Background Indexing Error: {e}")
+
+if vector_store and multiprocessing.parent_process() is None:
+    threading.Thread(target=resume_interrupted_indexing, daemon=True).start()
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found or expired."}), 404
+    data = job.to_dict()
+    # Semantic search indexing continues in the background after the job is done
+    if vector_store and job.status == "done" and job.result.get("file_id"):
+        data["indexing"] = vector_store.index_status(f"{job.result['file_id']}.txt")
+    return jsonify(data)
+
+@app.route('/api/jobs/<job_id>/events')
+def job_events(job_id):
+    """Server-Sent Events stream of a job's status, ending once it is done or failed."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found or expired."}), 404
+
+    def stream():
+        version = None
+        while True:
+            if version == job.version:
+                yield ": keep-alive\n\n"
+            else:
+                version = job.version
+                yield f"data: {app.json.dumps(job.to_dict())}\n\n"
+                if job.status in ("done", "error"):
+                    return
+            job.wait_for_change(version, timeout=15)
 
-        user_list = df['user'].unique().tolist()
-        if 'group_notification' in user_list:
-             user_list.remove('group_notification')
-        user_list.sort()
-        user_list.insert(0, "Overall")
-        
-        # Index into ChromaDB for semantic search in a background thread to avoid blocking the user response
-        if vector_store:
-            import threading
-            def run_background_indexing(df_copy, fn):
-                try:
-                    vector_store.index_chat(df_copy, fn)
-                except Exception as e:
-                    print(f"❌ Background Indexing Error: {e}")
-            
-            thread = threading.Thread(target=run_background_indexing, args=(df.copy(), filename))
-            thread.start()
-            print("🚀 Started ChromaDB indexing in a background thread.")
-        else:
-            print("⚠️ VectorStore not available; semantic search skipped.")
- 
-        # Default to Overall
-        res = render_whatsapp_result("Overall", df, user_list)
-        res["file_id"] = file_id
-        return jsonify(res)
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
 @app.route('/analyze/whatsapp_result', methods=['POST'])
 def whatsapp_result_update():
@@ -265,59 +603,99 @@ def whatsapp_result_update():
         selected_user = data.get('user', 'Overall')
         file_id = data.get('file_id')
         search_query = data.get('search_query')
+        search_options = data
+        chart_mode = data.get('chart_mode', 'image')
     else:
         selected_user = request.form.get('user', 'Overall')
         file_id = request.form.get('file_id')
         search_query = request.form.get('search_query')
+        search_options = request.form
+        chart_mode = request.form.get('chart_mode', 'image')
         
     if not file_id:
         return jsonify({"error": "file_id is required"}), 400
+    if not valid_file_id(file_id):
+        return jsonify({"error": "Invalid file_id"}), 400
         
-    pkl_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{file_id}.pkl")
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{file_id}.txt")
-    
-    if os.path.exists(pkl_path):
-        try:
-            df = pd.read_pickle(pkl_path)
-            print(f"✅ Loaded DataFrame from cache pickle: {pkl_path}")
-        except Exception as e:
-            print(f"⚠️ Warning: Failed to load pickle: {e}. Falling back to txt preprocessing.")
-            if not os.path.exists(filepath):
-                return jsonify({"error": "Session expired or file not found. Please upload file again."}), 404
-            with open(filepath, 'r', encoding='utf-8') as f:
-                data = f.read()
-            df = preprocessor.preprocess(data)
-    else:
-        if not os.path.exists(filepath):
-            return jsonify({"error": "Session expired or file not found. Please upload file again."}), 404
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = f.read()
-        df = preprocessor.preprocess(data)
-    
-    # Calculate user list on-the-fly
-    user_list = df['user'].unique().tolist()
-    if 'group_notification' in user_list:
-         user_list.remove('group_notification')
-    user_list.sort()
-    user_list.insert(0, "Overall")
+    entry = load_chat(file_id)
+    if entry is None:
+        return jsonify({"error": "Session expired or file not found. Please upload file again."}), 404
+    df = entry["df"]
     
     search_results = []
+    search_page = None
     
     if search_query:
-        mask = df['message'].str.contains(search_query, case=False, na=False)
-        search_df = df[mask]
-        # Convert to dict for template
-        for i, row in search_df.iterrows():
-            search_results.append({
-                'user': row['user'],
-                'date': str(row['date']),
-                'message': row['message']
-            })
+        # First page only; /api/search serves the following ones
+        try:
+            search_page = search_messages(entry, search_query, search_options)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        search_results = search_page.pop("results")
     
-    res = render_whatsapp_result(selected_user, df, user_list, search_results)
+    res = render_whatsapp_result(selected_user, entry, search_results, chart_mode=chart_mode)
     res["file_id"] = file_id
+    if search_page is not None:
+        res["search"] = search_page
     return jsonify(res)
 
+def search_messages(entry, query, options):
+    """A page of dashboard search results (see text_index.search) for request ``options``:
+    search_mode, search_user, search_start, search_end, search_order, cursor, limit."""
+    df = entry["df"]
+    page = text_index.search(
+        df, chat_text_index(entry), query,
+        mode=options.get('search_mode') or "literal",
+        user=options.get('search_user'),
+        start=options.get('search_start'),
+        end=options.get('search_end'),
+        order=options.get('search_order') or "asc",
+        cursor=options.get('cursor'),
+        limit=options.get('limit') or text_index.SEARCH_PAGE_SIZE,
+    )
+    rows = df.iloc[page["rows"]]
+    results = [{'user': user, 'date': str(date), 'message': message}
+               for user, date, message in zip(rows['user'].tolist(), rows['date'].tolist(), rows['message'].tolist())]
+    return {"results": results, "total": page["total"], "total_exact": page["total_exact"],
+            "next_cursor": page["next_cursor"]}
+
+@app.route('/api/search', methods=['GET', 'POST'])
+def api_search():
+    """Paginated message search: q (or search_query) plus the search_messages options."""
+    options = (request.get_json(silent=True) or {}) if request.method == 'POST' else request.args
+    file_id = options.get('file_id')
+    query = options.get('q') or options.get('search_query')
+    if not file_id or not query:
+        return jsonify({"error": "file_id and q are required"}), 400
+    if not valid_file_id(file_id):
+        return jsonify({"error": "Invalid file_id"}), 400
+    entry = load_chat(file_id)
+    if entry is None:
+        return jsonify({"error": "Session expired or file not found. Please upload file again."}), 404
+    try:
+        return jsonify(search_messages(entry, query, options))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/charts/<key>.png')
+def chart_image(key):
+    """Serve a stored chart. Keys are content hashes, so the image never changes."""
+    if request.if_none_match.contains(key):
+        response = make_response('', 304)
+    else:
+        png = charts.load_png(app.config['CHART_FOLDER'], key)
+        if png is None:
+            return "Chart not found", 404
+        response = make_response(png)
+        response.headers['Content-Type'] = 'image/png'
+    response.set_etag(key)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@app.route('/api/cache_stats')
+def cache_stats():
+    return jsonify({"chat_cache": chat_cache.stats(), "gemini": chatbot.stats()})
+
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -381,34 +759,12 @@ def download_report():
     
     if not file_id:
         return "file_id is required", 400
+    if not valid_file_id(file_id):
+        return "Invalid file_id", 400
         
-    pkl_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{file_id}.pkl")
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{file_id}.txt")
-    
-    if os.path.exists(pkl_path):
-        try:
-            df = pd.read_pickle(pkl_path)
-            print(f"✅ Loaded DataFrame from cache pickle for download: {pkl_path}")
-        except Exception as e:
-            print(f"⚠️ Warning: Failed to load pickle for download: {e}. Falling back to txt preprocessing.")
-            if not os.path.exists(filepath):
-                return "Session expired or file not found. Please upload file again.", 404
-            with open(filepath, 'r', encoding='utf-8') as f:
-                data = f.read()
-            df = preprocessor.preprocess(data)
-    else:
-        if not os.path.exists(filepath):
-            return "Session expired or file not found. Please upload file again.", 404
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = f.read()
-        df = preprocessor.preprocess(data)
-    
-    # Calculate user list on-the-fly
-    user_list = df['user'].unique().tolist()
-    if 'group_notification' in user_list:
-         user_list.remove('group_notification')
-    user_list.sort()
-    user_list.insert(0, "Overall")
+    entry = load_chat(file_id)
+    if entry is None:
+        return "Session expired or file not found. Please upload file again.", 404
     
     # Read CSS file to embed
     css_path = os.path.join(app.root_path, 'static', 'css', 'style.css')
@@ -425,8 +781,7 @@ def download_report():
     # Pass 'parent_template' to switch to standalone layout
     html_content = render_whatsapp_result(
         selected_user, 
-        df, 
-        user_list, 
+        entry, 
         download_mode=True, 
         css_content=css_content,
         parent_template="report_layout.html"
@@ -441,10 +796,13 @@ def download_report():
     return response
 
 
-def render_whatsapp_result(selected_user, df, user_list, search_results=None, download_mode=False, css_content="", parent_template="base.html"):
+TOP_EMOJIS = 20
+
+def render_whatsapp_result(selected_user, entry, search_results=None, download_mode=False, css_content="", parent_template="base.html", chart_mode="image"):
     print(f"DEBUG: render_whatsapp_result called with download_mode={download_mode}")
-    # Stats
-    num_messages, words, num_media_messages, num_links = helper.fetch_stats(selected_user, df)
+    df, user_list, cube = entry["df"], entry["users"], entry["cube"]
+    # Stats and activity charts are sliced from the precomputed aggregate cube
+    num_messages, words, num_media_messages, num_links = aggregates.fetch_stats(selected_user, cube)
     
     stats = {
         'num_messages': num_messages,
@@ -453,73 +811,71 @@ def render_whatsapp_result(selected_user, df, user_list, search_results=None, do
         'num_links': num_links
     }
     
-    charts = {}
+    # Plot data for each figure, computed only for charts not already in the chart store
+    def monthly_timeline_job():
+        timeline = aggregates.monthly_timeline(selected_user, cube)
+        return ('line', {'x': timeline['time'].tolist(), 'y': timeline['message'].tolist(), 'color': 'green'})
     
-    # Monthly Timeline
-    timeline = helper.monthly_timeline(selected_user, df)
-    fig, ax = plt.subplots()
-    ax.plot(timeline['time'], timeline['message'], color='green')
-    plt.xticks(rotation='vertical')
-    charts['monthly_timeline'] = get_base64_plot(fig)
-    
-    # Daily Timeline
-    daily_timeline = helper.daily_timeline(selected_user, df)
-    fig, ax = plt.subplots()
-    ax.plot(daily_timeline['only_date'], daily_timeline['message'], color='black')
-    plt.xticks(rotation='vertical')
-    charts['daily_timeline'] = get_base64_plot(fig)
+    def daily_timeline_job():
+        daily_timeline = aggregates.daily_timeline(selected_user, cube)
+        return ('line', {'x': daily_timeline['only_date'].tolist(), 'y': daily_timeline['message'].tolist(), 'color': 'black'})
     
     # Activity Maps
-    busy_day = helper.week_activity_map(selected_user, df)
-    fig, ax = plt.subplots()
-    ax.bar(busy_day.index, busy_day.values, color='purple')
-    plt.xticks(rotation='vertical')
-    charts['busy_day'] = get_base64_plot(fig)
+    def busy_day_job():
+        busy_day = aggregates.week_activity_map(selected_user, cube)
+        return ('bar', {'x': busy_day.index.astype(str).tolist(), 'y': busy_day.values.tolist(), 'color': 'purple'})
+    
+    def busy_month_job():
+        busy_month = aggregates.month_activity_map(selected_user, cube)
+        return ('bar', {'x': busy_month.index.astype(str).tolist(), 'y': busy_month.values.tolist(), 'color': 'orange'})
     
-    busy_month = helper.month_activity_map(selected_user, df)
-    fig, ax = plt.subplots()
-    ax.bar(busy_month.index, busy_month.values, color='orange')
-    plt.xticks(rotation='vertical')
-    charts['busy_month'] = get_base64_plot(fig)
+    def busy_users_job():
+        x, new_df = aggregates.most_busy_users(cube)
+        return ('bar', {'x': x.index.astype(str).tolist(), 'y': x.values.tolist(), 'color': 'red'})
     
-    # Heatmap
-    user_heatmap = helper.activity_heatmap(selected_user, df)
-    fig, ax = plt.subplots()
-    sns.heatmap(user_heatmap, ax=ax)
-    charts['heatmap'] = get_base64_plot(fig)
+    def sentiment_job():
+        sentiment_counts = aggregates.sentiment_counts(selected_user, cube)
+        return ('pie', {'values': sentiment_counts['count'].tolist(), 'labels': sentiment_counts['category'].tolist()})
     
+    builders = {
+        'monthly_timeline': monthly_timeline_job,
+        'daily_timeline': daily_timeline_job,
+        'busy_day': busy_day_job,
+        'busy_month': busy_month_job,
+        'heatmap': lambda: ('heatmap', {'matrix': aggregates.activity_heatmap(selected_user, cube)}),
+        'wordcloud': lambda: ('wordcloud', {'frequencies': aggregates.wordcloud_frequencies(selected_user, cube)}),
+        'sentiment': sentiment_job,
+    }
     # Busy Users (Only if Overall)
     if selected_user == 'Overall':
-        x, new_df = helper.most_busy_users(df)
-        fig, ax = plt.subplots()
-        ax.bar(x.index, x.values, color='red')
-        plt.xticks(rotation='vertical')
-        charts['busy_users'] = get_base64_plot(fig)
-    else:
-        charts['busy_users'] = None
-        
-    # Wordcloud
-    df_wc = helper.create_wordcloud(selected_user, df)
-    fig, ax = plt.subplots()
-    ax.imshow(df_wc)
-    plt.axis('off') # Remove axis for image
-    charts['wordcloud'] = get_base64_plot(fig)
+        builders['busy_users'] = busy_users_job
     
-    # Sentiment
-    sentiment_counts, sentiment_df = helper.sentiment_analysis(selected_user, df)
-    fig, ax = plt.subplots()
-    ax.pie(sentiment_counts['count'], labels=sentiment_counts['category'], autopct='%1.1f%%', startangle=90, colors=['green', 'red', 'grey'])
-    charts['sentiment'] = get_base64_plot(fig)
+    chart_folder = app.config['CHART_FOLDER']
+    if chart_mode == 'data' and not download_mode:
+        # Client-side rendering: return the series behind each chart and skip matplotlib entirely
+        chart_images = {name: charts.chart_series(*build()) for name, build in builders.items()}
+    else:
+        chart_keys = charts.render_cached(chart_folder, entry["content_hash"], selected_user, builders)
+        if download_mode:
+            # The downloaded report is a standalone file, so its images stay inline
+            chart_images = {name: base64.b64encode(charts.load_png(chart_folder, key)).decode('utf-8')
+                            for name, key in chart_keys.items()}
+        else:
+            chart_images = {name: url_for('chart_image', key=key) for name, key in chart_keys.items()}
+    chart_images.setdefault('busy_users', None)
     
-    # Toxicity Analysis
-    toxicity_data = helper.analyze_toxicity(selected_user, df)
+    # Toxicity Analysis (from the precomputed per-chat index)
+    toxicity_data = chat_toxicity(entry, selected_user)
+
+    # Most used emojis, sliced from the per-user emoji counts in the cube
+    top_emojis = aggregates.emoji_helper(selected_user, cube).head(TOP_EMOJIS).to_dict(orient='records')
 
     if download_mode:
         return render_template('whatsapp_result.html', 
                                selected_user=selected_user, 
                                users=user_list,
                                stats=stats,
-                               charts=charts,
+                               charts=chart_images,
                                search_results=search_results,
                                toxicity=toxicity_data,
                                download_mode=download_mode,
@@ -530,87 +886,136 @@ def render_whatsapp_result(selected_user, df, user_list, search_results=None, do
             "selected_user": selected_user,
             "users": user_list,
             "stats": stats,
-            "charts": charts,
+            "charts": chart_images,
+            "chart_mode": chart_mode,
             "search_results": search_results or [],
-            "toxicity": toxicity_data
+            "toxicity": toxicity_data,
+            "emojis": top_emojis
         }
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
-    data = request.json or {}
+RETRIEVED_LINES = 18
+RECENT_LINES = 18
+
+def chat_line(date, user, message):
+    return f"[{pd.Timestamp(date).strftime('%Y-%m-%d %H:%M')}] {str(user).strip()}: {str(message).strip()}"
+
+def retrieve_chat_lines(entry, query, selected_user, n=RETRIEVED_LINES):
+    """Hybrid retrieval for the chat prompt: BM25 over the chat's text index and the
+    vector store's semantic hits, merged by reciprocal rank fusion. Exact terms
+    (names, numbers) come from BM25 even when embeddings miss them."""
+    df = entry["df"]
+    index = chat_text_index(entry)
+    lines = {}
+    lexical = []
+    positions = [pos for pos, _ in index.bm25(query or "", k=n, user=selected_user)]
+    rows = df.iloc[positions]
+    for pos, date, user, message in zip(positions, rows['date'].tolist(), rows['user'].tolist(), rows['message'].tolist()):
+        key = f"msg_{index.row_ids[pos]}"
+        lexical.append(key)
+        lines[key] = chat_line(date, user, message)
+    semantic = []
+    if vector_store and query:
+        for hit in vector_store.search(query, f"{entry['file_id']}.txt", n_results=n, user_filter=selected_user):
+            semantic.append(hit["id"])
+            lines.setdefault(hit["id"], f"[{hit['date']}] {hit['document']}")
+    return [lines[key] for key in text_index.rrf_fuse([lexical, semantic])[:n]]
+
+def recent_chat_lines(entry, selected_user, n=RECENT_LINES):
+    """The scope's last ``n`` messages (the whole chat's if the user has none), found
+    with the text index's per-row user codes instead of filtering the frame."""
+    df = entry["df"]
+    positions = np.flatnonzero(chat_text_index(entry).scope_mask(selected_user))[-n:]
+    rows = df.iloc[positions] if len(positions) else df.tail(n)
+    return [chat_line(date, user, message)
+            for date, user, message in zip(rows['date'].tolist(), rows['user'].tolist(), rows['message'].tolist())]
+
+def toxicity_section(entry, selected_user):
+    rows = chat_toxicity(entry, selected_user)[:20]
+    return chat_context.Section(
+        "toxicity",
+        [f"{i}. User: {row['user']} | score: {row['score']}/10 | flagged word count: {row['count']}"
+         for i, row in enumerate(rows, start=1)],
+        header="--- Toxicity / abuse analysis (same heuristic as the Abuse Record table; higher score = more flagged words) ---",
+        footer="For 'who is most toxic', the top row (#1) is the highest score in this scope unless scores tie." if rows else None,
+        empty=("--- Toxicity / abuse analysis: No matches from the project's bad-word list for this dashboard scope. "
+               "That does not prove the chat is 'clean'—only that nothing triggered the list. ---"),
+        priority=90, max_share=0.25)
+
+def chat_prompt_context(data):
+    """(question, assembled context) for a chat request: dashboard scope, frontend
+    summary, toxicity table, retrieved and recent lines, fitted to CHAT_CONTEXT_TOKENS
+    (see chat_context.py). Every section comes from the cached chat and its stored
+    indexes; nothing is re-parsed or re-scanned per question."""
+    started = time.perf_counter()
     user_message = data.get('message')
     frontend_context = data.get('context', "")
     selected_user = (data.get('selected_user') or "Overall").strip() or "Overall"
     file_id = data.get('file_id')
 
-    backend_context = ""
+    sections = [
+        chat_context.Section("scope", [f"Dashboard scope: {selected_user}"], priority=100),
+        chat_context.Section("summary", [f"Frontend summary: {frontend_context}"], priority=40, max_share=0.15),
+    ]
+    dropped = 0
 
     filepath = None
-    if file_id:
+    if file_id and valid_file_id(file_id):
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{file_id}.txt")
 
     if filepath and os.path.exists(filepath):
         try:
-            filename = os.path.basename(filepath)
-            semantic_context = vector_store.search_chat(
-                user_message, filename, user_filter=selected_user
-            )
-
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
-            df = preprocessor.preprocess(content)
-
-            toxicity_rows = helper.analyze_toxicity(selected_user, df)
-            if toxicity_rows:
-                tox_lines = [
-                    "--- Toxicity / abuse analysis (same heuristic as the Abuse Record table; higher score = more flagged words) ---",
-                ]
-                for i, row in enumerate(toxicity_rows[:20], start=1):
-                    tox_lines.append(
-                        f"{i}. User: {row['user']} | score: {row['score']}/10 | flagged word count: {row['count']}"
-                    )
-                tox_lines.append(
-                    "For 'who is most toxic', the top row (#1) is the highest score in this scope unless scores tie."
-                )
-                toxicity_block = "\n".join(tox_lines)
-            else:
-                toxicity_block = (
-                    "--- Toxicity / abuse analysis: No matches from the project's bad-word list for this dashboard scope. "
-                    "That does not prove the chat is 'clean'—only that nothing triggered the list. ---"
-                )
-
-            if selected_user != "Overall":
-                df_scope = df[df['user'] == selected_user]
-            else:
-                df_scope = df
-            recent = df_scope.tail(18) if len(df_scope) else df.tail(18)
-            recent_msgs = [
-                f"\n--- Recent messages (scope: {selected_user}) ---",
+            entry = load_chat(file_id)
+            recent = recent_chat_lines(entry, selected_user)
+            # Lines repeating another retrieved line or a recent message only cost tokens
+            retrieved, dropped = chat_context.dedupe_lines(retrieve_chat_lines(entry, user_message, selected_user),
+                                                           against=recent)
+            scope = f" for user \"{selected_user}\"" if selected_user != "Overall" else ""
+            sections += [
+                toxicity_section(entry, selected_user),
+                chat_context.Section("retrieved", retrieved, header="--- Retrieved lines (keyword + semantic search) ---",
+                                     empty=f"(No matching chat lines found{scope}.)", priority=80, max_share=0.5),
+                chat_context.Section("recent", recent, header=f"--- Recent messages (scope: {selected_user}) ---",
+                                     priority=60, max_share=0.3, keep="tail"),
             ]
-            for _, row in recent.iterrows():
-                recent_msgs.append(
-                    f"[{row['date'].strftime('%Y-%m-%d %H:%M')}] {row['user']}: {row['message']}"
-                )
-
-            backend_context = (
-                toxicity_block
-                + "\n\n"
-                + f"--- Retrieved lines (Chroma semantic search) ---\n{semantic_context}\n"
-                + "\n".join(recent_msgs)
-            )
-
         except Exception as e:
             print(f"Chat Context Error: {e}")
 
-    full_context = (
-        f"Dashboard scope: {selected_user}\n"
-        f"Frontend summary: {frontend_context}\n\n"
-        f"{backend_context}"
-    )
-    
+    full_context, report = chat_context.assemble(sections)
+    prompt_tokens = chat_context.estimate_tokens(chatbot.build_prompt(user_message, full_context))
+    print(f"🧩 Chat prompt: ~{prompt_tokens} tokens (context {sum(r['tokens'] for r in report.values())}"
+          f"/{chat_context.CHAT_CONTEXT_TOKENS}: {chat_context.describe(report)}; {dropped} duplicate lines dropped) "
+          f"assembled in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return user_message, full_context
+
+@app.route('/api/chat', methods=['POST'])
+def chat():
+    data = request.json or {}
+    if data.get('file_id') and not valid_file_id(data['file_id']):
+        return jsonify({"error": "Invalid file_id"}), 400
+    user_message, full_context = chat_prompt_context(data)
     response = chatbot.get_response(user_message, full_context)
     return {"response": response}
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """/api/chat as Server-Sent Events: {"text": chunk} as the answer is generated,
+    then a "done" event with the whole {"response"}."""
+    data = request.json or {}
+    if data.get('file_id') and not valid_file_id(data['file_id']):
+        return jsonify({"error": "Invalid file_id"}), 400
+    user_message, full_context = chat_prompt_context(data)
+
+    def stream():
+        parts = []
+        for chunk in chatbot.stream_response(user_message, full_context):
+            parts.append(chunk)
+            yield f"data: {app.json.dumps({'text': chunk})}\n\n"
+        yield f"event: done\ndata: {app.json.dumps({'response': ''.join(parts)})}\n\n"
+
+    # X-Accel-Buffering: no keeps reverse proxies (nginx) from holding chunks back
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 if __name__ == "__main__":
     app.run(debug=True, port=5050)
 
@@ -0,0 +1,211 @@
+"""Micro-benchmarks for the chat analysis pipeline.
+
+Usage:
+    python benchmark.py preprocess [--messages 1000000]
+    python benchmark.py cache [--messages 1000000]
+    python benchmark.py charts [--messages 20000] [--workers 1 2 4 8]
+    python benchmark.py sentiment [--messages 200000] [--workers 4]
+    python benchmark.py emoji [--messages 500000]
+
+Each benchmark builds a synthetic WhatsApp export so results are reproducible
+without real chat data.
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import chat_store
+import preprocessor
+
+USERS = ['Alice', 'Bob', 'Carol Smith', 'Dev', '+91 98765 43210', 'Eve', 'Frank', 'Grace']
+WORDS = ("ok haha the meeting is at 5 lol see you tomorrow great idea send the invoice "
+         "https://example.com/page 😂 👍 nice thanks bro done call me").split()
+# Multi-codepoint emoji: skin tone, ZWJ sequence, flag, keycap
+EMOJI_WORDS = WORDS + ['👍🏽', '👨\u200d👩\u200d👧', '🇮🇳', '❤️', '#️⃣']
+
+
+def synthetic_chat(num_messages, seed=0, words=WORDS):
+    """Return a 24h-format export with multi-line messages, media and notifications."""
+    rng = random.Random(seed)
+    ts = datetime(2021, 1, 1)
+    lines = []
+    for _ in range(num_messages):
+        ts += timedelta(minutes=rng.randint(0, 30))
+        header = ts.strftime('%d/%m/%y, %H:%M - ')
+        roll = rng.random()
+        if roll < 0.01:
+            lines.append(f"{header}{rng.choice(USERS)} added {rng.choice(USERS)}\n")
+        elif roll < 0.06:
+            lines.append(f"{header}{rng.choice(USERS)}: <Media omitted>\n")
+        else:
+            text = ' '.join(rng.choice(words) for _ in range(rng.randint(1, 15)))
+            if roll > 0.97:
+                text += "\nand a second line: still the same message"
+            lines.append(f"{header}{rng.choice(USERS)}: {text}\n")
+    return ''.join(lines)
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_preprocess(args):
+    data = synthetic_chat(args.messages)
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', encoding='utf-8', delete=False) as f:
+        f.write(data)
+        path = f.name
+    try:
+        df, elapsed = _timed(preprocessor.preprocess, data)
+        print(f"preprocess(str):       {len(df):>9,} rows in {elapsed:6.2f}s  -> {len(df) / elapsed:>10,.0f} rows/sec")
+        df, elapsed = _timed(preprocessor.preprocess_file, path)
+        print(f"preprocess_file(path): {len(df):>9,} rows in {elapsed:6.2f}s  -> {len(df) / elapsed:>10,.0f} rows/sec")
+    finally:
+        os.remove(path)
+
+
+def _best_of(repeat, fn, *args, **kwargs):
+    return min(_timed(fn, *args, **kwargs)[1] for _ in range(repeat))
+
+
+def bench_cache(args):
+    data = synthetic_chat(args.messages)
+    df = preprocessor.preprocess(data).reset_index(drop=True)
+    folder = tempfile.mkdtemp()
+    pkl_path = os.path.join(folder, 'chat.pkl')
+    try:
+        df.to_pickle(pkl_path)
+        chat_store.save_chat(df, folder, 'chat')
+        pkl_mb = os.path.getsize(pkl_path) / 1e6
+        pq_mb = os.path.getsize(os.path.join(folder, 'chat.parquet')) / 1e6
+        print(f"{len(df):,} rows | pickle {pkl_mb:.1f} MB | parquet {pq_mb:.1f} MB")
+
+        cases = [
+            ("pickle, full frame", lambda: pd.read_pickle(pkl_path)),
+            ("parquet, full frame", lambda: chat_store.load_chat(folder, 'chat')),
+            ("parquet, metadata only (user list)", lambda: chat_store.read_meta(folder, 'chat')),
+        ]
+        for name, fn in cases:
+            print(f"{name:42s} {_best_of(args.repeat, fn) * 1000:8.1f} ms")
+    finally:
+        for name in os.listdir(folder):
+            os.remove(os.path.join(folder, name))
+        os.rmdir(folder)
+
+
+def bench_charts(args):
+    """End-to-end /analyze/whatsapp latency with the chart pool at different sizes."""
+    import app as webapp
+    import charts
+
+    data = synthetic_chat(args.messages).encode('utf-8')
+    client = webapp.app.test_client()
+    for workers in args.workers:
+        charts.shutdown()
+        charts.CHART_WORKERS = workers
+        charts.start(workers)
+        timings = []
+        for _ in range(args.repeat):
+            upload = {'file': (io.BytesIO(data), 'chat.txt'), 'wait': '1'}
+            start = time.perf_counter()
+            response = client.post('/analyze/whatsapp', data=upload, content_type='multipart/form-data')
+            timings.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.get_json()
+        print(f"{workers} chart worker(s): best {min(timings):6.2f}s  median {sorted(timings)[len(timings) // 2]:6.2f}s")
+    charts.shutdown()
+
+
+def bench_sentiment(args):
+    """Per-message VADER .apply vs the deduplicated, memoized sentiment engine."""
+    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+    import sentiment
+
+    messages = preprocessor.preprocess(synthetic_chat(args.messages))['message']
+    analyzer = SentimentIntensityAnalyzer()
+    _, elapsed = _timed(messages.apply, lambda m: analyzer.polarity_scores(m)['compound'])
+    print(f"{'per-message apply':32s} {elapsed:6.2f}s")
+
+    memo_path = os.path.join(tempfile.mkdtemp(), 'memo.sqlite')
+    try:
+        for name, kwargs in [
+            ("engine, no memo", dict(memo_path=None, workers=args.workers)),
+            ("engine, cold memo", dict(memo_path=memo_path, workers=args.workers)),
+            ("engine, warm memo (re-upload)", dict(memo_path=memo_path, workers=args.workers)),
+        ]:
+            _, elapsed = _timed(sentiment.score_messages, messages, **kwargs)
+            print(f"{name:32s} {elapsed:6.2f}s")
+    finally:
+        for path in [memo_path, memo_path + '-wal', memo_path + '-shm']:
+            if os.path.exists(path):
+                os.remove(path)
+        os.rmdir(os.path.dirname(memo_path))
+
+
+def bench_emoji(args):
+    """Per-character EMOJI_DATA loop (old helper.emoji_helper) vs the compiled emoji index."""
+    from collections import Counter
+    import emoji
+    import emoji_stats
+
+    df = preprocessor.preprocess(synthetic_chat(args.messages, words=EMOJI_WORDS))
+    users = [u for u in df['user'].unique() if u != 'group_notification']
+
+    def old_loop(selected_user):
+        scoped = df if selected_user == 'Overall' else df[df['user'] == selected_user]
+        return Counter(c for message in scoped['message'] for c in message if c in emoji.EMOJI_DATA)
+
+    _, elapsed = _timed(old_loop, 'Overall')
+    print(f"{'old loop, Overall':36s} {elapsed:6.2f}s")
+    _, elapsed = _timed(lambda: [old_loop(u) for u in users])
+    print(f"{'old loop, every user':36s} {elapsed:6.2f}s")
+
+    _, elapsed = _timed(emoji_stats.get_matcher)
+    print(f"{'index, compile matcher':36s} {elapsed:6.2f}s")
+    table, elapsed = _timed(emoji_stats.build_table, df)
+    print(f"{'index, build (once per upload)':36s} {elapsed:6.2f}s  ({len(table):,} user/emoji rows)")
+    _, elapsed = _timed(lambda: [emoji_stats.emoji_counts(u, table) for u in ['Overall'] + users])
+    print(f"{'index, Overall + every user':36s} {elapsed:6.2f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('preprocess', help='rows/sec of the WhatsApp export parser')
+    p.add_argument('--messages', type=int, default=1_000_000)
+    p.set_defaults(func=bench_preprocess)
+
+    p = sub.add_parser('cache', help='load latency of the Parquet chat cache vs pickle')
+    p.add_argument('--messages', type=int, default=1_000_000)
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_cache)
+
+    p = sub.add_parser('charts', help='/analyze/whatsapp latency across chart pool sizes')
+    p.add_argument('--messages', type=int, default=20_000)
+    p.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_charts)
+
+    p = sub.add_parser('sentiment', help='sentiment scoring: per-message apply vs batched engine')
+    p.add_argument('--messages', type=int, default=200_000)
+    p.add_argument('--workers', type=int, default=None)
+    p.set_defaults(func=bench_sentiment)
+
+    p = sub.add_parser('emoji', help='emoji counts: per-character loop vs compiled emoji index')
+    p.add_argument('--messages', type=int, default=500_000)
+    p.set_defaults(func=bench_emoji)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
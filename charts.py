@@ -0,0 +1,275 @@
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use('Agg') # Set backend to Agg for non-interactive plotting
+import matplotlib.pyplot as plt
+import seaborn as sns
+
+import helper
+
+
+# ──────────────────────────────────────────────
+#  CHART RENDERING POOL
+# ──────────────────────────────────────────────
+# The WhatsApp dashboard figures are independent of each other, so they are drawn
+# concurrently in a process pool (pyplot is not thread-safe, and rendering is CPU
+# bound). Workers are spawned once, import matplotlib/seaborn and draw a throwaway
+# figure up front so font and backend setup is not paid on the first request.
+# CHART_WORKERS=0 or 1 renders inline on the calling thread.
+CHART_WORKERS = int(os.environ.get("CHART_WORKERS", min(4, os.cpu_count() or 1)))
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def _png(fig):
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', bbox_inches='tight')
+    plt.close(fig)
+    return buf.getvalue()
+
+
+def _warm_up():
+    fig, ax = plt.subplots()
+    ax.plot([0, 1], [0, 1])
+    plt.xticks(rotation='vertical')
+    _png(fig)
+
+
+def line_chart(x, y, color):
+    fig, ax = plt.subplots()
+    ax.plot(x, y, color=color)
+    plt.xticks(rotation='vertical')
+    return _png(fig)
+
+
+def bar_chart(x, y, color):
+    fig, ax = plt.subplots()
+    ax.bar(x, y, color=color)
+    plt.xticks(rotation='vertical')
+    return _png(fig)
+
+
+def heatmap_chart(matrix):
+    fig, ax = plt.subplots()
+    sns.heatmap(matrix, ax=ax)
+    return _png(fig)
+
+
+def wordcloud_chart(frequencies):
+    wc = helper.new_wordcloud().generate_from_frequencies(frequencies)
+    fig, ax = plt.subplots()
+    ax.imshow(wc)
+    plt.axis('off') # Remove axis for image
+    return _png(fig)
+
+
+def pie_chart(values, labels):
+    fig, ax = plt.subplots()
+    ax.pie(values, labels=labels, autopct='%1.1f%%', startangle=90, colors=['green', 'red', 'grey'])
+    return _png(fig)
+
+
+RENDERERS = {
+    'line': line_chart,
+    'bar': bar_chart,
+    'heatmap': heatmap_chart,
+    'wordcloud': wordcloud_chart,
+    'pie': pie_chart,
+}
+
+
+def _render(kind, kwargs):
+    return RENDERERS[kind](**kwargs)
+
+
+def _get_pool(workers):
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # 'spawn' keeps workers clean of the (threaded) Flask parent's state
+            _pool = ProcessPoolExecutor(max_workers=workers,
+                                        mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_warm_up)
+            _pool_workers = workers
+        return _pool
+
+
+def start(workers=None):
+    """Spawn and warm the pool ahead of the first request."""
+    workers = CHART_WORKERS if workers is None else workers
+    if workers <= 1:
+        return
+    pool = _get_pool(workers)
+    # One no-op per worker forces every process to spawn and run _warm_up now
+    for future in [pool.submit(int) for _ in range(workers)]:
+        future.result()
+
+
+def shutdown():
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = None
+        _pool_workers = 0
+
+
+def render_all(jobs, workers=None):
+    """Render {name: (kind, kwargs)} chart jobs and return {name: png bytes}.
+
+    ``kind`` is a key of RENDERERS and ``kwargs`` its (picklable) plot data.
+    """
+    workers = CHART_WORKERS if workers is None else workers
+    if workers <= 1 or len(jobs) <= 1:
+        return {name: _render(kind, kwargs) for name, (kind, kwargs) in jobs.items()}
+
+    pool = _get_pool(workers)
+    futures = {name: pool.submit(_render, kind, kwargs) for name, (kind, kwargs) in jobs.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+
+# ──────────────────────────────────────────────
+#  DATA-ONLY CHARTS (drawn in the browser)
+# ──────────────────────────────────────────────
+# The interactive dashboards can ask for the series behind each chart instead of a
+# PNG; frontend/js/main.js (drawChart) draws them on a <canvas>, so matplotlib stays
+# off the request path. Series are column-oriented lists to keep the JSON small.
+SERIES_TOP_WORDS = 100
+
+
+def chart_series(kind, kwargs):
+    """JSON-ready data for a (kind, kwargs) chart job, as understood by drawChart."""
+    if kind in ('line', 'bar'):
+        return {'kind': kind, 'x': [str(v) for v in kwargs['x']], 'y': list(kwargs['y']), 'color': kwargs['color']}
+    if kind == 'heatmap':
+        matrix = kwargs['matrix']
+        return {'kind': 'heatmap',
+                'rows': [str(v) for v in matrix.index],
+                'columns': [str(v) for v in matrix.columns],
+                'values': matrix.values.tolist()}
+    if kind == 'wordcloud':
+        top = sorted(kwargs['frequencies'].items(), key=lambda kv: kv[1], reverse=True)[:SERIES_TOP_WORDS]
+        return {'kind': 'wordcloud', 'words': [w for w, _ in top], 'weights': [n for _, n in top]}
+    if kind == 'pie':
+        return {'kind': 'pie', 'labels': list(kwargs['labels']), 'values': list(kwargs['values']),
+                'colors': ['green', 'red', 'grey']}
+    raise ValueError(f"Unknown chart kind: {kind}")
+
+
+# ──────────────────────────────────────────────
+#  CONTENT-ADDRESSED CHART STORE
+# ──────────────────────────────────────────────
+# A rendered chart is fully determined by the chat content, the selected user, the
+# chart name and the renderer code, so it is stored once on disk under a hash of
+# those and served by URL (with the hash as a strong ETag). Repeat views of the same
+# chat/user skip both the plot data and the rendering. Bump CHART_STYLE_VERSION
+# whenever a renderer or the data fed to it changes so old images are not reused.
+# Charts of replaced chats and old style versions are never asked for again, so the
+# store is kept under CHART_STORE_MAX_MB by dropping the least recently used images
+# (a chart's mtime is bumped whenever render_cached serves it).
+CHART_STYLE_VERSION = 2
+CHART_STORE_MAX_MB = int(os.environ.get("CHART_STORE_MAX_MB", "256"))
+# Leftover .tmp files from a crashed write are removed after this many seconds
+CHART_TMP_MAX_AGE = 3600
+CHART_KEY_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def chart_key(content_hash, selected_user, name):
+    raw = f"{content_hash}|{selected_user}|{name}|{CHART_STYLE_VERSION}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def chart_path(folder, key):
+    return os.path.join(folder, f"{key}.png")
+
+
+def load_png(folder, key):
+    """Return the stored PNG bytes for a chart key, or None."""
+    if not CHART_KEY_RE.match(key):
+        return None
+    try:
+        with open(chart_path(folder, key), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def save_png(folder, key, png):
+    path = chart_path(folder, key)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(png)
+    os.replace(tmp_path, path)
+
+
+def render_cached(folder, content_hash, selected_user, builders, workers=None):
+    """Return {name: key} for the charts in ``builders``, rendering only missing ones.
+
+    ``builders`` maps a chart name to a zero-argument callable returning its
+    (kind, kwargs) job, so plot data is only computed for charts not yet stored.
+    """
+    keys = {name: chart_key(content_hash, selected_user, name) for name in builders}
+    missing = {}
+    for name, key in keys.items():
+        try:
+            os.utime(chart_path(folder, key))
+        except FileNotFoundError:
+            missing[name] = builders[name]()
+    if missing:
+        for name, png in render_all(missing, workers).items():
+            save_png(folder, keys[name], png)
+        sweep(folder, keep=keys.values())
+    print(f"[Charts] {len(keys) - len(missing)}/{len(keys)} charts served from the chart store")
+    return keys
+
+
+def sweep(folder, max_bytes=None, keep=()):
+    """Delete least recently used charts until the store fits in ``max_bytes``.
+
+    Keys in ``keep`` (the charts just handed out) are never removed. Returns the
+    number of files deleted.
+    """
+    max_bytes = CHART_STORE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+    keep = {chart_path(folder, key) for key in keep}
+    now = time.time()
+    entries, total, removed = [], 0, 0
+    for entry in os.scandir(folder):
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        if entry.name.endswith('.tmp'):
+            if now - stat.st_mtime > CHART_TMP_MAX_AGE:
+                removed += _remove(entry.path)
+        elif entry.name.endswith('.png'):
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+    for mtime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path in keep:
+            continue
+        removed += _remove(path)
+        total -= size
+    if removed:
+        print(f"[Charts] Removed {removed} old chart files from the chart store")
+    return removed
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return 1
+    except FileNotFoundError:
+        return 0
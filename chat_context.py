@@ -0,0 +1,123 @@
+import os
+import re
+
+
+# ──────────────────────────────────────────────
+#  CHAT CONTEXT BUDGET (prompt assembly for /api/chat)
+# ──────────────────────────────────────────────
+# The chat prompt is made of sections (scope, toxicity table, retrieved lines,
+# recent messages, frontend summary). Each is a header plus lines, and sections
+# are filled in priority order until CHAT_CONTEXT_TOKENS (estimated) is spent.
+# ``max_share`` caps a section's part of the budget, so the long ones (retrieved
+# and recent lines) can't starve the rest. A section that gets no lines is left
+# out, and the sections are written in their original order. Retrieved lines that
+# repeat (or nearly repeat) another line are dropped first, so the budget goes to
+# distinct messages.
+CHAT_CONTEXT_TOKENS = int(os.environ.get("CHAT_CONTEXT_TOKENS", "3000"))
+# Word-set overlap (Jaccard) from which two lines count as near-duplicates
+DEDUP_SIMILARITY = 0.8
+
+_WORD_RE = re.compile(r'\w+')
+# "[2024-01-05 10:00] " prefix of chat lines; dates don't make lines distinct
+_DATE_PREFIX_RE = re.compile(r'^\[[^\]]*\]\s*')
+
+
+def estimate_tokens(text):
+    """~4 characters a token (the same estimate the embedding batcher uses)."""
+    return len(text) // 4 + 1
+
+
+class Section:
+    """A block of the prompt: an optional header line, lines, and an optional footer.
+
+    ``priority``: higher sections are filled first. ``max_share``: cap as a fraction
+    of the budget. ``keep``: which end survives a cut ("head" or "tail", e.g. the
+    newest of the recent messages). ``empty``: line used when there are no lines.
+    """
+
+    def __init__(self, name, lines, header=None, footer=None, priority=0, max_share=1.0, keep="head", empty=None):
+        self.name = name
+        self.lines = list(lines)
+        self.header = header
+        self.footer = footer
+        self.priority = priority
+        self.max_share = max_share
+        self.keep = keep
+        self.empty = empty
+
+
+def _shingles(line):
+    return frozenset(_WORD_RE.findall(_DATE_PREFIX_RE.sub('', line).casefold()))
+
+
+def dedupe_lines(lines, against=(), threshold=DEDUP_SIMILARITY):
+    """``lines`` without those whose word set overlaps an earlier line (or one of
+    ``against``) by at least ``threshold``. Returns (kept lines, number dropped)."""
+    kept, seen = [], [_shingles(line) for line in against]
+    for line in lines:
+        words = _shingles(line)
+        if any(words == other or (words and other and len(words & other) / len(words | other) >= threshold)
+               for other in seen):
+            continue
+        seen.append(words)
+        kept.append(line)
+    return kept, len(lines) - len(kept)
+
+
+def _fit(section, allowance):
+    """(text, tokens, lines used) of ``section`` within ``allowance`` tokens, or None."""
+    fixed = [part for part in (section.header, section.footer) if part]
+    cost = sum(estimate_tokens(part) for part in fixed)
+    lines = section.lines or ([section.empty] if section.empty else [])
+    if not lines or cost >= allowance:
+        return None
+    ordered = lines if section.keep == "head" else lines[::-1]
+    taken = []
+    for line in ordered:
+        tokens = estimate_tokens(line)
+        if cost + tokens > allowance:
+            break
+        taken.append(line)
+        cost += tokens
+    if not taken:
+        # Not even one line fits: cut the first one down to what's left
+        room = (allowance - cost - 1) * 4
+        if room < 40:
+            return None
+        taken = [ordered[0][:room - 1] + "…"]
+        cost += estimate_tokens(taken[0])
+    if section.keep != "head":
+        taken.reverse()
+    body = "\n".join(taken)
+    text = "\n".join(([section.header] if section.header else []) + [body] + ([section.footer] if section.footer else []))
+    return text, cost, len(taken) if section.lines else 0
+
+
+def assemble(sections, budget=CHAT_CONTEXT_TOKENS):
+    """(context text, report) for ``sections`` within ``budget`` estimated tokens.
+
+    The report maps each section name to {"tokens", "lines", "of"}.
+    """
+    remaining = budget
+    placed = {}
+    report = {}
+    for section in sorted(sections, key=lambda s: -s.priority):
+        fitted = _fit(section, min(remaining, int(budget * section.max_share)))
+        report[section.name] = {"tokens": 0, "lines": 0, "of": len(section.lines)}
+        if fitted is None:
+            continue
+        text, tokens, used = fitted
+        placed[section.name] = text
+        report[section.name].update(tokens=tokens, lines=used)
+        remaining -= tokens
+    text = "\n\n".join(placed[s.name] for s in sections if s.name in placed)
+    return text, report
+
+
+def describe(report):
+    """Short log form of an assemble() report: name tokens (kept/total lines)."""
+    parts = []
+    for name, r in report.items():
+        cut = f" ({r['lines']}/{r['of']} lines)" if r['of'] and r['lines'] < r['of'] else ""
+        parts.append(f"{name} {r['tokens']}{cut}")
+    return ", ".join(parts)
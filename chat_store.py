@@ -0,0 +1,310 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# ──────────────────────────────────────────────
+#  COLUMNAR CHAT CACHE (Parquet, one file per upload)
+# ──────────────────────────────────────────────
+# Bump SCHEMA_VERSION whenever the processed DataFrame changes shape (new/renamed
+# columns, different dtypes). Caches written by an older version are treated as a
+# miss and rebuilt from the raw export instead of crashing the dashboard.
+SCHEMA_VERSION = 2
+METADATA_KEY = b"chat_cache"
+# Row groups let filtered reads skip decoding most of a large chat
+ROW_GROUP_SIZE = 64 * 1024
+
+
+def _cache_path(folder, file_id):
+    return os.path.join(folder, f"{file_id}.parquet")
+
+
+def file_digest(path, chunk_size=1024 * 1024, limit=None):
+    """SHA-256 of a raw export (or of its first ``limit`` bytes), used to
+    content-address anything derived from it."""
+    digest = hashlib.sha256()
+    remaining = limit
+    with open(path, 'rb') as f:
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return digest.hexdigest()
+
+
+def user_list_of(users):
+    """Dashboard user list: 'Overall' first, then real senders sorted."""
+    user_list = sorted(u for u in users if u != 'group_notification')
+    user_list.insert(0, "Overall")
+    return user_list
+
+
+def save_chat(df, folder, file_id, content_hash=None):
+    """Write the processed chat as Parquet with a schema version, the user list, the
+    raw export's content hash and the header formats it was parsed with."""
+    path = _cache_path(folder, file_id)
+    meta = {
+        "schema_version": SCHEMA_VERSION,
+        "users": user_list_of(df['user'].unique().tolist()),
+        "rows": len(df),
+        "content_hash": content_hash,
+        "formats": df.attrs.get('formats'),
+    }
+    # preserve_index=True stores the row id as a real column, so a loaded chat keeps
+    # each message's original row id (it keys the toxicity and vector indexes)
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), METADATA_KEY: json.dumps(meta).encode()})
+    tmp_path = path + ".tmp"
+    pq.write_table(table, tmp_path, row_group_size=ROW_GROUP_SIZE)
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_meta(folder, file_id):
+    """Return the cache metadata dict, or None if the cache is missing or stale."""
+    path = _cache_path(folder, file_id)
+    if not os.path.exists(path):
+        return None
+    try:
+        metadata = pq.read_schema(path).metadata or {}
+        meta = json.loads(metadata.get(METADATA_KEY, b"{}"))
+    except Exception as e:
+        print(f"[ChatCache] Unreadable cache {path}: {e}")
+        return None
+    if meta.get("schema_version") != SCHEMA_VERSION:
+        print(f"[ChatCache] STALE schema for {file_id} (v{meta.get('schema_version')} != v{SCHEMA_VERSION})")
+        return None
+    return meta
+
+
+def load_chat(folder, file_id):
+    """Load a processed chat from the columnar cache (memory-mapped).
+
+    Returns None on a miss or stale cache.
+    """
+    if read_meta(folder, file_id) is None:
+        return None
+    path = _cache_path(folder, file_id)
+    try:
+        table = pq.read_table(path, memory_map=True, use_pandas_metadata=True)
+        # Row id order; caches from earlier versions were stored clustered by user
+        return table.to_pandas().sort_index()
+    except Exception as e:
+        print(f"[ChatCache] Failed to read {path}: {e}")
+        return None
+
+
+# ──────────────────────────────────────────────
+#  EXPORT REGISTRY (recognizing a newer export of a stored chat)
+# ──────────────────────────────────────────────
+# WhatsApp exports of the same chat grow at the end: last week's export is a byte
+# prefix of this week's. exports.json maps a digest of an export's first HEAD_BYTES
+# to the uploads starting with those bytes, with the size and full digest of the
+# export each one was built from. A new upload looks up its own head digest and
+# confirms a candidate by hashing its first `size` bytes against `content_hash`.
+EXPORTS_INDEX = "exports.json"
+HEAD_BYTES = 4096
+_exports_lock = threading.Lock()
+
+
+def _read_exports(folder):
+    path = os.path.join(folder, EXPORTS_INDEX)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[ChatCache] Unreadable export registry {path}: {e}")
+        return {}
+
+
+def head_digest(path):
+    """Digest of an export's first HEAD_BYTES, or None for exports shorter than that."""
+    if os.path.getsize(path) < HEAD_BYTES:
+        return None
+    return file_digest(path, limit=HEAD_BYTES)
+
+
+def register_export(folder, file_id, path, content_hash):
+    """Record that upload ``file_id`` now holds the export at ``path``."""
+    head = head_digest(path)
+    with _exports_lock:
+        exports = _read_exports(folder)
+        for uploads in exports.values():
+            uploads.pop(file_id, None)
+        if head is not None:
+            exports.setdefault(head, {})[file_id] = {"size": os.path.getsize(path), "content_hash": content_hash}
+        exports = {h: uploads for h, uploads in exports.items() if uploads}
+        index_path = os.path.join(folder, EXPORTS_INDEX)
+        with open(index_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(exports, f)
+        os.replace(index_path + ".tmp", index_path)
+
+
+def find_base_export(folder, path):
+    """Return (file_id, size) of the largest stored export that ``path`` starts with, or None.
+
+    size == os.path.getsize(path) means the very same export was uploaded again.
+    """
+    head = head_digest(path)
+    if head is None:
+        return None
+    with _exports_lock:
+        uploads = dict(_read_exports(folder).get(head, {}))
+    new_size = os.path.getsize(path)
+    for file_id, info in sorted(uploads.items(), key=lambda item: -item[1]["size"]):
+        if info["size"] > new_size or read_meta(folder, file_id) is None:
+            continue
+        if file_digest(path, limit=info["size"]) == info["content_hash"]:
+            return file_id, info["size"]
+    return None
+
+
+# ──────────────────────────────────────────────
+#  IN-PROCESS LRU CACHE (shared by all request threads)
+# ──────────────────────────────────────────────
+def frame_nbytes(value, _seen=None):
+    """Approximate resident size of a cached value: DataFrames (deep), NumPy arrays,
+    objects with an ``nbytes()`` method (e.g. text_index.TextIndex), and the dicts,
+    lists and strings around them (e.g. the toxicity index). Shared objects count once."""
+    if _seen is None:
+        _seen = set()
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if callable(getattr(value, 'nbytes', None)):
+        return int(value.nbytes())
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(frame_nbytes(k, _seen) + frame_nbytes(v, _seen) for k, v in value.items())
+    if isinstance(value, (tuple, list, set, frozenset)):
+        return sys.getsizeof(value) + sum(frame_nbytes(v, _seen) for v in value)
+    return sys.getsizeof(value)
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by total bytes, with single-flight loading.
+
+    Concurrent ``get_or_load`` calls for the same missing key run the loader once;
+    the other callers wait for that result. Entries larger than the whole budget are
+    returned but not kept. A loader returning None (e.g. upload deleted) is not cached.
+    """
+
+    def __init__(self, max_bytes, sizeof=frame_nbytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self._inflight = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _InFlight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        nbytes = None
+        try:
+            call.value = loader()
+            if call.value is not None:
+                # Sizing a large frame takes a while; do it outside the lock
+                nbytes = self.sizeof(call.value)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+                if nbytes is not None:
+                    self._put_locked(key, call.value, nbytes)
+            call.done.set()
+        return call.value
+
+    def put(self, key, value):
+        nbytes = self.sizeof(value)
+        with self._lock:
+            self._put_locked(key, value, nbytes)
+
+    def resize(self, key, value):
+        """Re-measure ``key`` after its value grew in place (e.g. an index attached to a
+        cached chat on first use), evicting to stay within the budget."""
+        nbytes = self.sizeof(value)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] is not value:
+                return
+            self._put_locked(key, value, nbytes)
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+
+    def _put_locked(self, key, value, nbytes):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        if nbytes > self.max_bytes:
+            return
+        self._entries[key] = (value, nbytes)
+        self._bytes += nbytes
+        while self._bytes > self.max_bytes:
+            _, (_, evicted_bytes) = self._entries.popitem(last=False)
+            self._bytes -= evicted_bytes
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+            }
@@ -0,0 +1,399 @@
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction
+from chromadb.utils.embedding_functions import register_embedding_function
+
+
+# ──────────────────────────────────────────────
+#  EMBEDDING CACHE (SQLite, shared across uploads)
+# ──────────────────────────────────────────────
+# Every embedded text is stored as a float32 vector under (model, text hash), so a
+# re-uploaded chat, or the same message in another chat, is never sent to the
+# embedding API twice. Identical texts within a batch are embedded once as well.
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", os.path.join("uploads", "embedding_cache.sqlite"))
+EMBED_BATCH_SIZE = 100
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH = 900
+
+
+def model_key(ef, query=False):
+    """Cache namespace for an embedding function: provider, model and output size.
+
+    Queries get their own namespace, since some models embed them differently.
+    """
+    parts = [ef.name() if hasattr(type(ef), 'name') else type(ef).__name__,
+             str(getattr(ef, 'model_name', '') or ''), str(getattr(ef, 'dimension', '') or '')]
+    if query:
+        parts.append('query')
+    return ':'.join(parts)
+
+
+def text_hash(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+class EmbeddingCache:
+    def __init__(self, path=EMBEDDING_CACHE_PATH):
+        self.path = path
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS embeddings "
+                     "(model TEXT NOT NULL, hash BLOB NOT NULL, vector BLOB NOT NULL, PRIMARY KEY (model, hash))")
+        return conn
+
+    def get(self, model, hashes):
+        """{hash: float32 vector} for the hashes already cached under ``model``."""
+        found = {}
+        conn = self._connect()
+        try:
+            for i in range(0, len(hashes), _SQL_BATCH):
+                batch = hashes[i:i + _SQL_BATCH]
+                rows = conn.execute(f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN "
+                                    f"({','.join('?' * len(batch))})", [model, *batch])
+                found.update((h, np.frombuffer(v, dtype='<f4')) for h, v in rows)
+        finally:
+            conn.close()
+        return found
+
+    def put(self, model, items):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                                 [(model, h, np.asarray(v, dtype='<f4').tobytes()) for h, v in items])
+        finally:
+            conn.close()
+
+
+# ──────────────────────────────────────────────
+#  RATE-AWARE BATCHER (concurrent, adaptive, retrying)
+# ──────────────────────────────────────────────
+# Misses are sent by a small thread pool (EMBED_CONCURRENCY requests in flight)
+# through token buckets shared by every index in the process, so concurrent uploads
+# together stay under EMBED_RPM requests and EMBED_TPM tokens per minute (0 = no
+# limit). Quota and transient errors are retried with exponential backoff and
+# jitter, honouring Retry-After when the error carries one; they also pause the
+# other workers and halve the batch size, which grows back one step per success
+# (AIMD). Each finished batch is cached and handed to the caller right away, so an
+# interrupted run resumes from what was already embedded.
+EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", "4"))
+EMBED_RPM = float(os.environ.get("EMBED_RPM", "0"))
+EMBED_TPM = float(os.environ.get("EMBED_TPM", "0"))
+EMBED_MAX_RETRIES = int(os.environ.get("EMBED_MAX_RETRIES", "6"))
+# Request size cap in estimated tokens (~4 characters each)
+EMBED_BATCH_TOKENS = int(os.environ.get("EMBED_BATCH_TOKENS", "20000"))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+_RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+_RETRY_MARKERS = ("429", "resource_exhausted", "resourceexhausted", "quota", "rate limit", "too many requests",
+                  "503", "unavailable", "deadline exceeded", "timed out")
+
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    """Blocking token bucket refilled at ``per_minute`` units a minute (0 = unlimited).
+
+    Bursts are capped at ``burst_seconds`` worth of the rate, so a fresh bucket
+    can't spend a whole minute's allowance at once.
+    """
+
+    def __init__(self, per_minute, burst_seconds=10):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self._tokens = self.capacity
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """Take ``amount`` units, sleeping until they are available; returns the seconds waited."""
+        if self.rate <= 0:
+            return 0.0
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return waited
+                delay = (amount - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+# Shared by all batchers, since they all draw on the same API quota
+request_bucket = TokenBucket(EMBED_RPM)
+token_bucket = TokenBucket(EMBED_TPM)
+
+
+def _status_code(e):
+    for source in (e, getattr(e, 'response', None)):
+        for attr in ('code', 'status_code', 'status'):
+            value = getattr(source, attr, None)
+            if isinstance(value, int):
+                return value
+    return None
+
+
+def is_retryable(e):
+    """Quota (429) and transient server/network errors are worth retrying."""
+    if isinstance(e, (ConnectionError, TimeoutError, urllib.error.URLError)) and not isinstance(e, urllib.error.HTTPError):
+        return True
+    status = _status_code(e)
+    if status is not None:
+        return status in _RETRY_STATUS
+    return any(marker in str(e).lower() for marker in _RETRY_MARKERS)
+
+
+def retry_after(e):
+    """Seconds the server asked to wait (Retry-After header), if any."""
+    for source in (e, getattr(e, 'response', None)):
+        headers = getattr(source, 'headers', None)
+        value = headers.get('Retry-After') if headers is not None and hasattr(headers, 'get') else None
+        if value is not None:
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                return None
+    return None
+
+
+class EmbeddingBatcher:
+    """Embeds texts through ``ef`` with the cache, bounded concurrency, rate limits and retries."""
+
+    def __init__(self, ef, cache=None, query=False, batch_size=EMBED_BATCH_SIZE, concurrency=EMBED_CONCURRENCY,
+                 max_batch_tokens=EMBED_BATCH_TOKENS, max_retries=EMBED_MAX_RETRIES,
+                 requests=None, tokens=None):
+        self.ef = ef
+        self.cache = cache
+        self.query = query
+        self.model = model_key(ef, query=query)
+        self.max_batch_size = max(1, batch_size)
+        self.batch_size = self.max_batch_size
+        self.concurrency = max(1, concurrency)
+        self.max_batch_tokens = max_batch_tokens
+        self.max_retries = max_retries
+        self.requests = requests or request_bucket
+        self.tokens = tokens or token_bucket
+        self.calls = 0
+        self.retries = 0
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def _next_batch(self, pending, unique):
+        batch, budget = [], 0
+        while pending and len(batch) < self.batch_size:
+            cost = estimate_tokens(unique[pending[0]])
+            if batch and budget + cost > self.max_batch_tokens:
+                break
+            batch.append(pending.popleft())
+            budget += cost
+        return batch
+
+    def _call(self, texts):
+        # Wait out a quota pause signalled by any worker, then the rate limits
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.requests.acquire(1)
+        self.tokens.acquire(sum(estimate_tokens(t) for t in texts))
+        call = self.ef.embed_query if self.query and hasattr(self.ef, 'embed_query') else self.ef
+        with self._lock:
+            self.calls += 1
+        vectors = call(texts)
+        if len(vectors) != len(texts):
+            raise ValueError(f"Embedding function returned {len(vectors)} vectors for {len(texts)} texts")
+        return [np.asarray(v, dtype=np.float32) for v in vectors]
+
+    def _embed_batch(self, texts):
+        """Embed one batch, retrying failed parts in smaller pieces after a backoff."""
+        vectors, attempt = [], 0
+        while len(vectors) < len(texts):
+            part = texts[len(vectors):len(vectors) + self.batch_size]
+            try:
+                vectors.extend(self._call(part))
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                delay = retry_after(e)
+                if delay is None:
+                    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+                with self._lock:
+                    self.retries += 1
+                    self.batch_size = max(1, self.batch_size // 2)
+                    self._resume_at = max(self._resume_at, time.monotonic() + delay)
+                print(f"⏳ Embedding request failed ({str(e)[:120]}); retry {attempt}/{self.max_retries} "
+                      f"in {delay:.1f}s with batches of {self.batch_size}")
+                continue
+            attempt = 0
+            with self._lock:
+                self.batch_size = min(self.max_batch_size, self.batch_size + max(1, self.max_batch_size // 10))
+        return vectors
+
+    def embed(self, texts, on_batch=None):
+        """float32 matrix of embeddings aligned with ``texts``.
+
+        Identical texts are embedded once and cached vectors are reused. When given,
+        ``on_batch(positions, vectors)`` is called (in this thread) as vectors
+        become available: ``positions`` index into ``texts``, cached ones first.
+        """
+        unique = list(dict.fromkeys(texts))
+        hashes = [text_hash(t) for t in unique]
+        slot = {t: i for i, t in enumerate(unique)}
+        positions = [[] for _ in unique]
+        for pos, text in enumerate(texts):
+            positions[slot[text]].append(pos)
+
+        vectors = {}
+        cache = self.cache
+        if cache is not None:
+            try:
+                vectors = cache.get(self.model, hashes)
+            except sqlite3.Error as e:
+                print(f"⚠️ Embedding cache unavailable ({cache.path}): {e}")
+                cache = None
+        found = [i for i, h in enumerate(hashes) if h in vectors]
+        missing = [i for i, h in enumerate(hashes) if h not in vectors]
+
+        def deliver(slots):
+            if on_batch is None or not slots:
+                return
+            pos = [p for i in slots for p in positions[i]]
+            on_batch(pos, np.vstack([vectors[hashes[slot[texts[p]]]] for p in pos]))
+
+        deliver(found)
+        error = None
+        pending = deque(missing)
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embed") as pool:
+            in_flight = {}
+            while in_flight or (pending and error is None):
+                while pending and error is None and len(in_flight) < self.concurrency:
+                    batch = self._next_batch(pending, unique)
+                    in_flight[pool.submit(self._embed_batch, [unique[i] for i in batch])] = batch
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    batch = in_flight.pop(future)
+                    try:
+                        new = dict(zip((hashes[i] for i in batch), future.result()))
+                    except Exception as e:
+                        # Stop sending, but keep (and cache) the batches already in flight
+                        error = error or e
+                        continue
+                    vectors.update(new)
+                    if cache is not None:
+                        try:
+                            cache.put(self.model, new.items())
+                        except sqlite3.Error as e:
+                            print(f"⚠️ Failed to update embedding cache: {e}")
+                    deliver(batch)
+        if not self.query:
+            print(f"[Embeddings] {len(texts)} texts, {len(unique)} distinct, {len(missing)} to embed "
+                  f"({len(found)} from cache), {self.calls} requests, {self.retries} retries")
+        if error is not None:
+            raise error
+
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.vstack([vectors[hashes[slot[t]]] for t in texts])
+
+
+def embed(texts, ef, cache=None, query=False, batch_size=EMBED_BATCH_SIZE):
+    """float32 matrix of embeddings aligned with ``texts`` (see EmbeddingBatcher.embed).
+
+    ``cache=None`` disables the cache.
+    """
+    return EmbeddingBatcher(ef, cache, query=query, batch_size=batch_size).embed(texts)
+
+
+# ──────────────────────────────────────────────
+#  LOCAL STUB EMBEDDING FUNCTION
+# ──────────────────────────────────────────────
+_TOKEN_RE = re.compile(r"\w+")
+
+
+@register_embedding_function
+class HashEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Deterministic, offline embedding function for tests and local runs without an
+    API key (EMBEDDING_FUNCTION=hash). Words and character trigrams are hashed into
+    ``dimension`` buckets and the vector is L2-normalized, so texts sharing words
+    land close together; it is not a semantic model."""
+
+    def __init__(self, dimension=256):
+        self.dimension = dimension
+
+    def __call__(self, input):
+        vectors = np.zeros((len(input), self.dimension), dtype=np.float32)
+        for row, text in enumerate(input):
+            for token in _TOKEN_RE.findall(text.lower()):
+                vectors[row, zlib.crc32(token.encode('utf-8')) % self.dimension] += 1.0
+                padded = f" {token} "
+                for i in range(len(padded) - 2):
+                    vectors[row, zlib.crc32(padded[i:i + 3].encode('utf-8')) % self.dimension] += 0.5
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return list(vectors / np.where(norms == 0, 1, norms))
+
+    @staticmethod
+    def name():
+        return "hash_stub"
+
+    def get_config(self):
+        return {"dimension": self.dimension}
+
+    @staticmethod
+    def build_from_config(config):
+        return HashEmbeddingFunction(dimension=config.get("dimension", 256))
+
+
+@register_embedding_function
+class HttpEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Embeddings from an OpenAI-compatible HTTP endpoint (EMBEDDING_FUNCTION=http with
+    EMBEDDING_URL / EMBEDDING_MODEL): a self-hosted model, or a local fake server to
+    exercise the batcher's rate limiting and retries. HTTP errors are raised as
+    urllib.error.HTTPError, so 429s and Retry-After reach the retry logic."""
+
+    def __init__(self, url, model_name="", timeout=60):
+        self.url = url
+        self.model_name = model_name
+        self.timeout = timeout
+
+    def __call__(self, input):
+        body = json.dumps({"model": self.model_name, "input": list(input)}).encode('utf-8')
+        req = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            data = json.load(resp)["data"]
+        return [np.asarray(item["embedding"], dtype=np.float32)
+                for item in sorted(data, key=lambda item: item.get("index", 0))]
+
+    @staticmethod
+    def name():
+        return "http_embeddings"
+
+    def get_config(self):
+        return {"url": self.url, "model_name": self.model_name}
+
+    @staticmethod
+    def build_from_config(config):
+        return HttpEmbeddingFunction(config["url"], config.get("model_name", ""))
@@ -0,0 +1,92 @@
+import re
+import threading
+
+import emoji
+import numpy as np
+import pandas as pd
+
+from token_stats import scope_counts
+from toxicity import trie_regex
+
+
+# ──────────────────────────────────────────────
+#  EMOJI INDEX (one compiled matcher, counted once per chat)
+# ──────────────────────────────────────────────
+# Every key of emoji.EMOJI_DATA goes into one trie regex. Matches are greedy, so
+# multi-codepoint emoji (ZWJ families, skin tones, flags, keycaps) are counted as the
+# single emoji they render as, instead of one hit per codepoint. A lookahead for a
+# non-ASCII codepoint (optionally after a keycap base) rejects plain text before the
+# large trie alternation is tried.
+# Every emoji has a non-ASCII codepoint, so ASCII-only messages are skipped. The rest
+# are joined and scanned in one findall, and each match is mapped back to its message
+# and user. The result is a long-form user / emoji / count table with the same
+# first-occurrence ranks as token_stats, so any scope is a slice.
+# Every emoji starts with a non-ASCII codepoint, or with #, * or a digit followed by one
+_CANDIDATE = r'(?=[#*0-9]?[^\x00-\x7f])'
+# The trie's top level has ~1,400 alternatives, tried one by one. Splitting it into
+# 64-codepoint blocks, each behind a range check, cuts that to a few dozen.
+_BLOCK_BITS = 6
+# Joins the candidate messages for a single scan; chat text doesn't contain NUL
+_SEPARATOR = '\x00'
+
+_matcher = None
+_scanner = None
+_matcher_lock = threading.Lock()
+
+
+def _matcher_pattern(emojis):
+    blocks = {}
+    for e in emojis:
+        blocks.setdefault(ord(e[0]) >> _BLOCK_BITS, []).append(e)
+    parts = []
+    for block, members in sorted(blocks.items()):
+        lo, hi = chr(block << _BLOCK_BITS), chr(((block + 1) << _BLOCK_BITS) - 1)
+        parts.append(f"(?=[{re.escape(lo)}-{re.escape(hi)}])(?:{trie_regex(members)})")
+    return _CANDIDATE + '(?:' + '|'.join(parts) + ')'
+
+
+def get_matcher():
+    """Compiled regex matching any emoji in emoji.EMOJI_DATA (longest match wins)."""
+    global _matcher, _scanner
+    with _matcher_lock:
+        if _matcher is None:
+            _matcher = re.compile(_matcher_pattern(emoji.EMOJI_DATA))
+            # Same, plus the message separator used by build_table
+            _scanner = re.compile(re.escape(_SEPARATOR) + '|' + _matcher.pattern)
+        return _matcher
+
+
+def build_table(df):
+    """Per-user emoji counts: DataFrame[user (category), emoji, count, user_rank, rank]."""
+    get_matcher()  # compiles _scanner too
+    messages = df['message'].tolist()
+    candidates = [i for i, m in enumerate(messages) if isinstance(m, str) and not m.isascii()]
+    text = _SEPARATOR.join([messages[i].replace(_SEPARATOR, '') for i in candidates])
+    # One findall over the joined messages; counting the separators before each match
+    # gives its message, without a Python call per match
+    found = _scanner.findall(text)
+    is_separator = np.fromiter((f == _SEPARATOR for f in found), dtype=bool, count=len(found))
+    rows = np.asarray(candidates, dtype=np.int64)[np.cumsum(is_separator)[~is_separator]]
+    found = np.array(found, dtype=object)[~is_separator]
+
+    user_codes, users = pd.factorize(df['user'].to_numpy(dtype=object)[rows])
+    # factorize numbers values by first occurrence: emoji codes are the overall rank,
+    # and (user, emoji) pairs come out in chat order
+    emoji_codes, emojis = pd.factorize(found)
+    pair_codes, pairs = pd.factorize(user_codes.astype(np.int64) * max(len(emojis), 1) + emoji_codes)
+    pair_user, pair_emoji = np.divmod(pairs, max(len(emojis), 1))
+
+    table = pd.DataFrame({
+        'user': pd.Categorical(np.asarray(users, dtype=object)[pair_user]),
+        'emoji': pd.Series(np.asarray(emojis, dtype=object)[pair_emoji], dtype=str),
+        'count': np.bincount(pair_codes, minlength=len(pairs)).astype('int64'),
+        'rank': pair_emoji.astype('int64'),
+    })
+    table.insert(3, 'user_rank', table.groupby('user', observed=True).cumcount().astype('int64'))
+    return table
+
+
+def emoji_counts(selected_user, table):
+    """Same frame as the old helper.emoji_helper: columns emoji / count, most used first."""
+    scoped = scope_counts(selected_user, table, key='emoji')
+    return pd.DataFrame({'emoji': scoped['emoji'].tolist(), 'count': scoped['count'].tolist()})
@@ -94,7 +94,7 @@ function initChatbot() {
         chatMessages.scrollTop = chatMessages.scrollHeight;
 
         try {
-            const response = await fetch(`${BACKEND_URL}/api/chat`, {
+            const response = await fetch(`${BACKEND_URL}/api/chat/stream`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ 
@@ -104,16 +104,23 @@ function initChatbot() {
                     file_id: fileId 
                 })
             });
-            const data = await response.json();
+            if (!response.ok || !response.body) throw new Error(`HTTP ${response.status}`);
 
+            // The typing indicator becomes the bot message once the first chunk arrives
+            let botEl = null;
+            await readChatStream(response, (text) => {
+                if (!botEl) {
+                    const typingEl = document.getElementById(typingId);
+                    if (typingEl) typingEl.remove();
+                    chatMessages.insertAdjacentHTML('beforeend', '<div class="message-wrapper left"><div class="chat-message bot-message"></div></div>');
+                    botEl = chatMessages.lastElementChild.querySelector('.bot-message');
+                }
+                botEl.innerHTML = text.replace(/\*\*(.*?)\*\*/g, '<b>$1</b>');
+                chatMessages.scrollTop = chatMessages.scrollHeight;
+            });
             const typingEl = document.getElementById(typingId);
             if (typingEl) typingEl.remove();
 
-            // Append Bot Message
-            let botMsg = data.response.replace(/\*\*(.*?)\*\*/g, '<b>$1</b>');
-            chatMessages.innerHTML += `<div class="message-wrapper left"><div class="chat-message bot-message">${botMsg}</div></div>`;
-            chatMessages.scrollTop = chatMessages.scrollHeight;
-
         } catch (error) {
             console.error("Chat Error:", error);
             const typingEl = document.getElementById(typingId);
@@ -132,6 +139,32 @@ function initChatbot() {
     }
 }
 
+// Reads a /api/chat/stream response (Server-Sent Events) and calls onText with the
+// answer so far after every chunk. Resolves with the full answer.
+async function readChatStream(response, onText) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let text = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let end;
+        while ((end = buffer.indexOf('\n\n')) !== -1) {
+            const frame = buffer.slice(0, end);
+            buffer = buffer.slice(end + 2);
+            const event = (frame.match(/^event: (.*)$/m) || [])[1] || 'message';
+            const data = frame.split('\n').filter(l => l.startsWith('data: ')).map(l => l.slice(6)).join('\n');
+            if (!data) continue;
+            const payload = JSON.parse(data);
+            text = event === 'done' ? payload.response : text + payload.text;
+            onText(text);
+        }
+    }
+    return text;
+}
+
 // Utility to sanitize HTML
 function escapeHTML(str) {
     return str.replace(/[&<>'"]/g, 
@@ -144,3 +177,164 @@ function escapeHTML(str) {
         }[tag] || tag)
     );
 }
+
+// Client-side charts
+// In "data" chart mode the backend returns the series behind each chart instead of a
+// PNG ({kind: 'line'|'bar'|'heatmap'|'pie'|'wordcloud', ...}); they are drawn here on
+// a <canvas> placed next to the chart's <img>, which is hidden.
+function showChartData(img, series) {
+    let canvas = document.getElementById(img.id + '-canvas');
+    if (!canvas) {
+        canvas = document.createElement('canvas');
+        canvas.id = img.id + '-canvas';
+        canvas.style.width = '100%';
+        img.insertAdjacentElement('afterend', canvas);
+    }
+    img.style.display = 'none';
+    canvas.style.display = 'block';
+    drawChart(canvas, series);
+}
+
+function drawChart(canvas, series) {
+    const width = canvas.parentElement.clientWidth || 600;
+    const height = series.kind === 'wordcloud' ? Math.round(width / 2) : Math.round(width * 0.6);
+    const ratio = window.devicePixelRatio || 1;
+    canvas.width = width * ratio;
+    canvas.height = height * ratio;
+    canvas.style.height = height + 'px';
+    const ctx = canvas.getContext('2d');
+    ctx.setTransform(ratio, 0, 0, ratio, 0, 0);
+    ctx.clearRect(0, 0, width, height);
+    ctx.font = '11px Outfit, sans-serif';
+    ctx.fillStyle = '#4a5568';
+
+    const drawers = { line: drawXY, bar: drawXY, heatmap: drawHeatmap, pie: drawPie, wordcloud: drawWordcloud };
+    (drawers[series.kind] || (() => {}))(ctx, series, width, height);
+}
+
+function drawXY(ctx, series, width, height) {
+    const pad = { left: 40, right: 10, top: 10, bottom: 60 };
+    const plotW = width - pad.left - pad.right;
+    const plotH = height - pad.top - pad.bottom;
+    const n = series.y.length;
+    if (!n) return;
+    const maxY = Math.max(...series.y, 1);
+    const yPos = v => pad.top + plotH - (v / maxY) * plotH;
+    const slot = plotW / n;
+    const xPos = i => pad.left + slot * (i + 0.5);
+
+    // Axes and y ticks
+    ctx.strokeStyle = '#cbd5e0';
+    ctx.beginPath();
+    ctx.moveTo(pad.left, pad.top);
+    ctx.lineTo(pad.left, pad.top + plotH);
+    ctx.lineTo(pad.left + plotW, pad.top + plotH);
+    ctx.stroke();
+    ctx.textAlign = 'right';
+    ctx.textBaseline = 'middle';
+    for (let t = 0; t <= 4; t++) {
+        const v = Math.round(maxY * t / 4);
+        ctx.fillText(v, pad.left - 4, yPos(v));
+    }
+
+    ctx.fillStyle = ctx.strokeStyle = series.color;
+    if (series.kind === 'bar') {
+        series.y.forEach((v, i) => ctx.fillRect(xPos(i) - slot * 0.4, yPos(v), slot * 0.8, pad.top + plotH - yPos(v)));
+    } else {
+        ctx.lineWidth = 2;
+        ctx.beginPath();
+        series.y.forEach((v, i) => (i ? ctx.lineTo(xPos(i), yPos(v)) : ctx.moveTo(xPos(i), yPos(v))));
+        ctx.stroke();
+        ctx.lineWidth = 1;
+    }
+
+    // Vertical x labels, thinned out so they don't overlap
+    ctx.fillStyle = '#4a5568';
+    ctx.textAlign = 'right';
+    const every = Math.ceil(n / Math.max(1, Math.floor(plotW / 14)));
+    series.x.forEach((label, i) => {
+        if (i % every) return;
+        ctx.save();
+        ctx.translate(xPos(i), pad.top + plotH + 4);
+        ctx.rotate(-Math.PI / 2);
+        ctx.fillText(String(label).slice(0, 10), 0, 0);
+        ctx.restore();
+    });
+}
+
+function drawHeatmap(ctx, series, width, height) {
+    const pad = { left: 70, right: 10, top: 10, bottom: 45 };
+    const rows = series.rows.length, cols = series.columns.length;
+    if (!rows || !cols) return;
+    const cellW = (width - pad.left - pad.right) / cols;
+    const cellH = (height - pad.top - pad.bottom) / rows;
+    const maxV = Math.max(...series.values.flat(), 1);
+
+    series.values.forEach((row, r) => row.forEach((v, c) => {
+        // Dark (quiet) to light (busy), like the server-side heatmap
+        const t = v / maxV;
+        ctx.fillStyle = `rgb(${Math.round(30 + 220 * t)}, ${Math.round(20 + 150 * t * t)}, ${Math.round(60 + 80 * t)})`;
+        ctx.fillRect(pad.left + c * cellW, pad.top + r * cellH, Math.ceil(cellW), Math.ceil(cellH));
+    }));
+
+    ctx.fillStyle = '#4a5568';
+    ctx.textAlign = 'right';
+    ctx.textBaseline = 'middle';
+    series.rows.forEach((label, r) => ctx.fillText(label, pad.left - 4, pad.top + (r + 0.5) * cellH));
+    series.columns.forEach((label, c) => {
+        ctx.save();
+        ctx.translate(pad.left + (c + 0.5) * cellW, height - pad.bottom + 4);
+        ctx.rotate(-Math.PI / 2);
+        ctx.fillText(label, 0, 0);
+        ctx.restore();
+    });
+}
+
+function drawPie(ctx, series, width, height) {
+    const total = series.values.reduce((a, b) => a + b, 0);
+    if (!total) return;
+    const cx = width / 2, cy = height / 2, radius = Math.min(width, height) / 2 - 30;
+    let angle = -Math.PI / 2;
+    ctx.textAlign = 'center';
+    ctx.textBaseline = 'middle';
+    series.values.forEach((v, i) => {
+        const sweep = (v / total) * Math.PI * 2;
+        ctx.fillStyle = series.colors[i % series.colors.length];
+        ctx.beginPath();
+        ctx.moveTo(cx, cy);
+        ctx.arc(cx, cy, radius, angle, angle + sweep);
+        ctx.closePath();
+        ctx.fill();
+
+        const mid = angle + sweep / 2;
+        ctx.fillStyle = '#fff';
+        ctx.fillText(`${(v / total * 100).toFixed(1)}%`, cx + Math.cos(mid) * radius * 0.6, cy + Math.sin(mid) * radius * 0.6);
+        ctx.fillStyle = '#2d3748';
+        ctx.fillText(series.labels[i], cx + Math.cos(mid) * (radius + 18), cy + Math.sin(mid) * (radius + 14));
+        angle += sweep;
+    });
+}
+
+function drawWordcloud(ctx, series, width, height) {
+    if (!series.words.length) return;
+    const palette = ['#2f855a', '#3182ce', '#805ad5', '#dd6b20', '#c53030', '#2c7a7b', '#b7791f'];
+    const maxW = series.weights[0];
+    let x = 8, y = 8, lineHeight = 0;
+    ctx.textBaseline = 'top';
+    ctx.textAlign = 'left';
+    for (let i = 0; i < series.words.length; i++) {
+        const size = Math.round(12 + 36 * Math.sqrt(series.weights[i] / maxW));
+        ctx.font = `600 ${size}px Outfit, sans-serif`;
+        const w = ctx.measureText(series.words[i]).width;
+        if (x + w > width - 8) {
+            x = 8;
+            y += lineHeight + 4;
+            lineHeight = 0;
+        }
+        if (y + size > height) break;
+        ctx.fillStyle = palette[i % palette.length];
+        ctx.fillText(series.words[i], x, y);
+        x += w + 10;
+        lineHeight = Math.max(lineHeight, size);
+    }
+}
@@ -1,16 +1,137 @@
 import google.generativeai as genai
+import hashlib
 import os
+import re
+import sqlite3
+import threading
+import time
+
+DEFAULT_MODEL = 'gemini-flash-latest'
+# Gemini model answers come from (also part of the response cache key)
+GEMINI_MODEL = os.environ.get("GEMINI_MODEL", DEFAULT_MODEL)
+
+
+# ──────────────────────────────────────────────
+#  RESPONSE CACHE (SQLite, survives restarts)
+# ──────────────────────────────────────────────
+# Answers are stored under (model, normalized question, hash of the assembled
+# context). The context holds the retrieved lines and recent messages of the
+# dashboard scope, so asking again about the same chat scope is a hit, while a
+# newer export or another user changes the hash and misses. Entries expire after
+# GEMINI_CACHE_TTL seconds (0 disables the cache); past GEMINI_CACHE_MAX_ENTRIES
+# the least recently used go. Identical questions already in flight wait for
+# that one request instead of sending their own. Errors and empty answers are never cached.
+GEMINI_CACHE_PATH = os.environ.get("GEMINI_CACHE_PATH", os.path.join("uploads", "gemini_cache.sqlite"))
+GEMINI_CACHE_TTL = float(os.environ.get("GEMINI_CACHE_TTL", str(24 * 3600)))
+GEMINI_CACHE_MAX_ENTRIES = int(os.environ.get("GEMINI_CACHE_MAX_ENTRIES", "5000"))
+
+
+def normalize_question(text):
+    """Case-folded, whitespace-collapsed question without trailing punctuation."""
+    return re.sub(r'\s+', ' ', (text or '').casefold()).strip().rstrip('?!. ')
+
+
+def response_key(model, question, context):
+    context_hash = hashlib.blake2b((context or '').encode('utf-8'), digest_size=16).hexdigest()
+    return hashlib.blake2b('\0'.join([model, normalize_question(question), context_hash]).encode('utf-8'),
+                           digest_size=16).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path=GEMINI_CACHE_PATH, ttl=GEMINI_CACHE_TTL, max_entries=GEMINI_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, model TEXT NOT NULL, "
+                     "response TEXT NOT NULL, latency REAL NOT NULL, created REAL NOT NULL, used REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+        return conn
+
+    def get(self, key):
+        """(response, seconds it originally took) if cached and fresh, else None."""
+        if self.ttl <= 0:
+            return None
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                row = conn.execute("SELECT response, latency FROM responses WHERE key = ? AND created > ?",
+                                   (key, now - self.ttl)).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+        finally:
+            conn.close()
+        return row
+
+    def put(self, key, model, response, latency):
+        """Store an answer, then drop expired entries and the least recently used over the limit.
+        Returns the number of entries removed."""
+        if self.ttl <= 0:
+            return 0
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO responses (key, model, response, latency, created, used) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", (key, model, response, latency, now, now))
+                removed = conn.execute("DELETE FROM responses WHERE created <= ?", (now - self.ttl,)).rowcount
+                removed += conn.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                                        "ORDER BY used DESC LIMIT -1 OFFSET ?)", (self.max_entries,)).rowcount
+        finally:
+            conn.close()
+        return removed
+
+    def __len__(self):
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        finally:
+            conn.close()
+
+
+class _InFlight:
+    __slots__ = ("done", "value", "latency")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.latency = 0.0
+
+
+def _chunk_text(chunk):
+    # .text raises ValueError for chunks without text parts (e.g. a final safety-rating chunk)
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
 
 class GeminiChat:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, model=None, cache=None):
         # Allow passing key directly or from env
         self.api_key = api_key or os.environ.get("GEMINI_API_KEY")
-        if self.api_key:
+        self.cache = cache if cache is not None else ResponseCache()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.metrics = {"requests": 0, "hits": 0, "misses": 0, "coalesced": 0, "errors": 0, "evictions": 0,
+                        "model_seconds": 0.0, "saved_seconds": 0.0, "streamed": 0, "first_chunk_seconds": 0.0}
+        if model is not None:
+            # Any object with generate_content(prompt, stream=False), e.g. a test double
+            self.model = model
+            self.model_name = getattr(model, 'model_name', type(model).__name__)
+            print(f"✅ Gemini: Using the given model ({self.model_name}).")
+        elif self.api_key:
             try:
                 genai.configure(api_key=self.api_key)
                 # 'gemini-2.0-flash' had 0 quota. Trying 'gemini-flash-latest' which usually maps to a stable free-tier model.
-                self.model = genai.GenerativeModel('gemini-flash-latest')
-                print(f"✅ Gemini Configured. Model: gemini-flash-latest. Key: ...{self.api_key[-5:]}")
+                self.model = genai.GenerativeModel(GEMINI_MODEL)
+                self.model_name = GEMINI_MODEL
+                print(f"✅ Gemini Configured. Model: {GEMINI_MODEL}. Key: ...{self.api_key[-5:]}")
             except Exception as e:
                 print(f"❌ Gemini Configuration Error: {e}")
                 self.model = None
@@ -18,13 +139,8 @@ class GeminiChat:
             print("❌ Gemini API Key Missing!")
             self.model = None
 
-    def get_response(self, user_input, context_data=None):
-        if not self.model:
-            return "Error: Gemini API Key is missing or invalid. Check server logs."
-
-        try:
-            # Construct a prompt with context
-            prompt = f"""
+    def build_prompt(self, user_input, context_data=None):
+        return f"""
             You are an assistant for a WhatsApp chat analytics app. Use ONLY the sections below; do not invent chat topics or messages.
 
             DATA:
@@ -40,9 +156,119 @@ class GeminiChat:
             4. When dashboard scope is a single user (not "Overall"), toxicity rows may be only for that user.
             5. Answer directly and briefly.
             """
-            
-            response = self.model.generate_content(prompt)
-            return response.text
-        except Exception as e:
-            print(f"❌ Gemini Generation Error: {e}")
-            return f"I encountered an error: {str(e)}.\nTry checking your API Key or quota."
+
+    def get_response(self, user_input, context_data=None):
+        return "".join(self.stream_response(user_input, context_data, stream=False))
+
+    def stream_response(self, user_input, context_data=None, stream=True):
+        """The answer as text chunks, yielded as the model generates them.
+
+        Cached answers, and answers to an identical question already in flight,
+        arrive as a single chunk. With ``stream=False`` the model is asked for the
+        whole answer at once. Errors are yielded as a readable message.
+        """
+        if not self.model:
+            yield "Error: Gemini API Key is missing or invalid. Check server logs."
+            return
+
+        key = response_key(self.model_name, user_input, context_data)
+        started = time.perf_counter()
+        with self._lock:
+            self.metrics["requests"] += 1
+        try:
+            cached = self.cache.get(key)
+        except sqlite3.Error as e:
+            print(f"⚠️ Gemini cache unavailable: {e}")
+            cached = None
+        if cached is not None:
+            with self._lock:
+                self.metrics["hits"] += 1
+                self.metrics["saved_seconds"] += max(0.0, cached[1] - (time.perf_counter() - started))
+            yield cached[0]
+            return
+
+        # Single flight: one request per key, identical questions wait for its answer
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _InFlight()
+                self.metrics["misses"] += 1
+            else:
+                self.metrics["coalesced"] += 1
+        if not leader:
+            call.done.wait()
+            if call.value is not None:
+                with self._lock:
+                    self.metrics["saved_seconds"] += max(0.0, call.latency - (time.perf_counter() - started))
+                yield call.value
+            else:
+                yield "I encountered an error while answering this question.\nTry checking your API Key or quota."
+            return
+
+        parts = []
+        first_chunk = None
+        try:
+            try:
+                prompt = self.build_prompt(user_input, context_data)
+                if stream:
+                    chunks = self.model.generate_content(prompt, stream=True)
+                else:
+                    chunks = [self.model.generate_content(prompt)]
+                for chunk in chunks:
+                    text = _chunk_text(chunk)
+                    if not text:
+                        continue
+                    if first_chunk is None:
+                        first_chunk = time.perf_counter() - started
+                    parts.append(text)
+                    yield text
+            except Exception as e:
+                with self._lock:
+                    self.metrics["errors"] += 1
+                print(f"❌ Gemini Generation Error: {e}")
+                yield f"I encountered an error: {str(e)}.\nTry checking your API Key or quota."
+                return
+            if not parts:
+                # Nothing to answer with (e.g. the response was blocked); not cached, so asking again retries
+                with self._lock:
+                    self.metrics["errors"] += 1
+                print("⚠️ Gemini returned an empty answer")
+                yield "I couldn't come up with an answer to that. Please try rephrasing the question."
+                return
+
+            call.value = "".join(parts)
+            call.latency = time.perf_counter() - started
+            with self._lock:
+                self.metrics["model_seconds"] += call.latency
+                if stream and first_chunk is not None:
+                    self.metrics["streamed"] += 1
+                    self.metrics["first_chunk_seconds"] += first_chunk
+            if stream:
+                print(f"💬 Gemini: first chunk after {first_chunk or 0:.2f}s, full answer after {call.latency:.2f}s")
+            try:
+                evicted = self.cache.put(key, self.model_name, call.value, call.latency)
+                with self._lock:
+                    self.metrics["evictions"] += evicted
+            except sqlite3.Error as e:
+                print(f"⚠️ Gemini cache unavailable: {e}")
+        finally:
+            # Also reached when the client disconnects mid-stream; a partial answer is not kept
+            with self._lock:
+                del self._inflight[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+        answered = stats["hits"] + stats["misses"] + stats["coalesced"]
+        stats["hit_rate"] = round((stats["hits"] + stats["coalesced"]) / answered, 3) if answered else 0.0
+        stats["model_seconds"] = round(stats["model_seconds"], 3)
+        stats["saved_seconds"] = round(stats["saved_seconds"], 3)
+        first_chunk = stats.pop("first_chunk_seconds")
+        stats["avg_first_chunk_seconds"] = round(first_chunk / stats["streamed"], 3) if stats["streamed"] else None
+        try:
+            stats["entries"] = len(self.cache)
+        except sqlite3.Error:
+            stats["entries"] = None
+        return stats
@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+
+
+# ──────────────────────────────────────────────
+#  BACKGROUND JOBS (local, in-process queue)
+# ──────────────────────────────────────────────
+# Long pipelines (chat upload processing) run on a small thread pool instead of
+# inside the HTTP request, so large chats don't hit worker timeouts. A job is a list
+# of named stages; each stage records its status and timing, and overall progress is
+# the fraction of finished stages. Clients poll (or stream) Job.to_dict().
+# No external broker: the queue lives in this process, so it needs a single app
+# process (or sticky routing) to find a job again.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+# Finished jobs are forgotten after this long
+JOB_TTL_SECONDS = int(os.environ.get("JOB_TTL_SECONDS", "3600"))
+
+
+class Job:
+    def __init__(self, stages):
+        self.id = str(uuid.uuid4())
+        self.status = "queued"  # queued -> running -> done | error
+        # Stage status: pending -> running -> done | error, or skipped
+        self.stages = [{"name": name, "status": "pending", "elapsed": None} for name in stages]
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.version = 0  # bumped on every change, for streaming clients
+        self._changed = threading.Condition()
+
+    def _touch(self):
+        with self._changed:
+            self.version += 1
+            self._changed.notify_all()
+
+    def wait_for_change(self, version, timeout=None):
+        """Block until the job changes past ``version`` (or timeout); return the new version."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout=timeout)
+            return self.version
+
+    def wait(self, timeout=None):
+        """Block until the job has finished (done or error)."""
+        with self._changed:
+            return self._changed.wait_for(lambda: self.status in ("done", "error"), timeout=timeout)
+
+    def _stage_entry(self, name):
+        entry = next((s for s in self.stages if s["name"] == name), None)
+        if entry is None:
+            entry = {"name": name, "status": "pending", "elapsed": None}
+            self.stages.append(entry)
+        return entry
+
+    def skip(self, name):
+        """Mark a stage as not needed for this run (it counts as finished)."""
+        self._stage_entry(name)["status"] = "skipped"
+        self._touch()
+
+    @contextmanager
+    def stage(self, name):
+        """Mark a stage as running for the duration of the block and record its time."""
+        entry = self._stage_entry(name)
+        entry["status"] = "running"
+        self._touch()
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            entry["status"] = "error"
+            raise
+        else:
+            entry["status"] = "done"
+        finally:
+            entry["elapsed"] = round(time.perf_counter() - start, 3)
+            print(f"[Job {self.id[:8]}] {name}: {entry['status']} in {entry['elapsed']}s")
+            self._touch()
+
+    @property
+    def progress(self):
+        if not self.stages:
+            return 1.0 if self.status == "done" else 0.0
+        return round(sum(s["status"] in ("done", "skipped") for s in self.stages) / len(self.stages), 3)
+
+    def to_dict(self, include_result=True):
+        end = self.finished or time.time()
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "progress": self.progress,
+            "stage": next((s["name"] for s in self.stages if s["status"] == "running"), None),
+            "stages": [dict(s) for s in self.stages],
+            "elapsed": round(end - self.started, 3) if self.started else None,
+        }
+        if self.status == "error":
+            data["error"] = self.error
+        if include_result and self.status == "done":
+            data["result"] = self.result
+        return data
+
+
+def stage(job, name):
+    """``job.stage(name)``, or a no-op when running without a job."""
+    return job.stage(name) if job is not None else nullcontext()
+
+
+def skip(job, name):
+    """``job.skip(name)``, or a no-op when running without a job."""
+    if job is not None:
+        job.skip(name)
+
+
+class JobQueue:
+    def __init__(self, workers=JOB_WORKERS, ttl=JOB_TTL_SECONDS):
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, stages=(), **kwargs):
+        """Queue ``fn(job, *args, **kwargs)``; its return value becomes the job result."""
+        job = Job(stages)
+        with self._lock:
+            self._prune_locked()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = "running"
+        job.started = time.time()
+        job._touch()
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = "done"
+        except Exception as e:
+            print(f"❌ [Job {job.id[:8]}] failed: {e}")
+            job.error = str(e)
+            job.status = "error"
+        finally:
+            job.finished = time.time()
+            job._touch()
+
+    def _prune_locked(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished < cutoff]:
+            del self._jobs[job_id]
@@ -0,0 +1,156 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+# ──────────────────────────────────────────────
+#  LOCAL VECTOR INDEX (offline fallback for ChromaDB)
+# ──────────────────────────────────────────────
+# Used when ChromaDB can't start or no embedding API is configured (see
+# vector_helper.create_vector_store). Each chat is a folder under VECTOR_FOLDER:
+#   vectors.<n>.npy   float32 matrix, one L2-normalized row per message (memory-mapped)
+#   rows.<n>.parquet  message id, document, date and sender code of each row
+#   meta.json         generation n, embedding model, IDF weights and the sender list
+# Vectors are re-weighted by per-chat IDF over their dimensions before
+# normalizing, which turns the hashed word/trigram embedding into a hashed TF-IDF
+# (dimensions used by every message, as in dense models, keep weight 1). Search is
+# one matrix product for a batch of queries plus argpartition for the top k, and a
+# sender filter is a row list precomputed per sender. Exact search over 200k
+# messages takes ~20 ms a query (~3 ms each in a batch of 32), so there's no ANN index.
+VECTOR_FOLDER = os.environ.get("LOCAL_VECTOR_FOLDER", os.path.join("uploads", "vectors"))
+
+_loaded = {}  # folder -> (meta.json mtime, LocalIndex)
+_loaded_lock = threading.Lock()
+
+
+def idf_weights(vectors):
+    """Smoothed IDF of each dimension: log((1 + n) / (1 + rows using it)) + 1."""
+    used = np.count_nonzero(vectors, axis=0)
+    return (np.log((1 + len(vectors)) / (1 + used)) + 1).astype(np.float32)
+
+
+def weigh(vectors, idf):
+    """Rows of ``vectors`` scaled by ``idf`` and L2-normalized (float32)."""
+    weighted = np.asarray(vectors, dtype=np.float32) * idf
+    norms = np.sqrt(np.einsum('ij,ij->i', weighted, weighted))[:, None]
+    weighted /= np.where(norms == 0, 1, norms)
+    return weighted
+
+
+class LocalIndex:
+    """One chat's vectors (memory-mapped) with its rows and per-sender row lists."""
+
+    def __init__(self, folder):
+        with open(os.path.join(folder, "meta.json"), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        generation = self.meta['generation']
+        self.vectors = np.load(os.path.join(folder, f"vectors.{generation}.npy"), mmap_mode='r')
+        rows = pd.read_parquet(os.path.join(folder, f"rows.{generation}.parquet"))
+        self.ids = rows['id'].tolist()
+        self.documents = rows['document'].tolist()
+        self.dates = rows['date'].tolist()
+        self.codes = rows['user'].to_numpy()
+        self.idf = np.asarray(self.meta['idf'], dtype=np.float32)
+        self.users = self.meta['users']
+        self.user_rows = {user: np.flatnonzero(self.codes == code) for code, user in enumerate(self.users)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query_vectors, k=10, user=None):
+        """Top ``k`` (row, score) pairs for each query vector, best first, optionally
+        restricted to one sender's rows."""
+        queries = weigh(np.atleast_2d(query_vectors), self.idf)
+        scores = np.asarray(self.vectors @ queries.T)
+        rows = None
+        if user is not None:
+            rows = self.user_rows.get(user, np.zeros(0, dtype=np.int64))
+            scores = scores[rows]
+        k = min(k, len(scores))
+        results = []
+        for column in scores.T:
+            if k == 0:
+                results.append([])
+                continue
+            top = np.argpartition(-column, k - 1)[:k]
+            top = top[np.argsort(-column[top], kind='stable')]
+            found = rows[top] if rows is not None else top
+            results.append([(int(r), float(s)) for r, s in zip(found, column[top])])
+        return results
+
+
+def index_folder(name, folder=VECTOR_FOLDER):
+    return os.path.join(folder, name)
+
+
+def load(name, folder=VECTOR_FOLDER):
+    """The LocalIndex for ``name`` (reloaded when it was rewritten), or None if missing."""
+    path = index_folder(name, folder)
+    try:
+        stamp = os.stat(os.path.join(path, "meta.json")).st_mtime_ns
+    except OSError:
+        return None
+    with _loaded_lock:
+        cached = _loaded.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+    try:
+        index = LocalIndex(path)
+    except Exception as e:
+        print(f"[LocalVectors] Unreadable index {path}: {e}")
+        return None
+    with _loaded_lock:
+        _loaded[path] = (stamp, index)
+    return index
+
+
+def write(name, vectors, ids, documents, users, dates, model, append=False, folder=VECTOR_FOLDER):
+    """Store (or with ``append``, extend) the index ``name`` from raw embedding rows.
+
+    A new index computes its IDF from these rows; appended rows are weighted with
+    the stored IDF. Each write is a new generation of files and meta.json is
+    switched to it last, so readers (and memory maps of the previous generation)
+    never see a half-written index.
+    """
+    path = index_folder(name, folder)
+    old = load(name, folder)
+    generation = old.meta['generation'] + 1 if old is not None else 1
+    if not append or (old is not None and old.meta.get('model') != model):
+        old = None
+    vectors = np.asarray(vectors, dtype=np.float32)
+    idf = old.idf if old is not None else idf_weights(vectors)
+    weighted = weigh(vectors, idf) if len(vectors) else np.zeros((0, len(idf)), dtype=np.float32)
+
+    senders = list(old.users) if old is not None else []
+    code_of = {user: code for code, user in enumerate(senders)}
+    for user in users:
+        if user not in code_of:
+            code_of[user] = len(senders)
+            senders.append(user)
+    rows = pd.DataFrame({"id": ids, "document": documents, "date": dates,
+                         "user": np.array([code_of[u] for u in users], dtype=np.int32)})
+    if old is not None:
+        weighted = np.concatenate([np.asarray(old.vectors), weighted])
+        rows = pd.concat([pd.DataFrame({"id": old.ids, "document": old.documents, "date": old.dates,
+                                        "user": old.codes.astype(np.int32)}), rows], ignore_index=True)
+
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, f"vectors.{generation}.npy"), weighted)
+    rows.to_parquet(os.path.join(path, f"rows.{generation}.parquet"), index=False)
+    meta = {"generation": generation, "model": model, "idf": idf.tolist(), "users": senders, "rows": len(rows)}
+    with open(os.path.join(path, "meta.json.tmp"), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(os.path.join(path, "meta.json.tmp"), os.path.join(path, "meta.json"))
+
+    # Older generations can go once nothing maps them (on Windows, a mapped file stays until next time)
+    current = {f"vectors.{generation}.npy", f"rows.{generation}.parquet", "meta.json"}
+    for entry in os.listdir(path):
+        if entry not in current:
+            try:
+                os.remove(os.path.join(path, entry))
+            except OSError:
+                pass
+    return len(rows)
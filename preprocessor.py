@@ -1,133 +1,347 @@
 import re
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 
-def preprocess(data):
-    # Tuple of (regex_split, date_format, is_ios)
-    # The patterns are prioritized. iOS has brackets, distinctive. 12h has AM/PM. 24h is standard
-    
-    patterns = [
-        {
-            'name': 'ios',
-            # [26/01/23, 15:30:00] 
-            # Note: Sometimes there is a char after ] like space.
-            'regex': r'\[\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}:\d{2}\]\s?',
-            'format_str': '%d/%m/%y, %H:%M:%S',
-            'dayfirst': True
-        },
-        {
-            'name': '12h',
-            # 12/31/23, 11:59 PM - 
-            'regex': r'\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}\s[apAP][mM]\s-\s',
-            'format_str': '%m/%d/%y, %I:%M %p',
-            'dayfirst': False
-        },
-        {
-            'name': '24h',
-            # 26/01/23, 15:30 - 
-            'regex': r'\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}\s-\s',
-            'format_str': '%d/%m/%y, %H:%M',
-            'dayfirst': True
-        }
-    ]
-    
-    selected_pattern = None
-    # We check a larger subset to be sure, or the whole text?
-    # Checking first few matches is safer.
-    subset = data[:4000] 
-    
-    for p in patterns:
-        if re.search(p['regex'], subset):
-            selected_pattern = p
-            # Priority: iOS > 12h > 24h. 
-            # But 12h and 24h might overlap if AM/PM is missing? 
-            # 24h regex requires " - ". 12h regex requires "AM/PM - ". 
-            # So they are distinct enough.
+# Known export header formats, in priority order.
+# 'formats' are the exact strptime formats tried for the header, best guess first; the
+# detector reorders them per chat (day-first vs month-first, 2- vs 4-digit years) by how
+# many sampled headers each one parses.
+PATTERNS = [
+    {
+        'name': 'ios',
+        # [26/01/23, 15:30:00]
+        # Note: Sometimes there is a char after ] like space.
+        'regex': r'\[\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}:\d{2}\]\s?',
+        'formats': ['%d/%m/%y, %H:%M:%S', '%m/%d/%y, %H:%M:%S']
+    },
+    {
+        'name': 'ios_12h',
+        # [12/31/23, 11:59:00 PM]
+        'regex': r'\[\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}:\d{2}\s[apAP][mM]\]\s?',
+        'formats': ['%m/%d/%y, %I:%M:%S %p', '%d/%m/%y, %I:%M:%S %p']
+    },
+    {
+        'name': '12h',
+        # 12/31/23, 11:59 PM -
+        'regex': r'\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}\s[apAP][mM]\s-\s',
+        'formats': ['%m/%d/%y, %I:%M %p', '%d/%m/%y, %I:%M %p']
+    },
+    {
+        'name': '24h',
+        # 26/01/23, 15:30 -
+        'regex': r'\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}\s-\s',
+        'formats': ['%d/%m/%y, %H:%M', '%m/%d/%y, %H:%M']
+    },
+    {
+        'name': '24h_dot',
+        # 26.01.23, 15:30 -
+        'regex': r'\d{1,2}\.\d{1,2}\.\d{2,4},\s\d{1,2}:\d{2}\s-\s',
+        'formats': ['%d.%m.%y, %H:%M']
+    }
+]
+DEFAULT_PATTERN = '24h'
+
+# Format detection samples this many lines spread evenly across the whole export
+# (plus the head), so a chat that switches locale halfway through is still seen.
+DETECT_SAMPLE_LINES = 2000
+DETECT_HEAD_CHARS = 4000
+# Streaming parser: how many messages go into each DataFrame batch
+STREAM_BATCH_ROWS = 50000
+
+MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+               'August', 'September', 'October', 'November', 'December']
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+# Hour buckets used by the activity heatmap: "00-1", "1-2", ..., "23-00"
+PERIOD_LABELS = ['00-1'] + [f"{h}-{h + 1}" for h in range(1, 23)] + ['23-00']
+
+
+def _sample_text_lines(data, n=DETECT_SAMPLE_LINES):
+    """Systematic sample of lines: the head plus one line every len(data)/n chars."""
+    lines = data[:DETECT_HEAD_CHARS].splitlines()
+    step = max(len(data) // n, 1)
+    for offset in range(DETECT_HEAD_CHARS, len(data), step):
+        start = data.find('\n', offset) + 1
+        if start == 0:
             break
-            
-    if not selected_pattern:
-        # Default fallback
-        selected_pattern = patterns[2]
-        
-    pattern = selected_pattern['regex']
-    
-    messages = re.split(pattern, data)[1:]
-    dates = re.findall(pattern, data)
-    
-    df = pd.DataFrame({'user_message': messages, 'message_date': dates})
-    
-    # Helper to clean date string
-    def clean_date_str(d):
-        d = d.strip()
-        # Remove regex artifacts
-        # iOS: [ and ]
-        if d.startswith('['):
-            d = d.replace('[', '').replace(']', '')
-        # Separator " - "
-        d = d.replace(' -', '')
-        # Extra spaces
-        return d.strip()
-        
-    df['message_date'] = df['message_date'].apply(clean_date_str)
-    
+        end = data.find('\n', start)
+        lines.append(data[start:end if end != -1 else len(data)])
+    return lines
+
+
+def _sample_file_lines(path, n=DETECT_SAMPLE_LINES, encoding='utf-8'):
+    """Same sampling as _sample_text_lines, but by seeking so the file is never read whole."""
+    with open(path, 'rb') as f:
+        f.seek(0, 2)
+        size = f.tell()
+        f.seek(0)
+        lines = f.read(DETECT_HEAD_CHARS).decode(encoding, errors='ignore').splitlines()
+        step = max(size // n, 1)
+        for offset in range(DETECT_HEAD_CHARS, size, step):
+            f.seek(offset)
+            f.readline()  # skip the partial line we landed in
+            line = f.readline()
+            if not line:
+                break
+            lines.append(line.decode(encoding, errors='ignore'))
+    return lines
+
+
+def detect_formats(lines):
+    """Score every known header pattern and date format against sampled lines.
+
+    Returns the patterns that occur in the sample (in priority order), each as a copy
+    with 'hits' (sampled headers it matched) and 'formats' sorted by how many of those
+    headers each exact format parses. Falls back to the 24h pattern if nothing matches.
+    """
+    detected = []
+    for p in PATTERNS:
+        header = re.compile('\u200e?(' + p['regex'] + ')')
+        samples = [m.group(1) for m in map(header.match, lines) if m]
+        if not samples:
+            continue
+        cleaned = pd.Series([_clean_date_str(d) for d in samples], dtype=object)
+        candidates = p['formats'] + [f.replace('%y', '%Y') for f in p['formats']]
+        scores = {fmt: pd.to_datetime(cleaned, format=fmt, errors='coerce').notna().sum() for fmt in candidates}
+        # sorted() is stable, so ties keep the pattern's default order
+        formats = sorted(candidates, key=lambda fmt: -scores[fmt])
+        detected.append(dict(p, hits=len(samples), formats=formats))
+
+    if not detected:
+        fallback = next(p for p in PATTERNS if p['name'] == DEFAULT_PATTERN)
+        candidates = fallback['formats'] + [f.replace('%y', '%Y') for f in fallback['formats']]
+        detected.append(dict(fallback, hits=0, formats=candidates))
+    return detected
+
+
+def _header_regex(detected):
+    # One alternation group per detected pattern; match.lastindex tells which one hit.
+    # Exports sometimes prefix lines with a left-to-right mark
+    alternatives = '|'.join('(' + p['regex'] + ')' for p in detected)
+    return re.compile('(?m)^\u200e?(?:' + alternatives + ')')
+
+
+def preprocess(data):
+    detected = detect_formats(_sample_text_lines(data))
+    header = _header_regex(detected)
+
+    # With one capture group per pattern, re.split returns
+    # [preamble, g1, g2, ..., message, g1, g2, ..., message, ...] in a single C-level pass.
+    stride = len(detected) + 1
+    parts = header.split(data)
+    messages = parts[stride::stride]
+    if len(detected) == 1:
+        dates = parts[1::stride]
+        kinds = np.zeros(len(dates), dtype=np.int8)
+    else:
+        groups = [parts[i::stride] for i in range(1, stride)]
+        dates = [next(g for g in row if g is not None) for row in zip(*groups)]
+        kinds = np.array([next(i for i, g in enumerate(row) if g is not None) for row in zip(*groups)],
+                         dtype=np.int8)
+
+    return _build_frame(dates, messages, kinds, detected)
+
+
+def patterns_for(formats):
+    """Rebuild detect_formats() output from the 'formats' attr a parsed chat carries."""
+    by_name = {p['name']: p for p in PATTERNS}
+    return [dict(by_name[f['name']], hits=0, formats=list(f['formats'])) for f in formats]
+
+
+def iter_preprocess(path, batch_rows=STREAM_BATCH_ROWS, encoding='utf-8', start=0, detected=None):
+    """Stream a WhatsApp export line by line, yielding processed DataFrame batches.
+
+    A line that starts with a detected date header opens a new message; any other
+    line is a continuation of the previous (multi-line) message. Only one batch of raw
+    messages is held in memory at a time, so peak usage is bounded by ``batch_rows``
+    rather than by the size of the export.
+    ``start`` is a byte offset (at a line start) to begin parsing from, and ``detected``
+    reuses header formats detected earlier instead of sampling the file again.
+    """
+    if detected is None:
+        detected = detect_formats(_sample_file_lines(path, encoding=encoding))
+    header = _header_regex(detected)
+
+    with open(path, 'r', encoding=encoding) as f:
+        if start:
+            f.seek(start)  # utf-8 decoding is stateless, so a byte offset at a line start is a valid position
+        dates = []
+        kinds = []
+        messages = []
+        current = None
+
+        for line in f:
+            m = header.match(line)
+            if m:
+                if current is not None:
+                    messages.append(''.join(current))
+                    if len(messages) >= batch_rows:
+                        yield _build_frame(dates, messages, np.array(kinds, dtype=np.int8), detected)
+                        dates, kinds, messages = [], [], []
+                dates.append(m.group(m.lastindex))
+                kinds.append(m.lastindex - 1)
+                current = [line[m.end():]]
+            elif current is not None:
+                current.append(line)
+            # Lines before the first header (e.g. encryption banners) are dropped,
+            # matching preprocess() which discards everything before the first date.
+
+        if current is not None:
+            messages.append(''.join(current))
+        if messages:
+            yield _build_frame(dates, messages, np.array(kinds, dtype=np.int8), detected)
+
+
+def preprocess_file(path, batch_rows=STREAM_BATCH_ROWS, encoding='utf-8', start=0, detected=None):
+    """Parse an export from disk without loading the raw text into memory at once."""
+    batches = list(iter_preprocess(path, batch_rows=batch_rows, encoding=encoding, start=start, detected=detected))
+    if not batches:
+        return _build_frame([], [], np.zeros(0, dtype=np.int8), detected or detect_formats([]))
+    if len(batches) == 1:
+        return batches[0]
+    # Each batch only knows the senders it saw; unify them so the categoricals stay
+    # categorical, sorted like a single-batch parse (pd.Categorical) would give them
+    categoricals = {name: union_categoricals([b[name] for b in batches], sort_categories=True)
+                    for name, dtype in batches[0].dtypes.items() if isinstance(dtype, pd.CategoricalDtype)}
+    format_counts = {}
+    for b in batches:
+        for name, count in b.attrs.get('format_counts', {}).items():
+            format_counts[name] = format_counts.get(name, 0) + count
+    df = pd.concat(batches, ignore_index=True)
+    for name, values in categoricals.items():
+        df[name] = values
+    df.attrs['format_counts'] = format_counts
+    df.attrs['formats'] = batches[0].attrs['formats']
+    return df
+
+
+def tail_appendable(path, start, formats, encoding='utf-8'):
+    """Whether the part of an export after byte ``start`` can be parsed on its own with
+    a chat's known formats: it opens with a message header (rather than continuing the
+    last stored message) and uses no header format the stored chat didn't have.
+
+    Only the first DETECT_HEAD_CHARS of the tail are read, so this is cheap enough to
+    decide on an incremental append before any processing starts.
+    """
+    detected = patterns_for(formats)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        head = f.read(DETECT_HEAD_CHARS).decode(encoding, errors='ignore').splitlines()
+    if not head:
+        return True
+    if not _header_regex(detected).match(head[0]):
+        return False
+    known = {p['name'] for p in detected}
+    return not any(p['hits'] and p['name'] not in known for p in detect_formats(head))
+
+
+def preprocess_tail(path, start, formats, encoding='utf-8'):
+    """Parse only the part of an export after byte ``start`` with a chat's known formats.
+
+    Used when a newer export of a stored chat is uploaded: the old export is a prefix
+    of the new one, so only the new tail needs parsing. Check tail_appendable first.
+    """
+    return preprocess_file(path, encoding=encoding, start=start, detected=patterns_for(formats))
+
+
+def _sorted_categorical(codes, labels):
+    """Build a categorical from integer codes into ``labels``.
+
+    Categories are kept in lexical order so groupby/pivot output is ordered exactly
+    as it was when these columns were plain strings.
+    """
+    order = sorted(labels)
+    remap = np.array([order.index(label) for label in labels], dtype=np.int8)
+    return pd.Categorical.from_codes(remap[codes], categories=order)
+
+
+def _clean_date_str(d):
+    d = d.strip()
+    # Remove regex artifacts
+    # iOS: [ and ]
+    if d.startswith('['):
+        d = d.replace('[', '').replace(']', '')
+    # Separator " - "
+    d = d.replace(' -', '')
+    # Newer exports put a narrow no-break space before AM/PM
+    d = d.replace('\u202f', ' ')
+    # Extra spaces
+    return d.strip()
+
+
+def _build_frame(dates, messages, kinds, detected):
+    message_date = pd.Series([_clean_date_str(d) for d in dates], dtype=object)
+
     # Date Parsing logic
-    # Try the specific format first
-    try:
-        # Check if year is 4 digits in data, format uses %y (2 digits). 
-        # Pandas manages %y/%Y confusion well usually but specific format is better.
-        # We try strict format first.
-        df['date'] = pd.to_datetime(df['message_date'], format=selected_pattern['format_str'], errors='coerce')
-    except:
-        pass
-        
-    # If many failures, retry with loose parsing + dayfirst hint
-    if df['date'].isna().sum() > len(df) * 0.1: # if more than 10% failed
-        try:
-            df['date'] = pd.to_datetime(df['message_date'], dayfirst=selected_pattern['dayfirst'], errors='coerce')
-        except:
-             pass
-
-    df.dropna(subset=['date'], inplace=True)
-    
+    # Each segment is parsed with its own pattern's exact formats, best-scoring first.
+    # Rows a format rejects move on to the next exact format; there is no per-element
+    # inference fallback, so parsing stays fast and deterministic on mixed exports.
+    date = pd.Series(pd.NaT, index=message_date.index, dtype='datetime64[ns]')
+    format_counts = {}
+    for code, pattern in enumerate(detected):
+        pending = kinds == code
+        segment_rows = int(pending.sum())
+        if not segment_rows:
+            continue
+        for fmt in pattern['formats']:
+            parsed = pd.to_datetime(message_date[pending], format=fmt, errors='coerce')
+            ok = parsed.notna().to_numpy()
+            if ok.any():
+                date[parsed.index[ok]] = parsed[ok]
+                pending[pending] = ~ok
+            if not pending.any():
+                break
+        format_counts[pattern['name']] = segment_rows - int(pending.sum())
+
+    keep = date.notna().to_numpy()
+    if keep.all():
+        kept_messages = messages
+    else:
+        date = date[keep]
+        kept_messages = [m for m, k in zip(messages, keep) if k]
+
+    # Split user and message in one tight pass. pandas' .str methods on object columns
+    # are per-element Python calls as well and measured slower than this loop.
     users = []
     msgs = []
-    
-    for message in df['user_message']:
+
+    for message in kept_messages:
         # Split user and message safely without catastrophic regex backtracking
         first_colon = message.find(': ')
         first_newline = message.find('\n')
-        
+
         # WhatsApp usernames are on the first line and typically short (under 80 chars)
         if first_colon != -1 and (first_newline == -1 or first_colon < first_newline) and first_colon < 80:
-            user_part = message[:first_colon]
-            msg_part = message[first_colon + 2:]
-            users.append(user_part)
-            msgs.append(msg_part)
+            users.append(message[:first_colon])
+            msgs.append(message[first_colon + 2:])
         else:
             users.append('group_notification')
             msgs.append(message)
-    
-    df['user'] = users
-    df['message'] = msgs
-    df.drop(columns=['user_message', 'message_date'], inplace=True)
-
-    df['year'] = df['date'].dt.year
-    df['month_num'] = df['date'].dt.month
-    df['month'] = df['date'].dt.month_name()
-    df['day'] = df['date'].dt.day
-    df['day_name'] = df['date'].dt.day_name()
-    df['hour'] = df['date'].dt.hour
-    df['minute'] = df['date'].dt.minute
-    df['only_date'] = df['date'].dt.date
-
-    period = []
-    for hour in df[['day_name', 'hour']]['hour']:
-        if hour == 23:
-            period.append(str(hour) + "-" + str('00'))
-        elif hour == 0:
-            period.append(str('00') + "-" + str(hour + 1))
-        else:
-            period.append(str(hour) + "-" + str(hour + 1))
 
-    df['period'] = period
+    # Derive every calendar column from the raw datetime64 values at once instead of
+    # going through the .dt accessor once per column.
+    stamps = date.to_numpy()
+    days = stamps.astype('datetime64[D]')
+    months = stamps.astype('datetime64[M]')
+    month_num = (months.astype(np.int64) % 12 + 1).astype(np.int32)
+    weekday = ((days.astype(np.int64) + 3) % 7).astype(np.int32)  # 1970-01-01 was a Thursday
+    minutes_of_day = ((stamps - days) // np.timedelta64(1, 'm')).astype(np.int32)
+    hour = minutes_of_day // 60
+
+    df = pd.DataFrame({'date': date}, index=date.index)
+    df['user'] = pd.Categorical(users)
+    df['message'] = pd.Series(msgs, index=date.index, dtype=object)
+    df['year'] = (stamps.astype('datetime64[Y]').astype(np.int64) + 1970).astype(np.int32)
+    df['month_num'] = month_num
+    df['month'] = _sorted_categorical(month_num - 1, MONTH_NAMES)
+    df['day'] = ((days - months.astype('datetime64[D]')).astype(np.int64) + 1).astype(np.int32)
+    df['day_name'] = _sorted_categorical(weekday, DAY_NAMES)
+    df['hour'] = hour
+    df['minute'] = minutes_of_day % 60
+    df['only_date'] = days.astype(object)
+    df['period'] = _sorted_categorical(hour, PERIOD_LABELS)
+    df.attrs['format_counts'] = format_counts
+    # Header formats this chat was parsed with, so a later tail parses the same way
+    df.attrs['formats'] = [{'name': p['name'], 'formats': list(p['formats'])} for p in detected]
 
     return df
@@ -0,0 +1,132 @@
+import hashlib
+import multiprocessing
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+
+
+# ──────────────────────────────────────────────
+#  BATCHED SENTIMENT ENGINE (VADER)
+# ──────────────────────────────────────────────
+# Chats repeat the same short messages constantly ("ok", "haha", "<Media omitted>"),
+# so messages are deduplicated before scoring, and every distinct message's compound
+# score is memoized on disk by hash, shared across uploads. Only never-seen messages
+# reach VADER; large batches of those are scored in chunks on a process pool.
+# Bump SCORER_VERSION if the scoring changes (e.g. a vaderSentiment upgrade) so the
+# memo isn't reused across incompatible scores.
+SCORER_VERSION = 1
+POSITIVE_THRESHOLD = 0.05
+NEGATIVE_THRESHOLD = -0.05
+MEMO_PATH = os.environ.get("SENTIMENT_MEMO_PATH", os.path.join("uploads", "sentiment_memo.sqlite"))
+SENTIMENT_WORKERS = int(os.environ.get("SENTIMENT_WORKERS", min(4, os.cpu_count() or 1)))
+CHUNK_SIZE = 5000
+# Below this many new messages the pool's IPC costs more than it saves
+PARALLEL_MIN = 20000
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH = 900
+
+_analyzer = None
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _score_chunk(messages):
+    global _analyzer
+    if _analyzer is None:
+        _analyzer = SentimentIntensityAnalyzer()
+    return [_analyzer.polarity_scores(m)['compound'] for m in messages]
+
+
+def _get_pool(workers):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _score(messages, workers):
+    if workers <= 1 or len(messages) < PARALLEL_MIN:
+        return _score_chunk(messages)
+    chunks = [messages[i:i + CHUNK_SIZE] for i in range(0, len(messages), CHUNK_SIZE)]
+    return [score for scores in _get_pool(workers).map(_score_chunk, chunks) for score in scores]
+
+
+def message_hash(message):
+    return hashlib.blake2b(f"{SCORER_VERSION}\0{message}".encode('utf-8'), digest_size=16).digest()
+
+
+# ── On-disk memo: message hash -> compound score ──
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS scores (hash BLOB PRIMARY KEY, score REAL NOT NULL)")
+    return conn
+
+
+def _memo_get(conn, hashes):
+    found = {}
+    for i in range(0, len(hashes), _SQL_BATCH):
+        batch = hashes[i:i + _SQL_BATCH]
+        rows = conn.execute(f"SELECT hash, score FROM scores WHERE hash IN ({','.join('?' * len(batch))})", batch)
+        found.update(rows)
+    return found
+
+
+def _memo_put(conn, items):
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO scores (hash, score) VALUES (?, ?)", items)
+
+
+def score_messages(messages, memo_path=MEMO_PATH, workers=None):
+    """Return VADER compound scores (float64 array) aligned with ``messages``.
+
+    Identical messages are scored once; scores already in the memo are not recomputed.
+    ``memo_path=None`` disables the on-disk memo.
+    """
+    workers = SENTIMENT_WORKERS if workers is None else workers
+    messages = pd.Series(messages, dtype=object).fillna('nan')  # same text VADER saw for missing values before
+    if messages.empty:
+        return np.array([], dtype=float)
+    codes, uniques = pd.factorize(messages)
+    uniques = list(uniques)
+    hashes = [message_hash(m) for m in uniques]
+
+    conn = None
+    memo = {}
+    if memo_path:
+        try:
+            os.makedirs(os.path.dirname(memo_path) or '.', exist_ok=True)
+            conn = _connect(memo_path)
+            memo = _memo_get(conn, hashes)
+        except sqlite3.Error as e:
+            print(f"⚠️ Sentiment memo unavailable ({memo_path}): {e}")
+            conn = None
+
+    unique_scores = np.array([memo.get(h, np.nan) for h in hashes], dtype=float)
+    missing = np.flatnonzero(np.isnan(unique_scores))
+    if len(missing):
+        new_scores = _score([uniques[i] for i in missing], workers)
+        unique_scores[missing] = new_scores
+        if conn is not None:
+            try:
+                _memo_put(conn, [(hashes[i], s) for i, s in zip(missing, new_scores)])
+            except sqlite3.Error as e:
+                print(f"⚠️ Failed to update sentiment memo: {e}")
+    if conn is not None:
+        conn.close()
+    print(f"[Sentiment] {len(messages)} messages, {len(uniques)} distinct, {len(missing)} scored "
+          f"({len(uniques) - len(missing)} from memo)")
+    return unique_scores[codes]
+
+
+def categorize(scores):
+    """Vectorized Positive / Negative / Neutral thresholds on compound scores."""
+    scores = np.asarray(scores, dtype=float)
+    return np.select([scores >= POSITIVE_THRESHOLD, scores <= NEGATIVE_THRESHOLD],
+                     ['Positive', 'Negative'], default='Neutral')
@@ -0,0 +1,78 @@
+import os
+import re
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+# The app is a set of top-level modules; make them importable from the tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Read by the app's modules when they are imported, which for some test modules is
+# at collection time; so they are set before any test runs
+os.environ.update({"VECTOR_BACKEND": "local", "EMBEDDING_FUNCTION": "hash", "CHART_WORKERS": "0"})
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    # The app creates uploads/ (and its caches) in the working directory on import
+    workdir = tmp_path_factory.mktemp("app")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import app
+        yield app
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def chroma_dir(tmp_path, monkeypatch):
+    """Run in ``tmp_path`` so VectorStore's chroma_db/ is a fresh one. Chroma caches
+    clients by path, and the path is the same relative "chroma_db" every time."""
+    from chromadb.api.shared_system_client import SharedSystemClient
+
+    monkeypatch.chdir(tmp_path)
+    SharedSystemClient.clear_system_cache()
+    yield tmp_path
+    SharedSystemClient.clear_system_cache()
+
+
+class FakeModel:
+    """Deterministic stand-in for the Gemini model: echoes the question and the size
+    of its data after ``delay`` seconds (word by word when streaming). Counts calls,
+    so cache hits and coalescing can be checked."""
+
+    model_name = 'fake'
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, stream=False):
+        with self._lock:
+            self.calls += 1
+        question = re.search(r'USER QUESTION: (.*)', prompt)
+        data = prompt.split('DATA:', 1)[-1].split('USER QUESTION:', 1)[0]
+        text = (f"(fake answer) You asked: {question.group(1).strip() if question else ''} "
+                f"({len(data.strip().splitlines())} lines of chat data)")
+        if not stream:
+            time.sleep(self.delay)
+            return SimpleNamespace(text=text)
+        return self._stream(re.findall(r'\S+\s*', text))
+
+    def _stream(self, words):
+        # The same total delay, spread over the words
+        for word in words:
+            time.sleep(self.delay / len(words))
+            yield SimpleNamespace(text=word)
+
+
+@pytest.fixture
+def fake_model():
+    """FakeModel factory: ``fake_model(delay=...)``, passed to GeminiChat(model=...)."""
+    return FakeModel
@@ -0,0 +1,45 @@
+import os
+
+import charts
+
+
+def _store(folder, sizes):
+    """Write one fake PNG per size, oldest first; returns their keys."""
+    keys = []
+    for i, size in enumerate(sizes):
+        key = charts.chart_key("hash", "Overall", f"chart{i}")
+        charts.save_png(folder, key, b"x" * size)
+        os.utime(charts.chart_path(folder, key), (1000 + i, 1000 + i))
+        keys.append(key)
+    return keys
+
+
+def test_sweep_removes_least_recently_used(tmp_path):
+    keys = _store(tmp_path, [100, 100, 100, 100])
+    assert charts.sweep(tmp_path, max_bytes=250) == 2
+    assert [charts.load_png(tmp_path, k) is not None for k in keys] == [False, False, True, True]
+
+
+def test_sweep_keeps_charts_in_use(tmp_path):
+    keys = _store(tmp_path, [100, 100, 100])
+    charts.sweep(tmp_path, max_bytes=200, keep=[keys[0]])
+    assert [charts.load_png(tmp_path, k) is not None for k in keys] == [True, False, True]
+
+
+def test_sweep_drops_stale_tmp_files(tmp_path):
+    stale, fresh = tmp_path / "a.png.1.2.tmp", tmp_path / "b.png.1.2.tmp"
+    stale.write_bytes(b"x")
+    fresh.write_bytes(b"x")
+    os.utime(stale, (0, 0))
+    charts.sweep(tmp_path, max_bytes=10**6)
+    assert not stale.exists() and fresh.exists()
+
+
+def test_render_cached_bumps_served_charts(tmp_path, monkeypatch):
+    builders = {"pie": lambda: ("pie", {"values": [1, 2], "labels": ["Positive", "Negative"]})}
+    monkeypatch.setattr(charts, "render_all", lambda jobs, workers=None: {n: b"png" for n in jobs})
+    keys = charts.render_cached(tmp_path, "hash", "Overall", builders, workers=0)
+    path = charts.chart_path(tmp_path, keys["pie"])
+    os.utime(path, (1000, 1000))
+    charts.render_cached(tmp_path, "hash", "Overall", builders, workers=0)
+    assert os.path.getmtime(path) > 1000
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from gemini_helper import GeminiChat, ResponseCache
+
+
+@pytest.fixture
+def fake_chat(app_module, fake_model, tmp_path, monkeypatch):
+    model = fake_model(delay=0.05)
+    chat = GeminiChat(model=model, cache=ResponseCache(str(tmp_path / "gemini_cache.sqlite")))
+    monkeypatch.setattr(app_module, "chatbot", chat)
+    return model
+
+
+def read_events(response):
+    """[(event, payload)] of a Server-Sent Events body."""
+    events = []
+    for frame in response.get_data(as_text=True).split("\n\n"):
+        if not frame.strip():
+            continue
+        event = "message"
+        data = []
+        for line in frame.split("\n"):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data.append(line[len("data: "):])
+        events.append((event, json.loads("\n".join(data))))
+    return events
+
+
+def ask(client, message):
+    return client.post('/api/chat/stream', json={"message": message, "context": "Stats: 10 messages"})
+
+
+def test_answer_streams_in_chunks(app_module, fake_chat):
+    response = ask(app_module.app.test_client(), "Who talks the most?")
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    events = read_events(response)
+    chunks = [payload["text"] for event, payload in events if event == "message"]
+    assert len(chunks) > 1
+    assert events[-1][0] == "done"
+    assert "".join(chunks) == events[-1][1]["response"]
+    assert events[-1][1]["response"].startswith("(fake answer) You asked: Who talks the most?")
+    assert fake_chat.calls == 1
+
+
+def test_repeated_question_is_one_cached_chunk(app_module, fake_chat):
+    client = app_module.app.test_client()
+    first = read_events(ask(client, "Who talks the most?"))
+    second = read_events(ask(client, "who talks the most"))
+    assert [event for event, _ in second] == ["message", "done"]
+    assert second[0][1]["text"] == first[-1][1]["response"] == second[-1][1]["response"]
+    assert fake_chat.calls == 1
+
+
+def test_blocking_endpoint_shares_the_cache(app_module, fake_chat):
+    client = app_module.app.test_client()
+    streamed = read_events(ask(client, "Who talks the most?"))[-1][1]["response"]
+    response = client.post('/api/chat', json={"message": "Who talks the most?", "context": "Stats: 10 messages"})
+    assert response.get_json()["response"] == streamed
+    assert fake_chat.calls == 1
+
+
+def test_model_error_ends_the_stream(app_module, tmp_path, monkeypatch):
+    class FailingModel:
+        model_name = 'failing'
+
+        def generate_content(self, prompt, stream=False):
+            raise RuntimeError("429 quota exceeded")
+
+    chat = GeminiChat(model=FailingModel(), cache=ResponseCache(str(tmp_path / "gemini_cache.sqlite")))
+    monkeypatch.setattr(app_module, "chatbot", chat)
+    events = read_events(ask(app_module.app.test_client(), "Who talks the most?"))
+    assert events[-1][0] == "done"
+    assert "429 quota exceeded" in events[-1][1]["response"]
+    assert len(chat.cache) == 0
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import embeddings
+import vector_helper
+
+
+class CountingHash(embeddings.HashEmbeddingFunction):
+    """The hash stub, counting the texts it is asked to embed."""
+
+    def __init__(self, dimension=64):
+        super().__init__(dimension)
+        self.texts = 0
+
+    def __call__(self, input):
+        self.texts += len(input)
+        return super().__call__(input)
+
+
+def chat(n):
+    return pd.DataFrame({"user": ["Alice", "Bob"] * (n // 2),
+                         "message": [f"message number {i} about topic {i % 7}" for i in range(n)],
+                         "date": pd.date_range("2024-01-01", periods=n, freq="min")})
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return embeddings.EmbeddingCache(str(tmp_path / "embedding_cache.sqlite"))
+
+
+def test_batcher_reuses_cached_and_duplicate_texts(cache):
+    ef = CountingHash()
+    texts = ["a b c", "d e f", "a b c"]
+    first = embeddings.EmbeddingBatcher(ef, cache).embed(texts)
+    assert ef.texts == 2  # the repeated text is embedded once
+    second = embeddings.EmbeddingBatcher(ef, cache).embed(texts + ["g h i"])
+    assert ef.texts == 3  # only the new text misses the cache
+    np.testing.assert_array_equal(first, second[:3])
+
+
+def test_reindexing_is_served_from_the_cache(tmp_path, cache):
+    ef = CountingHash()
+    store = vector_helper.LocalVectorStore(ef, cache, folder=str(tmp_path / "vectors"))
+    store.index_chat(chat(40), "a.txt")
+    assert ef.texts == 40
+    # The same chat uploaded again (new id) embeds nothing; two new messages embed two
+    store.index_chat(chat(40), "b.txt")
+    store.index_chat(chat(42), "c.txt")
+    assert ef.texts == 42
+    assert store.count("c.txt") == 42
+
+
+def test_precomputed_vectors_reach_chroma_without_reembedding(chroma_dir, cache):
+    ef = CountingHash()
+    store = vector_helper.VectorStore(embedding_function=ef, cache=cache)
+    documents, _, ids = vector_helper.chat_documents(chat(40))
+    embeddings.EmbeddingBatcher(ef, cache).embed(documents)
+    assert ef.texts == 40
+
+    # Every vector comes from the cache, and Chroma stores them as given
+    assert store.index_chat(chat(40), "a.txt")
+    assert ef.texts == 40
+    stored = store.client.get_collection("a_txt").get(ids=ids, include=["embeddings"])
+    order = {doc_id: i for i, doc_id in enumerate(stored["ids"])}
+    expected = np.vstack(embeddings.HashEmbeddingFunction(64)(documents))
+    np.testing.assert_allclose(np.asarray(stored["embeddings"])[[order[i] for i in ids]], expected, rtol=1e-6)
+    assert store.index_status("a.txt") == {"status": "done", "indexed": 40, "total": 40}
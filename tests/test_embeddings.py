@@ -0,0 +1,149 @@
+import functools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+import embeddings
+import vector_helper
+
+
+class EmbeddingServer(ThreadingHTTPServer):
+    """OpenAI-compatible /v1/embeddings stub. ``script`` holds the statuses to answer
+    the next requests with (200 once it runs out); every request's input is recorded."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), EmbeddingHandler)
+        self.script = []
+        self.retry_after = None
+        self.requests = []  # (status, input texts)
+        self.lock = threading.Lock()
+        self.url = f"http://127.0.0.1:{self.server_address[1]}/v1/embeddings"
+
+
+class EmbeddingHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server = self.server
+        with server.lock:
+            status = server.script.pop(0) if server.script else 200
+            server.requests.append((status, body["input"]))
+        if status != 200:
+            self.send_response(status)
+            if status == 429 and server.retry_after is not None:
+                self.send_header("Retry-After", server.retry_after)
+            self.end_headers()
+            return
+        vectors = embeddings.HashEmbeddingFunction(16)(body["input"])
+        data = {"data": [{"index": i, "embedding": v.tolist()} for i, v in enumerate(vectors)]}
+        payload = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = EmbeddingServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def ef(server):
+    return embeddings.HttpEmbeddingFunction(server.url, "stub")
+
+
+def batcher(ef, **options):
+    options.setdefault("concurrency", 1)
+    return embeddings.EmbeddingBatcher(ef, None, requests=embeddings.TokenBucket(0),
+                                       tokens=embeddings.TokenBucket(0), **options)
+
+
+def texts(n):
+    return [f"message {i}" for i in range(n)]
+
+
+def test_429_is_retried_after_retry_after(server, ef, monkeypatch):
+    # Exponential backoff alone would wait at least 2.5s; Retry-After asks for 0.2s
+    monkeypatch.setattr(embeddings, "BACKOFF_BASE", 5.0)
+    server.script = [429, 429]
+    server.retry_after = "0.2"
+    b = batcher(ef, batch_size=4)
+    start = time.monotonic()
+    vectors = b.embed(texts(4))
+    elapsed = time.monotonic() - start
+    assert vectors.shape == (4, 16)
+    assert b.retries == 2
+    statuses = [status for status, _ in server.requests]
+    assert statuses[:2] == [429, 429] and set(statuses[2:]) == {200}
+    assert 0.4 <= elapsed < 2.5
+
+
+def test_batch_size_halves_on_429_and_grows_back(server, ef):
+    server.script = [429]
+    server.retry_after = "0"
+    b = batcher(ef, batch_size=8)
+    b.embed(texts(20))
+    sizes = [len(batch) for status, batch in server.requests]
+    # Halved after the 429, then one step (max batch // 10, at least 1) per success
+    assert sizes == [8, 4, 4, 6, 6]
+    assert b.batch_size == 8
+    # Every text was embedded exactly once in the end
+    assert sorted(t for status, batch in server.requests if status == 200 for t in batch) == sorted(texts(20))
+
+
+def test_non_retryable_errors_and_exhausted_retries_raise(server, ef):
+    server.script = [400]
+    with pytest.raises(Exception) as error:
+        batcher(ef).embed(texts(3))
+    assert getattr(error.value, "code", None) == 400
+
+    server.script = [429] * 3
+    server.retry_after = "0"
+    b = batcher(ef, max_retries=2)
+    with pytest.raises(Exception) as error:
+        b.embed(texts(3))
+    assert getattr(error.value, "code", None) == 429
+    assert b.retries == 2
+
+
+def test_interrupted_indexing_resumes_with_append(server, ef, chroma_dir, monkeypatch):
+    # Small requests so the run stops part way: two batches succeed, the third fails
+    monkeypatch.setattr(embeddings, "EmbeddingBatcher",
+                        functools.partial(embeddings.EmbeddingBatcher, batch_size=10, concurrency=1))
+    df = pd.DataFrame({"user": ["Alice", "Bob"] * 25, "message": texts(50),
+                       "date": pd.date_range("2024-01-01", periods=50, freq="min")})
+    cache = embeddings.EmbeddingCache(str(chroma_dir / "embedding_cache.sqlite"))
+    store = vector_helper.VectorStore(embedding_function=ef, cache=cache)
+    server.script = [200, 200, 400]
+    with pytest.raises(Exception):
+        store.index_chat(df, "chat.txt")
+    assert store.count("chat.txt") == 20
+
+    # After a restart the checkpoint marks the collection as interrupted
+    store = vector_helper.VectorStore(embedding_function=ef, cache=embeddings.EmbeddingCache(
+        str(chroma_dir / "other_cache.sqlite")))
+    assert store.interrupted() == ["chat.txt"]
+    assert store.index_status("chat.txt") == {"status": "interrupted", "indexed": 20, "total": 50}
+
+    # Resuming (as app.resume_interrupted_indexing does) only embeds what is missing,
+    # even with an empty embedding cache
+    server.requests.clear()
+    assert store.index_chat(df, "chat.txt", append=True)
+    documents, _, _ = vector_helper.chat_documents(df)
+    assert sorted(t for status, batch in server.requests for t in batch) == sorted(documents[20:])
+    assert store.count("chat.txt") == 50
+    assert store.interrupted() == []
+    assert store.index_status("chat.txt")["status"] == "done"
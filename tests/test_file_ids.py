@@ -0,0 +1,43 @@
+import os
+import shutil
+
+import pytest
+
+CHAT = "12/01/2024, 10:00 - Alice: hello there\n12/01/2024, 10:01 - Bob: hi Alice\n"
+
+
+@pytest.fixture
+def outside_chat():
+    """A chat export next to uploads/, reachable only through a '../' file_id."""
+    path = os.path.join(os.getcwd(), "outside.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(CHAT)
+    yield "../outside"
+    for name in os.listdir(os.getcwd()):
+        if name.startswith("outside"):
+            full = os.path.join(os.getcwd(), name)
+            shutil.rmtree(full) if os.path.isdir(full) else os.remove(full)
+
+
+def test_valid_file_id(app_module):
+    assert app_module.valid_file_id("0b5d2b7e-5c1a-4a8e-9d7e-2f3c4b5a6d7e")
+    for bad in ["../requirements", "requirements", "", None, "0b5d2b7e5c1a4a8e9d7e2f3c4b5a6d7e/..",
+                "0b5d2b7e-5c1a-4a8e-9d7e-2f3c4b5a6d7e/../x"]:
+        assert not app_module.valid_file_id(bad)
+
+
+@pytest.mark.parametrize("method, url, payload", [
+    ("post", "/analyze/whatsapp_result", {"json": {"file_id": "FILE"}}),
+    ("post", "/api/search", {"json": {"file_id": "FILE", "q": "hello"}}),
+    ("get", "/api/search", {"query_string": {"file_id": "FILE", "q": "hello"}}),
+    ("post", "/api/chat", {"json": {"file_id": "FILE", "message": "hi"}}),
+    ("post", "/api/chat/stream", {"json": {"file_id": "FILE", "message": "hi"}}),
+    ("get", "/download_report", {"query_string": {"file_id": "FILE"}}),
+])
+def test_path_file_ids_are_rejected(app_module, outside_chat, method, url, payload):
+    payload = {key: {k: (outside_chat if v == "FILE" else v) for k, v in value.items()}
+               for key, value in payload.items()}
+    before = set(os.listdir(os.getcwd()))
+    response = getattr(app_module.app.test_client(), method)(url, **payload)
+    assert response.status_code == 400
+    assert set(os.listdir(os.getcwd())) == before
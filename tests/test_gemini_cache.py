@@ -0,0 +1,138 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import gemini_helper
+from gemini_helper import GeminiChat, ResponseCache
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "gemini_cache.sqlite")
+
+
+def make_chat(cache_path, model, **cache_options):
+    return GeminiChat(model=model, cache=ResponseCache(cache_path, **cache_options))
+
+
+class EmptyModel:
+    model_name = 'empty'
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, prompt, stream=False):
+        self.calls += 1
+        return SimpleNamespace(text="")
+
+
+class FailingModel:
+    model_name = 'failing'
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, prompt, stream=False):
+        self.calls += 1
+        raise RuntimeError("429 quota exceeded")
+
+
+def test_repeated_question_is_a_cache_hit(fake_model, cache_path):
+    model = fake_model(delay=0)
+    chat = make_chat(cache_path, model)
+    first = chat.get_response("Who talks the most?", "context A")
+    # Case, spacing and trailing punctuation don't make a new question
+    assert chat.get_response("  who TALKS the most ", "context A") == first
+    assert model.calls == 1
+    assert chat.stats()["hits"] == 1
+
+
+def test_other_context_misses(fake_model, cache_path):
+    model = fake_model(delay=0)
+    chat = make_chat(cache_path, model)
+    chat.get_response("Who talks the most?", "context A")
+    chat.get_response("Who talks the most?", "context B")
+    assert model.calls == 2
+
+
+def test_cache_survives_restart(fake_model, cache_path):
+    model = fake_model(delay=0)
+    make_chat(cache_path, model).get_response("question", "context")
+    make_chat(cache_path, model).get_response("question", "context")
+    assert model.calls == 1
+
+
+def test_entries_expire_after_ttl(fake_model, cache_path, monkeypatch):
+    model = fake_model(delay=0)
+    chat = make_chat(cache_path, model, ttl=60)
+    now = time.time()
+    monkeypatch.setattr(gemini_helper.time, "time", lambda: now)
+    chat.get_response("question", "context")
+    monkeypatch.setattr(gemini_helper.time, "time", lambda: now + 59)
+    chat.get_response("question", "context")
+    assert model.calls == 1
+    monkeypatch.setattr(gemini_helper.time, "time", lambda: now + 61)
+    chat.get_response("question", "context")
+    assert model.calls == 2
+
+
+def test_least_recently_used_are_evicted_past_max_entries(fake_model, cache_path):
+    model = fake_model(delay=0)
+    chat = make_chat(cache_path, model, max_entries=3)
+    for question in ["a", "b", "c"]:
+        chat.get_response(question, "context")
+    time.sleep(0.01)
+    chat.get_response("a", "context")  # hit: "a" is now the most recently used
+    chat.get_response("d", "context")  # evicts "b"
+    assert len(chat.cache) == 3
+    assert chat.stats()["evictions"] == 1
+    calls = model.calls
+    chat.get_response("a", "context")
+    assert model.calls == calls
+    chat.get_response("b", "context")
+    assert model.calls == calls + 1
+
+
+def test_concurrent_identical_questions_share_one_request(fake_model, cache_path):
+    model = fake_model(delay=0.3)
+    chat = make_chat(cache_path, model)
+    answers = []
+    threads = [threading.Thread(target=lambda: answers.append(chat.get_response("question", "context")))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert model.calls == 1
+    assert len(answers) == 8 and len(set(answers)) == 1
+    stats = chat.stats()
+    assert stats["misses"] == 1 and stats["hits"] + stats["coalesced"] == 7
+
+
+def test_errors_are_not_cached(cache_path):
+    model = FailingModel()
+    chat = make_chat(cache_path, model)
+    assert "429 quota exceeded" in chat.get_response("question", "context")
+    chat.get_response("question", "context")
+    assert model.calls == 2
+    assert len(chat.cache) == 0
+    assert chat.stats()["errors"] == 2
+
+
+def test_empty_answers_are_not_cached(cache_path):
+    model = EmptyModel()
+    chat = make_chat(cache_path, model)
+    assert chat.get_response("question", "context")
+    chat.get_response("question", "context")
+    assert model.calls == 2
+    assert len(chat.cache) == 0
+
+
+def test_ttl_zero_disables_the_cache(fake_model, cache_path):
+    model = fake_model(delay=0)
+    chat = make_chat(cache_path, model, ttl=0)
+    chat.get_response("question", "context")
+    chat.get_response("question", "context")
+    assert model.calls == 2
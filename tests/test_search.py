@@ -0,0 +1,42 @@
+import io
+
+import pytest
+
+import text_index
+
+CHAT = ("12/01/2024, 10:00 - Alice: hello there\n"
+        "12/01/2024, 10:01 - Bob: hi Alice, aaaaaaaaaaaaaaaaaaaaaaaaaaaaab\n"
+        "12/01/2024, 10:02 - Alice: see you tomorrow\n")
+
+
+@pytest.fixture(scope="module")
+def file_id(app_module):
+    response = app_module.app.test_client().post(
+        "/analyze/whatsapp", data={"file": (io.BytesIO(CHAT.encode()), "chat.txt"), "chart_mode": "data", "wait": "1"})
+    assert response.status_code == 200
+    return response.get_json()["file_id"]
+
+
+def search(app_module, file_id, q, mode):
+    return app_module.app.test_client().post("/api/search", json={"file_id": file_id, "q": q, "search_mode": mode})
+
+
+def test_regex_search(app_module, file_id):
+    response = search(app_module, file_id, r"hel+o", "regex")
+    assert response.status_code == 200
+    assert response.get_json()["total"] == 1
+
+
+@pytest.mark.parametrize("q", [r"(a+)+$", r"(a|aa)*b", "(unclosed"])
+def test_nested_quantifier_regex_is_rejected(app_module, file_id, q):
+    response = search(app_module, file_id, q, "regex")
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_compile_regex_without_the_parser(monkeypatch):
+    # Without re._parser the nested-quantifier check is skipped; the time budget still applies
+    monkeypatch.setattr(text_index, "sre_parse", None)
+    assert text_index.compile_regex(r"(a+)+$").search("aaa")
+    with pytest.raises(ValueError):
+        text_index.compile_regex("(unclosed")
@@ -0,0 +1,27 @@
+import io
+import time
+
+CHAT = "12/01/2024, 10:00 - Alice: hello there\n12/01/2024, 10:01 - Bob: hi Alice\n"
+
+
+def wait_for_job(client, status_url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(status_url).get_json()
+        if job["status"] in ("done", "error"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError("upload job did not finish")
+
+
+def test_upload_answers_file_id_with_the_job_result(app_module):
+    client = app_module.app.test_client()
+    response = client.post("/analyze/whatsapp", data={"file": (io.BytesIO(CHAT.encode()), "chat.txt"),
+                                                       "chart_mode": "data"})
+    assert response.status_code == 202
+    body = response.get_json()
+    # The id isn't known until the job has decided between appending and a full run
+    assert "file_id" not in body
+    job = wait_for_job(client, body["status_url"])
+    assert job["status"] == "done"
+    assert app_module.valid_file_id(job["result"]["file_id"])
@@ -0,0 +1,492 @@
+import math
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# CPython's private regex parser, used to spot nested quantifiers before compiling.
+# Without it (other interpreters, or a release that moves it) that check is skipped
+# and regex searches rely on the row-by-row time budget alone.
+try:
+    import re._parser as sre_parse
+except ImportError:
+    sre_parse = None
+
+import token_stats
+
+
+# ──────────────────────────────────────────────
+#  INVERTED TEXT INDEX (keyword search + BM25, one per chat)
+# ──────────────────────────────────────────────
+# Built once at upload from every message, lowercased and split into \w+ tokens:
+#   terms     vocabulary in first-seen order; also kept '\n'-joined, so the terms
+#             containing a search word are found by one regex scan of that string
+#   offsets   CSR offsets: the postings of term t are rows/tf[offsets[t]:offsets[t+1]]
+#   rows, tf  row positions (ascending within a term) and term frequencies
+#   doc_len   tokens per message, for BM25 length normalization
+#   user      sender code of each row, for scoped searches
+#   row_ids   the chat's row ids (they key the vector index: "msg_<id>")
+# Keyword search intersects posting lists and checks the exact text only on the rows
+# left. BM25 ranking adds up per-term contributions over the postings with numpy.
+# Stored as uploads/<id>.text_index.npz, tagged with the export's content hash.
+INDEX_VERSION = 1
+_TOKEN_RE = re.compile(r"\w+")
+_MEDIA_MESSAGE = token_stats.MEDIA_MESSAGE.strip()
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def _index_path(folder, file_id):
+    return os.path.join(folder, f"{file_id}.text_index.npz")
+
+
+class TextIndex:
+    def __init__(self, terms, offsets, rows, tf, doc_len, user, users, row_ids, retrievable, content_hash=None):
+        self.terms = terms
+        self.offsets = offsets
+        self.rows = rows
+        self.tf = tf
+        self.doc_len = doc_len
+        self.user = user
+        self.users = users
+        self.row_ids = row_ids
+        self.retrievable = retrievable
+        self.content_hash = content_hash
+        self.term_id = {t: i for i, t in enumerate(terms)}
+        self._joined = "\n" + "\n".join(terms) + "\n"
+        # Start of each term in _joined, for mapping a regex match back to its term
+        self._starts = np.cumsum([1] + [len(t) + 1 for t in terms[:-1]]) if terms else np.zeros(0, dtype=np.int64)
+        self.avg_len = float(doc_len.mean()) if len(doc_len) else 0.0
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    def nbytes(self):
+        """Approximate resident size: the arrays, the vocabulary and its lookups."""
+        arrays = (self.offsets, self.rows, self.tf, self.doc_len, self.user, self.row_ids, self.retrievable,
+                  self._starts)
+        return (sum(np.asarray(a).nbytes for a in arrays)
+                + sys.getsizeof(self.terms) + sum(sys.getsizeof(t) for t in self.terms)
+                + sys.getsizeof(self.term_id) + sys.getsizeof(self._joined)
+                + sys.getsizeof(self.users) + sum(sys.getsizeof(u) for u in self.users))
+
+    def postings(self, term_ids):
+        """Sorted unique row positions containing any of ``term_ids``."""
+        if not len(term_ids):
+            return np.zeros(0, dtype=np.int32)
+        if len(term_ids) == 1:
+            return self.rows[self.offsets[term_ids[0]]:self.offsets[term_ids[0] + 1]]
+        mask = np.zeros(len(self), dtype=bool)
+        for t in term_ids:
+            mask[self.rows[self.offsets[t]:self.offsets[t + 1]]] = True
+        return np.flatnonzero(mask).astype(np.int32)
+
+    def matching_terms(self, token, prefix_open=False, suffix_open=False):
+        """Ids of terms equal to ``token``, or also ending with it (``prefix_open``) /
+        starting with it (``suffix_open``) / containing it (both)."""
+        if not prefix_open and not suffix_open:
+            term = self.term_id.get(token)
+            return [] if term is None else [term]
+        # Closed ends are anchored to the line (term) boundaries of the joined vocabulary
+        pattern = re.compile(("" if prefix_open else "^") + re.escape(token) + ("" if suffix_open else "$"),
+                             re.MULTILINE)
+        starts = [m.start() for m in pattern.finditer(self._joined)]
+        return np.unique(np.searchsorted(self._starts, starts, side='right') - 1).tolist()
+
+    def candidate_rows(self, query):
+        """Row positions that can contain ``query`` as a case-insensitive substring,
+        or None when the query has no word characters to look up."""
+        text = query.lower()
+        tokens = list(_TOKEN_RE.finditer(text))
+        if not tokens:
+            return None
+        rows = None
+        for i, m in enumerate(tokens):
+            # Only the query's outer words can be cut off inside a longer message word
+            prefix_open = i == 0 and m.start() == 0
+            suffix_open = i == len(tokens) - 1 and m.end() == len(text)
+            found = self.postings(self.matching_terms(m.group(), prefix_open, suffix_open))
+            rows = found if rows is None else np.intersect1d(rows, found, assume_unique=True)
+            if not len(rows):
+                break
+        return rows
+
+    def scope_mask(self, user=None, retrievable_only=False):
+        """Boolean row mask for a dashboard user ('Overall'/None = everyone)."""
+        mask = self.retrievable.copy() if retrievable_only else np.ones(len(self), dtype=bool)
+        if user and user != "Overall":
+            code = self.users.index(user) if user in self.users else -1
+            mask &= self.user == code
+        return mask
+
+    def bm25(self, query, k=18, user=None, k1=BM25_K1, b=BM25_B):
+        """Top ``k`` (row position, score) pairs for ``query`` among the messages worth
+        retrieving (no notifications or media placeholders), best first."""
+        tokens = list(dict.fromkeys(_TOKEN_RE.findall(query.lower())))
+        stop_words = token_stats.load_stop_words()
+        terms = [t for t in tokens if t not in stop_words] or tokens
+        scores = np.zeros(len(self), dtype=np.float32)
+        n = len(self)
+        for token in terms:
+            term = self.term_id.get(token)
+            if term is None:
+                continue
+            rows = self.rows[self.offsets[term]:self.offsets[term + 1]]
+            tf = self.tf[self.offsets[term]:self.offsets[term + 1]].astype(np.float32)
+            idf = math.log(1 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = k1 * (1 - b + b * self.doc_len[rows] / max(self.avg_len, 1e-9))
+            scores[rows] += idf * tf * (k1 + 1) / (tf + norm)
+        scores[~self.scope_mask(user, retrievable_only=True)] = 0
+        hits = np.flatnonzero(scores)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.lexsort((hits, -scores[hits]))]
+        return [(int(pos), float(scores[pos])) for pos in hits]
+
+
+def _postings(df, term_id, terms, start=0):
+    """(term, row, tf) triples, doc lengths and retrievable flags for ``df``'s
+    messages; new words are added to ``term_id``/``terms``."""
+    term_col, row_col, tf_col = [], [], []
+    doc_len = np.zeros(len(df), dtype=np.int32)
+    for pos, message in enumerate(df['message'].tolist()):
+        tokens = _TOKEN_RE.findall(message.lower())
+        doc_len[pos] = len(tokens)
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, count in counts.items():
+            term = term_id.get(token)
+            if term is None:
+                term = term_id[token] = len(terms)
+                terms.append(token)
+            term_col.append(term)
+            row_col.append(start + pos)
+            tf_col.append(count)
+    messages = df['message'].astype(object).str.strip()
+    retrievable = ((df['user'].astype(object) != 'group_notification') & (messages.str.len() > 1)
+                   & (messages != _MEDIA_MESSAGE)).to_numpy(dtype=bool)
+    return (np.asarray(term_col, dtype=np.int64), np.asarray(row_col, dtype=np.int32),
+            np.asarray(tf_col, dtype=np.int32), doc_len, retrievable)
+
+
+def _csr(term_col, row_col, tf_col, n_terms):
+    # Stable sort keeps rows ascending within each term
+    order = np.argsort(term_col, kind='stable')
+    offsets = np.zeros(n_terms + 1, dtype=np.int64)
+    np.cumsum(np.bincount(term_col, minlength=n_terms), out=offsets[1:])
+    return offsets, row_col[order], tf_col[order]
+
+
+def _user_codes(df, users):
+    code_of = {u: i for i, u in enumerate(users)}
+    for u in df['user'].astype(object).unique().tolist():
+        if u not in code_of:
+            code_of[u] = len(users)
+            users.append(u)
+    return np.asarray([code_of[u] for u in df['user'].astype(object).tolist()], dtype=np.int32)
+
+
+def build_index(df, content_hash=None):
+    """Tokenize the whole chat once into a TextIndex (rows in ``df`` order)."""
+    term_id, terms, users = {}, [], []
+    term_col, row_col, tf_col, doc_len, retrievable = _postings(df, term_id, terms)
+    offsets, rows, tf = _csr(term_col, row_col, tf_col, len(terms))
+    return TextIndex(terms, offsets, rows, tf, doc_len, _user_codes(df, users), users,
+                     df.index.to_numpy(dtype=np.int64), retrievable, content_hash)
+
+
+def extend_index(index, tail_df, content_hash=None):
+    """Index of a chat extended by ``tail_df`` (rows appended after the indexed ones):
+    only the new messages are tokenized."""
+    terms, users = list(index.terms), list(index.users)
+    term_id = dict(index.term_id)
+    term_col, row_col, tf_col, doc_len, retrievable = _postings(tail_df, term_id, terms, start=len(index))
+    old_terms = np.repeat(np.arange(len(index.terms), dtype=np.int64), np.diff(index.offsets))
+    offsets, rows, tf = _csr(np.concatenate([old_terms, term_col]), np.concatenate([index.rows, row_col]),
+                             np.concatenate([index.tf, tf_col]), len(terms))
+    return TextIndex(terms, offsets, rows, tf, np.concatenate([index.doc_len, doc_len]),
+                     np.concatenate([index.user, _user_codes(tail_df, users)]), users,
+                     np.concatenate([index.row_ids, tail_df.index.to_numpy(dtype=np.int64)]),
+                     np.concatenate([index.retrievable, retrievable]), content_hash)
+
+
+def save_index(index, folder, file_id):
+    path = _index_path(folder, file_id)
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, version=np.array([INDEX_VERSION]), content_hash=np.array([index.content_hash or ""]),
+             terms=np.frombuffer("\n".join(index.terms).encode('utf-8'), dtype=np.uint8),
+             users=np.frombuffer("\n".join(index.users).encode('utf-8'), dtype=np.uint8),
+             offsets=index.offsets, rows=index.rows, tf=index.tf, doc_len=index.doc_len,
+             user=index.user, row_ids=index.row_ids, retrievable=index.retrievable)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_index(folder, file_id, content_hash=None):
+    """Return the stored index, or None if it is missing, old, or built from another export."""
+    path = _index_path(folder, file_id)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            if int(data['version'][0]) != INDEX_VERSION or (content_hash and str(data['content_hash'][0]) != content_hash):
+                print(f"[TextIndex] STALE index for {file_id}")
+                return None
+            terms = data['terms'].tobytes().decode('utf-8')
+            users = data['users'].tobytes().decode('utf-8')
+            return TextIndex(terms.split("\n") if terms else [], data['offsets'], data['rows'], data['tf'],
+                             data['doc_len'], data['user'], users.split("\n") if users else [], data['row_ids'],
+                             data['retrievable'], content_hash)
+    except Exception as e:
+        print(f"[TextIndex] Failed to read {path}: {e}")
+        return None
+
+
+# ──────────────────────────────────────────────
+#  DASHBOARD SEARCH (filtered, sorted, cursor-paginated)
+# ──────────────────────────────────────────────
+# A search narrows the chat to candidate rows (literal mode: the rows holding all
+# of the query's words, from the index; regex mode: every row), applies the sender
+# and date filters as masks, orders them by date and checks the text in chunks:
+# the rows after the cursor first, to fill the page, then the rest for the count.
+# Checking stops at SEARCH_TIME_BUDGET, in which case the count is a lower bound
+# (total_exact = False) and the cursor still leads to the next matches. Complete
+# match lists are kept in a small LRU, so further pages are just slices.
+# Cursors are "<date ns>:<row>" of the last row returned (keyset pagination), so
+# they stay valid when newer messages are appended to the chat.
+SEARCH_PAGE_SIZE = 50
+SEARCH_MAX_PAGE_SIZE = 200
+SEARCH_TIME_BUDGET = float(os.environ.get("SEARCH_TIME_BUDGET", "0.5"))
+SEARCH_MAX_QUERY = 200
+# Regexes run on Python's backtracking engine, which can't be interrupted mid-match.
+# They are kept short, and a repeat over a group that itself repeats or alternates
+# ("(a+)+", "(a|aa)*"), the shape of catastrophic backtracking, is rejected.
+SEARCH_MAX_REGEX = 100
+SEARCH_CACHE_ENTRIES = 64
+_CHUNK = 4096
+
+_results = OrderedDict()  # (content hash, rows, query, filters) -> match positions in sort order
+_results_lock = threading.Lock()
+
+
+def _unbounded_repeats(parsed):
+    """Yield (repeated items, max count) for each repeat in a parsed pattern, at any depth."""
+    for op, arg in parsed:
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, sre_parse.POSSESSIVE_REPEAT):
+            yield arg[2], arg[1]
+            yield from _unbounded_repeats(arg[2])
+        elif op == sre_parse.SUBPATTERN:
+            yield from _unbounded_repeats(arg[3])
+        elif op in (sre_parse.ATOMIC_GROUP, sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            yield from _unbounded_repeats(arg if op == sre_parse.ATOMIC_GROUP else arg[1])
+        elif op == sre_parse.BRANCH:
+            for branch in arg[1]:
+                yield from _unbounded_repeats(branch)
+
+
+def _is_ambiguous(parsed):
+    """Whether ``parsed`` can match the same text more than one way under a repeat:
+    it repeats or alternates."""
+    for op, arg in parsed:
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, sre_parse.BRANCH):
+            return True
+        if op == sre_parse.SUBPATTERN and _is_ambiguous(arg[3]):
+            return True
+    return False
+
+
+def compile_regex(query):
+    """Compiled case-insensitive search regex; ValueError if it's invalid, too long,
+    or nests quantifiers."""
+    if len(query) > SEARCH_MAX_REGEX:
+        raise ValueError(f"Regular expression must be at most {SEARCH_MAX_REGEX} characters")
+    try:
+        pattern = re.compile(query, re.IGNORECASE)
+    except re.error as e:
+        raise ValueError(f"Invalid regular expression: {e}")
+    if sre_parse is None:
+        return pattern
+    for items, most in _unbounded_repeats(sre_parse.parse(query, re.IGNORECASE)):
+        if most > 1 and _is_ambiguous(items):
+            raise ValueError("Regular expression has a repeated group that repeats or alternates "
+                             "(e.g. '(a+)+'); simplify it")
+    return pattern
+
+
+def _matcher(df, query, mode):
+    """fn(positions, deadline) -> (boolean array of which rows' messages match, rows checked).
+
+    Regexes are checked one row at a time and stop at ``deadline`` (the first row is
+    always checked, so a search advances); literal matching is vectorized per chunk.
+    """
+    messages = df['message']
+    if mode == "regex":
+        pattern = compile_regex(query)
+
+        def matches(rows, deadline):
+            found = np.zeros(len(rows), dtype=bool)
+            for i, message in enumerate(messages.iloc[rows].tolist()):
+                if i and time.perf_counter() > deadline:
+                    return found[:i], i
+                found[i] = pattern.search(message) is not None
+            return found, len(rows)
+        return matches
+    needle = query.lower()
+    return lambda rows, deadline: (
+        messages.iloc[rows].str.lower().str.contains(needle, regex=False, na=False).to_numpy(dtype=bool), len(rows))
+
+
+def _date_bound(value, end=False):
+    """ns timestamp of a 'YYYY-MM-DD' (or full timestamp) bound; an end date covers its whole day."""
+    if not value:
+        return None
+    try:
+        stamp = pd.Timestamp(value)
+    except ValueError:
+        raise ValueError(f"Invalid date: {value!r}")
+    if end and len(str(value)) <= 10:
+        stamp += pd.Timedelta(days=1)
+    return stamp.value
+
+
+def parse_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        date_ns, row = cursor.split(":")
+        return int(date_ns), int(row)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
+
+def _chunks(rows):
+    for i in range(0, len(rows), _CHUNK):
+        yield rows[i:i + _CHUNK]
+
+
+def search(df, index, query, mode="literal", user=None, start=None, end=None, order="asc", cursor=None,
+           limit=SEARCH_PAGE_SIZE, budget=SEARCH_TIME_BUDGET):
+    """One page of messages matching ``query`` (case-insensitive).
+
+    ``mode`` is "literal" or "regex"; ``user`` ('Overall'/None = everyone) and
+    ``start``/``end`` (inclusive dates) filter; ``order`` is "asc" (oldest first)
+    or "desc". Returns {"rows": positions in ``df``, "total", "total_exact",
+    "next_cursor"}. Raises ValueError for a bad query, regex, date or cursor.
+    """
+    if mode not in ("literal", "regex"):
+        raise ValueError(f"Unknown search mode: {mode!r}")
+    if not query or len(query) > SEARCH_MAX_QUERY:
+        raise ValueError(f"Search query must be 1-{SEARCH_MAX_QUERY} characters")
+    user = user if user and user != "Overall" else None
+    descending = order == "desc"
+    try:
+        limit = max(1, min(int(limit), SEARCH_MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid limit: {limit!r}")
+    lower, upper = _date_bound(start), _date_bound(end, end=True)
+    after = parse_cursor(cursor)
+    matches = _matcher(df, query, mode)
+    if index is not None and len(index) != len(df):
+        index = None
+    dates = df['date'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+    key = (index.content_hash, len(df), mode, query, user, lower, upper) if index is not None and index.content_hash else None
+    with _results_lock:
+        hits = _results.get(key) if key is not None else None
+        if hits is not None:
+            _results.move_to_end(key)
+
+    if hits is not None:
+        rows = hits
+    else:
+        # Candidate rows, filtered, in (date, row) order
+        rows = index.candidate_rows(query) if index is not None and mode == "literal" else None
+        if rows is None:
+            rows = np.arange(len(df))
+        keep = np.ones(len(rows), dtype=bool)
+        if user is not None:
+            keep &= (index.scope_mask(user)[rows] if index is not None
+                     else (df['user'].iloc[rows].astype(object) == user).to_numpy(dtype=bool))
+        if lower is not None:
+            keep &= dates[rows] >= lower
+        if upper is not None:
+            keep &= dates[rows] < upper
+        rows = rows[keep]
+        rows = rows[np.lexsort((rows, dates[rows]))]
+
+    ordered = rows[::-1] if descending else rows
+    begin = 0
+    if after is not None:
+        # Rows at or before the cursor key in this order are on earlier pages
+        if descending:
+            done = (dates[ordered] > after[0]) | ((dates[ordered] == after[0]) & (ordered >= after[1]))
+        else:
+            done = (dates[ordered] < after[0]) | ((dates[ordered] == after[0]) & (ordered <= after[1]))
+        begin = int(np.count_nonzero(done))
+
+    if hits is not None:
+        page = ordered[begin:begin + limit]
+        next_row = page[-1] if begin + limit < len(ordered) else None
+        return {"rows": page, "total": len(hits), "total_exact": True,
+                "next_cursor": f"{dates[next_row]}:{int(next_row)}" if next_row is not None else None}
+
+    # Check the text: rows after the cursor first (they fill the page), then the rest,
+    # which are only counted. At least one chunk is always checked, so paging advances.
+    deadline = time.perf_counter() + budget
+    found_after, found_before = [], []
+    scanned_to = None  # last row checked after the cursor, when that part was cut short
+    exact = True
+    pending = ordered[begin:]
+    done = 0
+    while done < len(pending):
+        chunk = pending[done:done + _CHUNK]
+        found, checked = matches(chunk, deadline)
+        found_after.append(chunk[:checked][found])
+        done += checked
+        if done < len(pending) and (checked < len(chunk) or time.perf_counter() > deadline):
+            exact = False
+            scanned_to = pending[done - 1]
+            break
+    if exact:
+        for chunk in _chunks(ordered[:begin]):
+            if time.perf_counter() > deadline:
+                exact = False
+                break
+            found, checked = matches(chunk, deadline)
+            found_before.append(chunk[:checked][found])
+            if checked < len(chunk):
+                exact = False
+                break
+    found_after = np.concatenate(found_after) if found_after else np.zeros(0, dtype=np.int64)
+    total = len(found_after) + sum(len(f) for f in found_before)
+
+    page = found_after[:limit]
+    next_row = None
+    if len(found_after) > limit:
+        next_row = page[-1]
+    elif scanned_to is not None:
+        next_row = scanned_to
+    if exact and key is not None:
+        all_hits = np.concatenate(found_before + [found_after])
+        with _results_lock:
+            _results[key] = all_hits[::-1] if descending else all_hits
+            while len(_results) > SEARCH_CACHE_ENTRIES:
+                _results.popitem(last=False)
+    return {"rows": page, "total": total, "total_exact": exact,
+            "next_cursor": f"{dates[next_row]}:{int(next_row)}" if next_row is not None else None}
+
+
+def rrf_fuse(rankings, k=60):
+    """Reciprocal rank fusion: keys ordered by the sum of 1 / (k + rank) over the
+    rankings they appear in (ties keep first-seen order)."""
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda key: -scores[key])
@@ -0,0 +1,117 @@
+import os
+import re
+import threading
+from collections import Counter
+
+import pandas as pd
+from wordcloud import STOPWORDS
+
+
+# ──────────────────────────────────────────────
+#  TOKEN STATISTICS (one tokenization pass per chat)
+# ──────────────────────────────────────────────
+# Every message is lowercased and split once. That single pass yields:
+#   words:  per-user word totals over all messages (the "Total Words" stat)
+#   tokens: per-user token counts with stop words removed (group notifications and
+#           media messages skipped), in long form: user / token / count plus the
+#           first-occurrence ranks needed to break ties exactly like Counter does
+# The top-20 list and the wordcloud frequencies are both sliced from `tokens`.
+STOP_WORDS_PATH = 'stop_words.txt'
+MEDIA_MESSAGE = '<Media omitted>\n'
+TOP_WORDS = 20
+# What WordCloud.process_text treats as a word
+_WORD_RE = re.compile(r"\w[\w']*")
+
+_stop_words = None
+_stop_words_stat = None
+_stop_words_lock = threading.Lock()
+
+
+def load_stop_words(path=STOP_WORDS_PATH):
+    """Stop words as a set, re-read only when the file changes."""
+    global _stop_words, _stop_words_stat
+    try:
+        st = os.stat(path)
+        stat = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        stat = None
+    with _stop_words_lock:
+        if _stop_words is None or stat != _stop_words_stat:
+            words = set()
+            if stat is not None:
+                with open(path, 'r', encoding='utf-8') as f:
+                    words = set(f.read().lower().split())
+            _stop_words, _stop_words_stat = frozenset(words), stat
+        return _stop_words
+
+
+def build_tables(df, stop_words=None):
+    """Tokenize the chat once; return {'words': Series by user, 'tokens': DataFrame}."""
+    stop_words = load_stop_words() if stop_words is None else stop_words
+    words = Counter()
+    overall = Counter()
+    per_user = {}
+    for user, message in zip(df['user'].tolist(), df['message'].tolist()):
+        tokens = message.lower().split()
+        words[user] += len(tokens)
+        if user == 'group_notification' or message == MEDIA_MESSAGE:
+            continue
+        kept = [t for t in tokens if t not in stop_words]
+        overall.update(kept)
+        counter = per_user.get(user)
+        if counter is None:
+            counter = per_user[user] = Counter()
+        counter.update(kept)
+
+    # Counters keep first-insertion order, which is what most_common() uses for ties
+    rank = {token: i for i, token in enumerate(overall)}
+    columns = {'user': [], 'token': [], 'count': [], 'user_rank': [], 'rank': []}
+    for user, counter in per_user.items():
+        for i, (token, count) in enumerate(counter.items()):
+            columns['user'].append(user)
+            columns['token'].append(token)
+            columns['count'].append(count)
+            columns['user_rank'].append(i)
+            columns['rank'].append(rank[token])
+    tokens = pd.DataFrame(columns).astype({'count': 'int64', 'user_rank': 'int64', 'rank': 'int64'})
+    tokens['user'] = tokens['user'].astype('category')
+    return {'words': pd.Series(words, dtype='int64'), 'tokens': tokens}
+
+
+def scope_counts(selected_user, tokens, key='token'):
+    """Counts for a scope, ordered like Counter.most_common() would order them.
+
+    Works on any long-form user / ``key`` / count / user_rank / rank table.
+    """
+    if selected_user != 'Overall':
+        scoped = tokens[tokens['user'] == selected_user]
+        return scoped.sort_values(['count', 'user_rank'], ascending=[False, True])[[key, 'count']]
+    merged = tokens.groupby(key, sort=False).agg(count=('count', 'sum'), rank=('rank', 'first')).reset_index()
+    return merged.sort_values(['count', 'rank'], ascending=[False, True])[[key, 'count']]
+
+
+def most_common_words(selected_user, tokens, n=TOP_WORDS):
+    """Same frame as pd.DataFrame(Counter(words).most_common(n)): columns 0 (word) and 1 (count)."""
+    top = scope_counts(selected_user, tokens).head(n)
+    return pd.DataFrame(list(zip(top['token'].tolist(), top['count'].tolist())))
+
+
+def wordcloud_frequencies(selected_user, tokens):
+    """Word -> count table for WordCloud.generate_from_frequencies.
+
+    Tokens are split into words the way WordCloud.process_text does (punctuation
+    dropped, trailing 's removed, numbers and WordCloud's English stop words skipped).
+    Unlike WordCloud.generate(), two-word collocations are not counted and plurals
+    are not merged into their singular ("dogs" and "dog" stay separate entries):
+    both need the running text, and this table is built from per-user token counts.
+    """
+    frequencies = Counter()
+    scoped = scope_counts(selected_user, tokens)
+    for token, count in zip(scoped['token'].tolist(), scoped['count'].tolist()):
+        for word in _WORD_RE.findall(token):
+            if word.endswith("'s"):
+                word = word[:-2]
+            if not word or word.isdigit() or word in STOPWORDS:
+                continue
+            frequencies[word] += count
+    return dict(frequencies)
@@ -0,0 +1,266 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import Counter
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# ──────────────────────────────────────────────
+#  TOXICITY SCANNER (compiled once from bad_words.txt)
+# ──────────────────────────────────────────────
+# Matching rules (unchanged from the original per-message loops):
+#   1. multi-word phrases, longest first, are counted as substrings and masked out
+#   2. the rest is split on whitespace, tokens are stripped of PUNCT, and every token
+#      equal to a single-word term counts once
+# Two compiled trie regexes (phrases anywhere, single terms between whitespace or
+# punctuation) match a superset of those rules, so one pass over the chat finds the
+# few candidate messages; only those go through the exact rules above.
+# The compiled scanner is reused until bad_words.txt changes on disk.
+BAD_WORDS_PATH = os.path.join(os.path.dirname(__file__), 'bad_words.txt')
+PUNCT = '.,!?;:()[]{}"\'-'
+
+_scanner = None
+_scanner_stat = None
+_scanner_lock = threading.Lock()
+
+
+def load_bad_words(path=BAD_WORDS_PATH):
+    if not os.path.isfile(path):
+        return []
+    terms = []
+    seen = set()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            t = line.lower()
+            if t not in seen:
+                seen.add(t)
+                terms.append(t)
+    return terms
+
+
+def trie_regex(terms):
+    """Regex matching any of ``terms``, with shared prefixes factored out.
+
+    Hundreds of plain alternatives are tried one by one at every position; as a trie
+    each position costs a single character check for most text.
+    """
+    trie = {}
+    for term in terms:
+        node = trie
+        for ch in term:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+
+    def build(node):
+        alts = [re.escape(ch) + build(node[ch]) for ch in sorted(k for k in node if k)]
+        if not alts:
+            return ''
+        body = alts[0] if len(alts) == 1 else '(?:' + '|'.join(alts) + ')'
+        # A term ends here: the longer continuations are optional
+        return f'(?:{body})?' if '' in node else body
+
+    return build(trie)
+
+
+class ToxicityScanner:
+    def __init__(self, terms):
+        self.terms = list(terms)
+        self.phrases = sorted([t for t in self.terms if ' ' in t], key=len, reverse=True)
+        self.singles = [t for t in self.terms if ' ' not in t]
+        self._single_rank = {s: i for i, s in enumerate(self.singles)}
+        # Identifies the term list, e.g. to invalidate results computed with an older one
+        self.fingerprint = hashlib.sha256('\n'.join(self.terms).encode('utf-8')).hexdigest()
+
+        self._phrase_re = re.compile(trie_regex(self.phrases)) if self.phrases else None
+        self._single_re = None
+        if self.singles:
+            # A token equal to a single term is surrounded by whitespace/punctuation
+            not_boundary = f"[^\\s{re.escape(PUNCT)}]"
+            self._single_re = re.compile(f"(?<!{not_boundary}){trie_regex(self.singles)}(?!{not_boundary})")
+
+    def triggers(self, msg_lower):
+        """Matched terms for one lowercased message, phrases first then single words."""
+        if not self.terms or not msg_lower:
+            return []
+        masked = msg_lower
+        found = []
+        if self._phrase_re is not None and self._phrase_re.search(masked):
+            for p in self.phrases:
+                c = masked.count(p)
+                if c:
+                    found.extend([p] * c)
+                    masked = masked.replace(p, ' ' * len(p))
+        counts = Counter()
+        for raw in masked.split():
+            w = raw.strip(PUNCT).lower()
+            if w in self._single_rank:
+                counts[w] += 1
+        for s in sorted(counts, key=self._single_rank.get):
+            found.extend([s] * counts[s])
+        return found
+
+    def scan(self, messages):
+        """Return {position: [terms]} for every message (by position) with at least one hit."""
+        hits = {}
+        no_match = lambda _: None
+        phrase_search = self._phrase_re.search if self._phrase_re is not None else no_match
+        single_search = self._single_re.search if self._single_re is not None else no_match
+        for i, message in enumerate(messages):
+            msg_lower = str(message).lower()
+            if phrase_search(msg_lower) or single_search(msg_lower):
+                words = self.triggers(msg_lower)
+                if words:
+                    hits[i] = words
+        return hits
+
+
+def get_scanner(path=BAD_WORDS_PATH):
+    """The compiled scanner for the current bad_words.txt, or None if there are no terms."""
+    global _scanner, _scanner_stat
+    try:
+        st = os.stat(path)
+        stat = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        stat = None
+    with _scanner_lock:
+        if _scanner is None or stat != _scanner_stat:
+            _scanner = ToxicityScanner(load_bad_words(path))
+            _scanner_stat = stat
+        scanner = _scanner
+    return scanner if scanner.terms else None
+
+
+def user_scores(df, hits, user_order=None):
+    """Per-user toxicity entries from scan() hits over ``df`` (positions into df).
+
+    Each user's count is the number of matched terms; the most toxic user scores 10.0
+    and the others scale as 1 + (count / max_count) * 9. Users keep their order of
+    first appearance in ``df`` (or ``user_order``) before the stable sort by score.
+    """
+    if not hits:
+        return []
+    positions = sorted(hits)
+    flagged = df.iloc[positions]  # only the flagged rows are materialized
+
+    by_user = {}
+    for pos, user, date, message in zip(positions, flagged['user'].tolist(), flagged['date'].tolist(),
+                                         flagged['message'].tolist()):
+        words = hits[pos]
+        entry = by_user.setdefault(user, {'user': user, 'count': 0, 'messages': []})
+        entry['count'] += len(words)
+        entry['messages'].append({
+            'date': date,
+            'message': message,
+            'words': words
+        })
+
+    order = {u: i for i, u in enumerate(df['user'].unique() if user_order is None else user_order)}
+    toxic_data = sorted(by_user.values(), key=lambda e: order[e['user']])
+
+    # Relative Normalization — most toxic user gets 10.0, others scale proportionally
+    # Example: max=200 words → 10.0 | 100 words → 5.5 | 50 words → 3.25
+    max_count = max(entry['count'] for entry in toxic_data)
+    for entry in toxic_data:
+        entry['score'] = round(1 + (entry['count'] / max_count) * 9, 1)
+
+    # Sort by score descending (most toxic first)
+    return sorted(toxic_data, key=lambda x: x['score'], reverse=True)
+
+
+# ──────────────────────────────────────────────
+#  PRECOMPUTED TOXICITY INDEX (stored with the chat)
+# ──────────────────────────────────────────────
+# Built once per upload as <file_id>.toxicity.parquet: a sparse row id -> matched terms
+# map of the flagged messages only, plus each user's first-appearance order. Any
+# scope's scores are then derived from the flagged rows alone. The index carries the
+# scanner fingerprint, so editing bad_words.txt makes it stale and it is rebuilt.
+INDEX_VERSION = 1
+METADATA_KEY = b"chat_toxicity"
+
+
+def _index_path(folder, file_id):
+    return os.path.join(folder, f"{file_id}.toxicity.parquet")
+
+
+def build_index(df, scanner):
+    """Scan the whole chat once; hits are keyed by df row id (index label)."""
+    hits = scanner.scan(df['message'])
+    labels = df.index.to_numpy()
+    return {
+        'fingerprint': scanner.fingerprint,
+        'hits': {int(labels[pos]): words for pos, words in hits.items()},
+        'user_order': [str(u) for u in df['user'].unique()],
+    }
+
+
+def extend_index(index, tail_df, scanner):
+    """Index of a chat extended by ``tail_df`` (new rows, ids after the indexed ones):
+    only the new messages are scanned."""
+    tail = build_index(tail_df, scanner)
+    known = set(index['user_order'])
+    return {
+        'fingerprint': index['fingerprint'],
+        'hits': {**index['hits'], **tail['hits']},
+        'user_order': index['user_order'] + [u for u in tail['user_order'] if u not in known],
+    }
+
+
+def save_index(index, folder, file_id):
+    path = _index_path(folder, file_id)
+    rows = sorted(index['hits'])
+    table = pa.table({
+        'row': pa.array(rows, type=pa.int64()),
+        'terms': pa.array([index['hits'][r] for r in rows], type=pa.list_(pa.string())),
+    })
+    meta = {"index_version": INDEX_VERSION, "fingerprint": index['fingerprint'], "user_order": index['user_order']}
+    table = table.replace_schema_metadata({METADATA_KEY: json.dumps(meta).encode()})
+    tmp_path = path + ".tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_index(folder, file_id, fingerprint):
+    """Return the stored index, or None if it is missing, old, or built from other bad words."""
+    path = _index_path(folder, file_id)
+    if not os.path.exists(path):
+        return None
+    try:
+        table = pq.read_table(path)
+        meta = json.loads((table.schema.metadata or {}).get(METADATA_KEY, b"{}"))
+    except Exception as e:
+        print(f"[Toxicity] Failed to read {path}: {e}")
+        return None
+    if meta.get("index_version") != INDEX_VERSION or meta.get("fingerprint") != fingerprint:
+        print(f"[Toxicity] STALE index for {file_id} (bad_words.txt or index format changed)")
+        return None
+    columns = table.to_pydict()
+    return {
+        'fingerprint': meta['fingerprint'],
+        'hits': dict(zip(columns['row'], columns['terms'])),
+        'user_order': meta['user_order'],
+    }
+
+
+def scope_scores(df, index, selected_user):
+    """Per-user toxicity scores for ``selected_user`` from the precomputed index, touching flagged rows only."""
+    if not index['hits']:
+        return []
+    rows = list(index['hits'])
+    positions = df.index.get_indexer(rows)
+    found = positions >= 0
+    rows = [r for r, ok in zip(rows, found) if ok]
+    positions = positions[found]
+    if selected_user != 'Overall':
+        in_scope = (df['user'].iloc[positions] == selected_user).to_numpy()
+        rows = [r for r, ok in zip(rows, in_scope) if ok]
+        positions = positions[in_scope]
+    hits = {int(pos): index['hits'][row] for row, pos in zip(rows, positions)}
+    return user_scores(df, hits, user_order=index['user_order'])
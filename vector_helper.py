@@ -3,12 +3,62 @@ import chromadb.utils.embedding_functions as embedding_functions
 import os
 import pandas as pd
 import re
+import threading
+
+import embeddings
+import local_vectors
+
+# "gemini" (default, needs GEMINI_API_KEY), "http" (OpenAI-compatible EMBEDDING_URL)
+# or "hash" (local deterministic stub, no API)
+EMBEDDING_FUNCTION = os.environ.get("EMBEDDING_FUNCTION", "gemini")
+# "auto" (Chroma when it starts and embeddings are configured, else the local index),
+# "chroma" or "local"
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "auto")
+# Messages written to Chroma per add() call
+CHROMA_ADD_BATCH = 1000
+
+def chat_documents(df):
+    """(documents, metadatas, ids) of the chat messages worth indexing."""
+    documents = []
+    metadatas = []
+    ids = []
+
+    # Process each message as a document
+    # Embed "user: text" so queries like "what did X say about …" match better
+    for i, row in df.iterrows():
+        user = str(row['user']).strip()
+        if user == "group_notification":
+            continue
+        msg = str(row['message']).strip()
+        if msg and len(msg) > 1 and msg != '<Media omitted>':
+            documents.append(f"{user}: {msg}")
+            metadatas.append({
+                "user": user,
+                "date": str(row['date'])
+            })
+            ids.append(f"msg_{i}")
+    return documents, metadatas, ids
+
+
+def scope_of(user_filter):
+    """The selected dashboard user as a search filter, or None for the whole chat."""
+    if user_filter and str(user_filter).strip() and str(user_filter).strip() != "Overall":
+        return str(user_filter).strip()
+    return None
+
 
 class VectorStore:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, embedding_function=None, cache=None):
+        """``embedding_function`` overrides the EMBEDDING_FUNCTION choice (any Chroma
+        embedding function); ``cache`` defaults to the shared on-disk embedding cache."""
         self.api_key = api_key or os.environ.get("GEMINI_API_KEY")
         self.client = None
         self.ef = None
+        self.cache = cache if cache is not None else embeddings.EmbeddingCache()
+        # Live indexing progress per collection, and one indexing run per collection at a time
+        self._progress = {}
+        self._locks = {}
+        self._locks_guard = threading.Lock()
         
         try:
             # Ensure chroma_db directory exists
@@ -20,11 +70,20 @@ class VectorStore:
             print("✅ ChromaDB: Persistent client initialized at chroma_db/")
         except Exception as e:
             print(f"❌ ChromaDB: Failed to initialize persistent client: {e}")
-            print("⚠️ Vector search will be disabled.")
-            return
+            print("⚠️ ChromaDB search will be disabled.")
         
+        if embedding_function is not None:
+            self.ef = embedding_function
+            print(f"✅ ChromaDB: Using embedding function {embeddings.model_key(self.ef)}.")
+        elif EMBEDDING_FUNCTION == "hash":
+            self.ef = embeddings.HashEmbeddingFunction()
+            print("✅ ChromaDB: Using the local hash embedding function (EMBEDDING_FUNCTION=hash).")
+        elif EMBEDDING_FUNCTION == "http":
+            self.ef = embeddings.HttpEmbeddingFunction(os.environ.get("EMBEDDING_URL", "http://localhost:8001/v1/embeddings"),
+                                                       os.environ.get("EMBEDDING_MODEL", ""))
+            print(f"✅ ChromaDB: Using the HTTP embedding endpoint {self.ef.url}.")
         # Setup Google Gemini Embedding Function
-        if self.api_key:
+        elif self.api_key:
             try:
                 os.environ["GEMINI_API_KEY"] = self.api_key
                 self.ef = embedding_functions.GoogleGeminiEmbeddingFunction(
@@ -35,7 +94,7 @@ class VectorStore:
                 print(f"❌ ChromaDB: Error initializing embedding function: {e}")
                 self.ef = None
         else:
-            print("⚠️ ChromaDB: GEMINI_API_KEY missing. Vector search will not work.")
+            print("⚠️ ChromaDB: GEMINI_API_KEY missing. ChromaDB search will not work.")
 
     def _sanitize_name(self, name):
         """Sanitize collection name for ChromaDB requirements."""
@@ -45,93 +104,252 @@ class VectorStore:
         if len(name) > 63: name = name[:63]
         return name
 
-    def index_chat(self, df, collection_name="whatsapp_chat"):
-        """Index the chat messages into ChromaDB."""
-        if not self.ef:
+    def count(self, collection_name="whatsapp_chat"):
+        """Number of indexed messages in a collection (0 if it doesn't exist)."""
+        if not self.client:
+            return 0
+        try:
+            return self.client.get_collection(name=self._sanitize_name(collection_name)).count()
+        except Exception:
+            return 0
+
+    def _lock_for(self, collection_name):
+        with self._locks_guard:
+            return self._locks.setdefault(collection_name, threading.Lock())
+
+    def index_chat(self, df, collection_name="whatsapp_chat", append=False):
+        """Index the chat messages into ChromaDB.
+
+        With ``append=True`` the rows of ``df`` (new messages of an already indexed
+        chat, with new row ids) are added to the existing collection instead of
+        replacing it, so only they are embedded.
+
+        The collection's metadata is the checkpoint: it records the source name, the
+        message count and whether indexing completed. Re-indexing the same messages
+        into an incomplete collection (or appending) only adds the ids it is missing,
+        so an interrupted run picks up where it stopped.
+        """
+        if not self.client or not self.ef:
             return False
-            
+
+        source = collection_name
         collection_name = self._sanitize_name(collection_name)
-            
-        # Clear old collection if it exists to avoid mixing chats or duplicate data
-        try:
-            self.client.delete_collection(name=collection_name)
-            print(f"🗑️ ChromaDB: Deleted existing collection: {collection_name}")
-        except:
-            pass
-            
-        collection = self.client.create_collection(
-            name=collection_name, 
-            embedding_function=self.ef
-        )
-        
-        documents = []
-        metadatas = []
-        ids = []
-        
-        # Process each message as a document
-        # Embed "user: text" so queries like "what did X say about …" match better
-        for i, row in df.iterrows():
-            user = str(row['user']).strip()
-            if user == "group_notification":
-                continue
-            msg = str(row['message']).strip()
-            if msg and len(msg) > 1 and msg != '<Media omitted>':
-                documents.append(f"{user}: {msg}")
-                metadatas.append({
-                    "user": user,
-                    "date": str(row['date'])
-                })
-                ids.append(f"msg_{i}")
-        
+        documents, metadatas, ids = chat_documents(df)
         if not documents:
             print("⚠️ ChromaDB: No valid messages found to index.")
             return False
 
-        # Add to collection in batches to avoid API/Memory limits
-        batch_size = 100 
-        for i in range(0, len(documents), batch_size):
-            collection.add(
-                documents=documents[i:i+batch_size],
-                metadatas=metadatas[i:i+batch_size],
-                ids=ids[i:i+batch_size]
-            )
-        
-        print(f"✅ ChromaDB: Indexed {len(documents)} messages into collection: {collection_name}")
+        with self._lock_for(collection_name):
+            fingerprint = embeddings.text_hash("\n".join(ids) + "\n" + "\n".join(documents)).hex()
+            collection = None
+            try:
+                collection = self.client.get_collection(name=collection_name, embedding_function=self.ef)
+            except Exception:
+                pass
+            checkpoint = (collection.metadata or {}) if collection is not None else {}
+
+            if append and collection is not None:
+                total = None
+            elif collection is not None and checkpoint.get("fingerprint") == fingerprint:
+                if not checkpoint.get("complete"):
+                    print(f"🔁 ChromaDB: Resuming indexing of {collection_name}")
+                total = len(ids)
+            else:
+                # Clear old collection if it exists to avoid mixing chats or duplicate data
+                try:
+                    self.client.delete_collection(name=collection_name)
+                    print(f"🗑️ ChromaDB: Deleted existing collection: {collection_name}")
+                except:
+                    pass
+                collection = self.client.create_collection(name=collection_name, embedding_function=self.ef)
+                total = len(ids)
+            # Messages already in the collection (from an interrupted run) are skipped
+            done = set()
+            for i in range(0, len(ids), CHROMA_ADD_BATCH):
+                done.update(collection.get(ids=ids[i:i + CHROMA_ADD_BATCH], include=[])["ids"])
+            todo = [i for i, doc_id in enumerate(ids) if doc_id not in done]
+            if total is None:
+                total = collection.count() + len(todo)
+            checkpoint = {"source": source, "fingerprint": fingerprint, "total": total, "complete": False}
+            collection.modify(metadata=checkpoint)
+            progress = self._progress[collection_name] = {
+                "status": "indexing", "indexed": total - len(todo), "total": total}
+
+            def add(positions, vectors):
+                for i in range(0, len(positions), CHROMA_ADD_BATCH):
+                    part = [todo[p] for p in positions[i:i + CHROMA_ADD_BATCH]]
+                    collection.add(
+                        documents=[documents[j] for j in part],
+                        embeddings=vectors[i:i + CHROMA_ADD_BATCH],
+                        metadatas=[metadatas[j] for j in part],
+                        ids=[ids[j] for j in part]
+                    )
+                    progress["indexed"] += len(part)
+
+            try:
+                # Cached vectors are written first; misses are embedded concurrently and
+                # written batch by batch as they arrive
+                embeddings.EmbeddingBatcher(self.ef, self.cache).embed([documents[i] for i in todo], on_batch=add)
+            except Exception:
+                progress["status"] = "error"
+                raise
+            collection.modify(metadata={**checkpoint, "complete": True})
+            progress["status"] = "done"
+
+        action = "Appended" if append else "Indexed"
+        print(f"✅ ChromaDB: {action} {len(todo)} messages into collection: {collection_name} "
+              f"({progress['indexed']}/{total} indexed)")
         return True
 
-    def search_chat(self, query, collection_name="whatsapp_chat", n_results=18, user_filter=None):
-        """Semantic search; optional Chroma metadata filter when a single user is selected."""
-        if not self.ef:
-            return "Error: Embedding function not initialized."
+    def index_status(self, collection_name="whatsapp_chat"):
+        """{"status", "indexed", "total"} for a collection, or None if it was never indexed.
 
+        status is indexing/done/error for runs in this process, and done or
+        interrupted for collections from earlier runs.
+        """
         collection_name = self._sanitize_name(collection_name)
-        where = None
-        if user_filter and str(user_filter).strip() and str(user_filter).strip() != "Overall":
-            where = {"user": str(user_filter).strip()}
+        if collection_name in self._progress:
+            return dict(self._progress[collection_name])
+        if not self.client:
+            return None
+        try:
+            collection = self.client.get_collection(name=collection_name)
+        except Exception:
+            return None
+        checkpoint = collection.metadata or {}
+        count = collection.count()
+        complete = checkpoint.get("complete", True)
+        return {"status": "done" if complete else "interrupted", "indexed": count,
+                "total": int(checkpoint.get("total") or count)}
 
+    def interrupted(self):
+        """Source names of collections whose indexing never completed (e.g. the app was
+        stopped mid-index) and that aren't being indexed right now."""
+        if not self.client:
+            return []
+        names = []
+        for collection in self.client.list_collections():
+            checkpoint = collection.metadata or {}
+            if checkpoint.get("complete") is False and collection.name not in self._progress:
+                names.append(checkpoint.get("source", collection.name))
+        return names
+
+    def search(self, query, collection_name="whatsapp_chat", n_results=18, user_filter=None):
+        """Semantic search hits, best first: [{"id", "date", "document", "score"}].
+
+        ``user_filter`` (a dashboard user; 'Overall' = everyone) becomes a Chroma
+        metadata filter. Returns [] when nothing is indexed or the search fails.
+        """
+        if not self.client or not self.ef:
+            return []
+        user_filter = scope_of(user_filter)
         try:
-            collection = self.client.get_collection(name=collection_name, embedding_function=self.ef)
+            collection = self.client.get_collection(name=self._sanitize_name(collection_name), embedding_function=self.ef)
             cnt = collection.count()
             if cnt == 0:
-                return "(No messages indexed in Chroma for this upload.)"
-            n_q = min(n_results, cnt)
-            kwargs = {"query_texts": [query], "n_results": max(1, n_q)}
-            if where:
-                kwargs["where"] = where
+                return []
+            query_vector = embeddings.embed([query], self.ef, self.cache, query=True)
+            kwargs = {"query_embeddings": query_vector, "n_results": max(1, min(n_results, cnt))}
+            if user_filter:
+                kwargs["where"] = {"user": user_filter}
             results = collection.query(**kwargs)
+        except Exception as e:
+            print(f"❌ ChromaDB: Search Error: {e}")
+            return []
+        if not results or not results.get("documents") or not results["documents"][0]:
+            return []
+        return [{"id": doc_id, "date": meta['date'], "document": doc, "score": 1.0 - float(distance)}
+                for doc_id, doc, meta, distance in zip(results["ids"][0], results["documents"][0],
+                                                       results["metadatas"][0], results["distances"][0])]
+
+
+class LocalVectorStore(VectorStore):
+    """VectorStore backed by local_vectors instead of ChromaDB: no server and, with the
+    default hash embeddings, no API key, so semantic search keeps working offline."""
+
+    def __init__(self, embedding_function=None, cache=None, folder=local_vectors.VECTOR_FOLDER):
+        self.client = None
+        self.ef = embedding_function or embeddings.HashEmbeddingFunction()
+        self.cache = cache if cache is not None else embeddings.EmbeddingCache()
+        self.folder = folder
+        self._progress = {}
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        print(f"✅ Local vector index at {folder}/ using {embeddings.model_key(self.ef)}.")
+
+    def count(self, collection_name="whatsapp_chat"):
+        index = local_vectors.load(self._sanitize_name(collection_name), self.folder)
+        return len(index) if index is not None else 0
 
-            formatted_context = []
-            if results and results.get("documents") and results["documents"][0]:
-                for i in range(len(results["documents"][0])):
-                    doc = results["documents"][0][i]
-                    meta = results["metadatas"][0][i]
-                    formatted_context.append(f"[{meta['date']}] {doc}")
+    def index_chat(self, df, collection_name="whatsapp_chat", append=False):
+        """Embed the chat's messages and store them as a local index (``append`` adds
+        the rows of ``df`` that aren't indexed yet)."""
+        collection_name = self._sanitize_name(collection_name)
+        documents, metadatas, ids = chat_documents(df)
+        if not documents:
+            print("⚠️ Local index: No valid messages found to index.")
+            return False
+
+        with self._lock_for(collection_name):
+            model = embeddings.model_key(self.ef)
+            existing = local_vectors.load(collection_name, self.folder) if append else None
+            if existing is not None and existing.meta.get('model') == model:
+                known = set(existing.ids)
+                keep = [i for i, doc_id in enumerate(ids) if doc_id not in known]
+                documents = [documents[i] for i in keep]
+                metadatas = [metadatas[i] for i in keep]
+                ids = [ids[i] for i in keep]
+            else:
+                existing = None
+            base = len(existing) if existing is not None else 0
+            progress = self._progress[collection_name] = {
+                "status": "indexing", "indexed": base, "total": base + len(ids)}
+            try:
+                vectors = embeddings.EmbeddingBatcher(self.ef, self.cache).embed(documents)
+                if len(ids) or existing is None:
+                    local_vectors.write(collection_name, vectors, ids, documents, [m["user"] for m in metadatas],
+                                        [m["date"] for m in metadatas], model, append=existing is not None,
+                                        folder=self.folder)
+            except Exception:
+                progress["status"] = "error"
+                raise
+            progress.update(status="done", indexed=progress["total"])
+
+        action = "Appended" if append else "Indexed"
+        print(f"✅ Local index: {action} {len(ids)} messages into {collection_name} ({progress['total']} total)")
+        return True
+
+    def index_status(self, collection_name="whatsapp_chat"):
+        collection_name = self._sanitize_name(collection_name)
+        if collection_name in self._progress:
+            return dict(self._progress[collection_name])
+        count = self.count(collection_name)
+        return {"status": "done", "indexed": count, "total": count} if count else None
 
-            if not formatted_context:
-                scope = f" for user \"{user_filter}\"" if where else ""
-                return f"(No matching chat lines found in semantic search{scope}.)"
+    def interrupted(self):
+        # Indexes are written whole, so there is never a partial one to resume
+        return []
 
-            return "\n".join(formatted_context)
+    def search(self, query, collection_name="whatsapp_chat", n_results=18, user_filter=None):
+        index = local_vectors.load(self._sanitize_name(collection_name), self.folder)
+        if index is None or not len(index):
+            return []
+        try:
+            query_vector = embeddings.embed([query], self.ef, self.cache, query=True)
+            hits = index.search(query_vector, n_results, user=scope_of(user_filter))[0]
         except Exception as e:
-            print(f"❌ ChromaDB: Search Error: {e}")
-            return ""
+            print(f"❌ Local index: Search Error: {e}")
+            return []
+        return [{"id": index.ids[row], "date": index.dates[row], "document": index.documents[row], "score": score}
+                for row, score in hits]
+
+def create_vector_store():
+    """ChromaDB-backed VectorStore, or the local index when Chroma can't start, no
+    embedding function is configured, or VECTOR_BACKEND=local."""
+    if VECTOR_BACKEND != "local":
+        store = VectorStore()
+        if VECTOR_BACKEND == "chroma" or (store.client and store.ef):
+            return store
+        print("⚠️ ChromaDB semantic search unavailable; using the local vector index instead.")
+        return LocalVectorStore(embedding_function=store.ef)
+    return LocalVectorStore()